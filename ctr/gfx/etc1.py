@@ -0,0 +1,301 @@
+
+"""ETC1 and ETC1A4 texture compression
+
+Textures are made of 4x4 blocks. Each block is a little-endian 64-bit
+word holding two base colors, one per half of the block, a modifier table
+for each half and a 2-bit modifier selector for each texel. ETC1A4 blocks
+are preceded by 64 bits of 4-bit alpha values.
+
+Blocks are stored in 8x8 tiles of 2x2 blocks in Morton order, with the
+tiles in row order, which is the tiled swizzle of the block grid with a
+tile size of 2. All blocks of one or more textures are decoded at once.
+"""
+
+import numpy as np
+from PIL import Image
+
+from ctr.gfx import swizzle
+
+FORMAT_ETC1 = 0xC
+FORMAT_ETC1A4 = 0xD
+
+BLOCK_SIZE = {
+    FORMAT_ETC1: 8,
+    FORMAT_ETC1A4: 16,
+}
+
+# Modifiers of each table for selectors 0 to 3
+MODIFIERS = np.array([
+    [2, 8, -2, -8],
+    [5, 17, -5, -17],
+    [9, 29, -9, -29],
+    [13, 42, -13, -42],
+    [18, 60, -18, -60],
+    [24, 80, -24, -80],
+    [33, 106, -33, -106],
+    [47, 183, -47, -183],
+], dtype=np.int32)
+
+# Texel i of a block is at (x, y) = divmod(i, 4)
+_TEXEL_SHIFTS = np.arange(16, dtype=np.int64).reshape(4, 4).T
+# Bit offsets of the red, green and blue fields in the upper word
+_CHANNEL_SHIFTS = (24, 16, 8)
+
+
+def texel_data(data, ofs, format, width, height):
+    """Get the blocks of a texture, padded with zeros if truncated
+
+    Returns
+    -------
+    blocks : np.ndarray
+        (blocks, block size) uint8 array in stored order
+    """
+    block_size = BLOCK_SIZE[format]
+    count = (width >> 2)*(height >> 2)
+    blocks = np.zeros(count*block_size, dtype=np.uint8)
+    chunk = np.frombuffer(data[ofs:ofs+count*block_size], dtype=np.uint8)
+    blocks[:len(chunk)] = chunk
+    return blocks.reshape(count, block_size)
+
+
+def _subblocks(flip):
+    """Get which half of a block each (y, x) texel is in
+
+    Parameters
+    ----------
+    flip : np.ndarray
+        (N, ) flip bits. If set, the halves are the top and bottom rows,
+        otherwise the left and right columns
+
+    Returns
+    -------
+    second : np.ndarray
+        (N, 4, 4) bool array, set for the second half
+    """
+    y, x = np.mgrid[:4, :4]
+    return np.where(np.asarray(flip, dtype=bool)[:, None, None],
+                    y >= 2, x >= 2)
+
+
+def decode_blocks(colors, alpha=None):
+    """Decode ETC1 blocks
+
+    Parameters
+    ----------
+    colors : np.ndarray
+        (N, 8) uint8 color blocks
+    alpha : np.ndarray or None
+        (N, 8) uint8 alpha blocks. If None, blocks are opaque
+
+    Returns
+    -------
+    rgba : np.ndarray
+        (N, 4, 4, 4) uint8 texels indexed by block, y and x
+    """
+    words = np.ascontiguousarray(colors, dtype=np.uint8).view('<u4')\
+        .astype(np.int64)
+    lo = words[:, 0]
+    hi = words[:, 1]
+    num = len(words)
+    diff = (hi >> 1) & 1 != 0
+    base = np.empty((num, 2, 3), dtype=np.int32)
+    for channel, shift in enumerate(_CHANNEL_SHIFTS):
+        first = (hi >> (shift+3)) & 0x1F
+        delta = (hi >> shift) & 0x7
+        delta -= (delta & 0x4) << 1
+        second = np.clip(first+delta, 0, 0x1F)
+        base[:, 0, channel] = np.where(diff, (first << 3) | (first >> 2),
+                                       ((hi >> (shift+4)) & 0xF)*17)
+        base[:, 1, channel] = np.where(diff, (second << 3) | (second >> 2),
+                                       ((hi >> shift) & 0xF)*17)
+    second = _subblocks(hi & 1)
+    tables = np.where(second, ((hi >> 2) & 0x7)[:, None, None],
+                      ((hi >> 5) & 0x7)[:, None, None])
+    selectors = (((lo[:, None, None] >> _TEXEL_SHIFTS) & 1) |
+                 (((lo[:, None, None] >> (_TEXEL_SHIFTS+16)) & 1) << 1))
+    base = np.where(second[..., None], base[:, None, None, 1],
+                    base[:, None, None, 0])
+    rgba = np.empty((num, 4, 4, 4), dtype=np.uint8)
+    rgba[..., :3] = np.clip(base+MODIFIERS[tables, selectors][..., None],
+                            0, 255)
+    if alpha is None:
+        rgba[..., 3] = 255
+    else:
+        alpha = np.ascontiguousarray(alpha, dtype=np.uint8)
+        # Texel i is the nibble at bit 4*i
+        nibbles = np.stack([alpha & 0xF, alpha >> 4], -1).reshape(num, 4, 4)
+        rgba[..., 3] = nibbles.transpose(0, 2, 1)*np.uint8(17)
+    return rgba
+
+
+def encode_blocks(rgba):
+    """Encode ETC1 blocks
+
+    Both ways of splitting each block are tried. Halves use differential
+    colors when they are close enough and individual colors otherwise,
+    with the table that fits the texels best.
+
+    Parameters
+    ----------
+    rgba : np.ndarray
+        (N, 4, 4, 4) texels indexed by block, y and x
+
+    Returns
+    -------
+    colors : np.ndarray
+        (N, 8) uint8 color blocks
+    alpha : np.ndarray
+        (N, 8) uint8 alpha blocks
+    """
+    rgba = np.asarray(rgba, dtype=np.uint8)
+    pixels = rgba[..., :3].astype(np.int32)
+    num = len(pixels)
+    best_error = np.full(num, np.iinfo(np.int64).max, dtype=np.int64)
+    best = {}
+    y, x = np.mgrid[:4, :4]
+    for flip in (0, 1):
+        second = (y if flip else x) >= 2
+        avg = np.stack([pixels[:, ~second].mean(1),
+                        pixels[:, second].mean(1)], 1)
+        q5 = np.clip(np.rint(avg*31/255.), 0, 31).astype(np.int64)
+        delta = q5[:, 1]-q5[:, 0]
+        diff = ((delta >= -4) & (delta <= 3)).all(1)
+        q4 = np.clip(np.rint(avg*15/255.), 0, 15).astype(np.int64)
+        base = np.where(diff[:, None, None], (q5 << 3) | (q5 >> 2), q4*17)
+        error = np.zeros(num, dtype=np.int64)
+        tables = np.zeros((num, 2), dtype=np.int64)
+        selectors = np.zeros((num, 4, 4), dtype=np.int64)
+        for half, mask in enumerate((~second, second)):
+            half_pixels = pixels[:, mask]
+            half_error = np.full(num, np.iinfo(np.int64).max, dtype=np.int64)
+            half_selectors = np.zeros(half_pixels.shape[:2], dtype=np.int64)
+            for table, modifiers in enumerate(MODIFIERS):
+                candidates = np.clip(base[:, half, None, :] +
+                                     modifiers[:, None], 0, 255)
+                distance = ((half_pixels[:, :, None, :] -
+                             candidates[:, None, :, :])**2).sum(-1)
+                table_error = distance.min(2).sum(1)
+                better = table_error < half_error
+                half_error[better] = table_error[better]
+                tables[better, half] = table
+                half_selectors[better] = distance[better].argmin(2)
+            error += half_error
+            selectors[:, mask] = half_selectors
+        better = error < best_error
+        best_error[better] = error[better]
+        for name, value in (('flip', np.full(num, flip)), ('diff', diff),
+                            ('q5', q5), ('delta', delta), ('q4', q4),
+                            ('tables', tables), ('selectors', selectors)):
+            if name in best:
+                best[name][better] = value[better]
+            else:
+                best[name] = value.copy()
+    diff = best['diff']
+    hi = (best['tables'][:, 0] << 5) | (best['tables'][:, 1] << 2) | \
+        (diff.astype(np.int64) << 1) | best['flip']
+    for channel, shift in enumerate(_CHANNEL_SHIFTS):
+        hi |= np.where(diff,
+                       (best['q5'][:, 0, channel] << (shift+3)) |
+                       ((best['delta'][:, channel] & 0x7) << shift),
+                       (best['q4'][:, 0, channel] << (shift+4)) |
+                       (best['q4'][:, 1, channel] << shift))
+    selectors = best['selectors']
+    lo = (((selectors & 1) << _TEXEL_SHIFTS) |
+          ((selectors >> 1) << (_TEXEL_SHIFTS+16))).reshape(num, 16).sum(1)
+    colors = np.stack([lo, hi], -1).astype('<u4').view(np.uint8)
+    nibbles = (rgba[..., 3].astype(np.int32)*15+127)//255
+    nibbles = nibbles.transpose(0, 2, 1).reshape(num, 8, 2)
+    alpha = (nibbles[..., 0] | (nibbles[..., 1] << 4)).astype(np.uint8)
+    return colors.reshape(num, 8), alpha
+
+
+def decode_batch(textures):
+    """Decode several textures with one pass over all of their blocks
+
+    Parameters
+    ----------
+    textures : iterable of tuple
+        (data, ofs, format, width, height) of each texture, as for decode
+
+    Returns
+    -------
+    images : list of np.ndarray
+        (height, width, 4) uint8 RGBA array of each texture
+    """
+    textures = list(textures)
+    colors = []
+    alpha = []
+    for data, ofs, format, width, height in textures:
+        blocks = texel_data(data, ofs, format, width, height)
+        colors.append(blocks[:, -8:])
+        if format == FORMAT_ETC1A4:
+            alpha.append(blocks[:, :8])
+        else:
+            alpha.append(np.full((len(blocks), 8), 0xFF, dtype=np.uint8))
+    if not textures:
+        return []
+    rgba = decode_blocks(np.concatenate(colors), np.concatenate(alpha))
+    images = []
+    start = 0
+    for data, ofs, format, width, height in textures:
+        count = (width >> 2)*(height >> 2)
+        blocks = swizzle.deswizzle(rgba[start:start+count], width >> 2,
+                                   height >> 2, 2)
+        images.append(blocks.transpose(0, 2, 1, 3, 4)
+                      .reshape(height, width, 4))
+        start += count
+    return images
+
+
+def decode(data, ofs, format, width, height):
+    """Decode a texture
+
+    Parameters
+    ----------
+    data : string
+        Texture data block
+    ofs : int
+        Offset of the texture in data
+    format : int
+        FORMAT_ETC1 or FORMAT_ETC1A4
+    width : int
+    height : int
+        Multiples of 8
+
+    Returns
+    -------
+    rgba : np.ndarray
+        (height, width, 4) uint8 array
+    """
+    return decode_batch([(data, ofs, format, width, height)])[0]
+
+
+def encode(rgba, format=FORMAT_ETC1):
+    """Encode a texture
+
+    Parameters
+    ----------
+    rgba : array-like
+        (height, width, 4) array or RGBA PIL Image. Sizes are multiples
+        of 8
+    format : int
+        FORMAT_ETC1 or FORMAT_ETC1A4
+
+    Returns
+    -------
+    data : string
+        Texture data
+    """
+    rgba = np.asarray(rgba, dtype=np.uint8)
+    height, width = rgba.shape[:2]
+    blocks = rgba.reshape(height >> 2, 4, width >> 2, 4, 4)\
+        .transpose(0, 2, 1, 3, 4)
+    colors, alpha = encode_blocks(swizzle.swizzle(blocks, 2))
+    if format == FORMAT_ETC1A4:
+        colors = np.concatenate([alpha, colors], 1)
+    return colors.tostring()
+
+
+def get_image(data, ofs, format, width, height):
+    """Decode a texture to an RGBA PIL Image"""
+    return Image.fromarray(decode(data, ofs, format, width, height), 'RGBA')
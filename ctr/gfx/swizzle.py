@@ -0,0 +1,146 @@
+
+"""Morton (Z-order) swizzling of textures
+
+Positions along a Morton curve interleave the bits of x (even bits) and y
+(odd bits). Bits are spread and gathered a byte at a time through lookup
+tables, and the order of a whole texture is computed once per size, so
+swizzling is a single gather of the texel array.
+
+CTR textures are stored as 8x8 tiles in row order with the texels of each
+tile in Morton order.
+"""
+
+import numpy as np
+
+TILE_SIZE = 8
+
+# Byte values with their bits moved to the even bits of a uint16
+_SPREAD = np.zeros(256, dtype=np.uint32)
+for _bit in xrange(8):
+    _SPREAD |= ((np.arange(256, dtype=np.uint32) >> _bit) & 1) << (_bit*2)
+# Even bits of a byte gathered into a nibble
+_COMPACT = np.zeros(256, dtype=np.uint32)
+for _bit in xrange(4):
+    _COMPACT |= ((np.arange(256, dtype=np.uint32) >> (_bit*2)) & 1) << _bit
+del _bit
+
+_orders = {}
+
+
+def morton(x, y):
+    """Get the Morton positions of coordinates below 0x10000
+
+    Parameters
+    ----------
+    x : int or array-like
+    y : int or array-like
+
+    Returns
+    -------
+    pos : np.ndarray
+        uint32 positions
+    """
+    x = np.asarray(x, dtype=np.uint32)
+    y = np.asarray(y, dtype=np.uint32)
+    return (_SPREAD[x & 0xFF] | (_SPREAD[(x >> 8) & 0xFF] << np.uint32(16)) |
+            (_SPREAD[y & 0xFF] << np.uint32(1)) |
+            (_SPREAD[(y >> 8) & 0xFF] << np.uint32(17)))
+
+
+def unmorton(pos):
+    """Get the coordinates of Morton positions
+
+    Parameters
+    ----------
+    pos : int or array-like
+
+    Returns
+    -------
+    x, y : np.ndarray
+        uint32 coordinates
+    """
+    pos = np.asarray(pos, dtype=np.uint32)
+    x = np.zeros(pos.shape, dtype=np.uint32)
+    y = np.zeros(pos.shape, dtype=np.uint32)
+    for shift in xrange(0, 32, 8):
+        chunk = (pos >> np.uint32(shift)) & np.uint32(0xFF)
+        x |= _COMPACT[chunk] << np.uint32(shift >> 1)
+        y |= _COMPACT[chunk >> np.uint32(1)] << np.uint32(shift >> 1)
+    return x, y
+
+
+def swizzle_order(width, height, tile=TILE_SIZE):
+    """Get where each texel of an image is stored
+
+    Parameters
+    ----------
+    width : int
+    height : int
+        Multiples of tile
+    tile : int or None
+        Size of the square tiles stored in row order. If None, the whole
+        image is a single Morton curve
+
+    Returns
+    -------
+    order : np.ndarray
+        (height, width) read-only array of positions in the swizzled data
+    """
+    key = (width, height, tile)
+    try:
+        return _orders[key]
+    except KeyError:
+        pass
+    y, x = np.mgrid[:height, :width].astype(np.uint32)
+    if tile is None:
+        order = morton(x, y)
+    else:
+        tile_id = (y//tile)*(width//tile)+x//tile
+        order = tile_id*(tile*tile)+morton(x % tile, y % tile)
+    order = order.astype(np.intp)
+    order.flags.writeable = False
+    _orders[key] = order
+    return order
+
+
+def deswizzle(values, width, height, tile=TILE_SIZE):
+    """Arrange swizzled values as an image
+
+    Parameters
+    ----------
+    values : array-like
+        (width*height, ...) values in stored order
+    width : int
+    height : int
+    tile : int or None
+        See swizzle_order
+
+    Returns
+    -------
+    image : np.ndarray
+        (height, width, ...) array
+    """
+    return np.asarray(values)[swizzle_order(width, height, tile)]
+
+
+def swizzle(image, tile=TILE_SIZE):
+    """Store an image in swizzled order
+
+    Parameters
+    ----------
+    image : array-like
+        (height, width, ...) array
+    tile : int or None
+        See swizzle_order
+
+    Returns
+    -------
+    values : np.ndarray
+        (width*height, ...) values in stored order
+    """
+    image = np.asarray(image)
+    height, width = image.shape[:2]
+    values = np.empty((width*height, )+image.shape[2:], dtype=image.dtype)
+    values[swizzle_order(width, height, tile)] = image
+    return values
+
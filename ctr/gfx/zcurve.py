@@ -1,26 +1,29 @@
 
+from ctr.gfx import swizzle
+
 
 class ZCurve(object):
+    """Values laid out along a single Morton curve
+
+    Values are appended in curve order and iterated row by row. The size is
+    that of the smallest box holding every appended position.
+    """
     def __init__(self):
-        self.data = {}  # Sparse (x, y)=>val
-        self.pos = 0
+        self.values = []
+
+    @property
+    def pos(self):
+        return len(self.values)
 
     def to_2d(self, ofs=0):
-        x = 0
-        y = 0
-        shift = 0
-        pos = self.pos+ofs
-        while pos:
-            x |= (pos & 0x1) << shift
-            pos >>= 1
-            y |= (pos & 0x1) << shift
-            pos >>= 1
-            shift += 1
-        return (x, y)
+        x, y = swizzle.unmorton(self.pos+ofs)
+        return (int(x), int(y))
 
     def append(self, val):
-        self.data[self.to_2d()] = val
-        self.pos += 1
+        self.values.append(val)
+
+    def extend(self, values):
+        self.values.extend(values)
 
     @property
     def height(self):
@@ -32,11 +35,18 @@ class ZCurve(object):
         w, h = self.to_2d(-1)
         return w+1
 
+    def order(self):
+        """Get the (height, width) array of value indexes"""
+        return swizzle.swizzle_order(self.width, self.height, None)
+
+    def to_array(self):
+        """Get the values as a (height, width, ...) array"""
+        return swizzle.deswizzle(self.values, self.width, self.height, None)
+
     def __iter__(self):
         # Assume w, h are max
-        for y in range(self.height):
-            for x in range(self.width):
-                yield self.data[(x, y)]
+        for idx in self.order().ravel():
+            yield self.values[idx]
 
 
 class ZCurveSkip(ZCurve):
@@ -49,8 +59,18 @@ class ZCurveSkip(ZCurve):
             super(ZCurveSkip, self).append(val)
         self.skip = not self.skip
 
+    def extend(self, values):
+        values = list(values)
+        super(ZCurveSkip, self).extend(values[int(self.skip)::2])
+        if len(values) % 2:
+            self.skip = not self.skip
+
 
 class ZCurveDouble(ZCurve):
     def append(self, val):
         super(ZCurveDouble, self).append(val)
         super(ZCurveDouble, self).append(val)
+
+    def extend(self, values):
+        super(ZCurveDouble, self).extend(
+            val for val in values for repeat in (0, 1))
@@ -51,18 +51,19 @@ class Archive(object):
         handle : File-like or string
             Destination file handle to write to
         """
+        files = self.files
         with zipfile.ZipFile(handle, mode) as archive:
             try:
-                names = self.files.keys()
+                names = files.keys()
             except AttributeError:
-                names = xrange(len(self.files))
+                names = xrange(len(files))
             for name in names:
                 zipinfo = zipfile.ZipInfo(
                     str(name)+self.extension,
                     date_time=time.localtime(time.time())[:6])
                 zipinfo.compress_type = archive.compression
                 zipinfo.external_attr = 33152 << 16
-                archive.writestr(zipinfo, self.files[name])
+                archive.writestr(zipinfo, files[name])
         return handle
 
     def export_dir(self, dir_name):
@@ -77,14 +78,15 @@ class Archive(object):
             os.makedirs(dir_name)
         except:
             pass
+        files = self.files
         try:
-            names = self.files.keys()
+            names = files.keys()
         except AttributeError:
-            names = xrange(len(self.files))
+            names = xrange(len(files))
         for name in names:
             with open(os.path.join(dir_name, str(name)+self.extension), 'w')\
                     as handle:
-                handle.write(self.files[name])
+                handle.write(files[name])
         return dir_name
 
     def import_(self, handle, mode='r'):
@@ -272,7 +272,8 @@ class MainWindow(QMainWindow):
                 translations["error_nonewrom"])
             return
         patchFile = QFileDialog.getSaveFileName(None, "Save Patch File", 
-            filter="xdelta3 Patch Files (*.xdelta3);;All Files (*.*)")
+            filter="BPS Patch Files (*.bps);;IPS Patch Files (*.ips);;"
+            "xdelta3 Patch Files (*.xdelta3);;All Files (*.*)")
         if not patchFile:
             return
         xdelta3.makePatch(patchFile, inrom, outrom)
@@ -27,7 +27,22 @@ def start(ui_type='GUI'):
         raise ValueError('Unsupported UI Type: {0}'.format(ui_type))
 
 if __name__ == '__main__':
-    if '--cli' in sys.argv:
+    if sys.argv[1:2] == ['batch']:
+        import ppre.batch
+        exit(ppre.batch.main(sys.argv[1:]))
+    elif sys.argv[1:2] == ['sprites']:
+        import ppre.sprites
+        exit(ppre.sprites.main(sys.argv[1:]))
+    elif sys.argv[1:2] == ['sounds']:
+        import ppre.sounds
+        exit(ppre.sounds.main(sys.argv[1:]))
+    elif sys.argv[1:2] == ['sequences']:
+        import ppre.sequences
+        exit(ppre.sequences.main(sys.argv[1:]))
+    elif sys.argv[1:2] == ['models']:
+        import ppre.models
+        exit(ppre.models.main(sys.argv[1:]))
+    elif '--cli' in sys.argv:
         start('CLI')
     elif '--api' in sys.argv:
         start('API')
@@ -1,11 +1,57 @@
 
+from cStringIO import StringIO
+import math
+
+import numpy as np
+from PIL import Image
+
 from generic import Editable
+from ntr.g2d import render
 from ntr.g2d.ncer import LABL
+from util import quantize
+from util.colors import bgr555_to_rgba
 
 
 class AnimationElement(Editable):
+    """Cell shown by a frame
+
+    Parameters
+    ----------
+    type : int
+        Element type of the sequence. TYPE_SRT elements have a rotation
+        (0x10000 per turn) and 20.12 fixed point scales. TYPE_SRT and
+        TYPE_TRANSLATION elements move the cell origin by x, y.
+    """
+    TYPE_INDEX = 0
+    TYPE_SRT = 1
+    TYPE_TRANSLATION = 2
+
     def define(self, type):
-        pass
+        self.type = type
+        self.uint16('index')
+        if type == self.TYPE_SRT:
+            self.uint16('rotation')
+            self.int32('scale_x', default=0x1000)
+            self.int32('scale_y', default=0x1000)
+            self.int16('x')
+            self.int16('y')
+        elif type == self.TYPE_TRANSLATION:
+            self.uint16('u2')
+            self.int16('x')
+            self.int16('y')
+
+    @property
+    def offset(self):
+        return (getattr(self, 'x', 0), getattr(self, 'y', 0))
+
+    @property
+    def transform(self):
+        """Get (rotation, scale_x, scale_y), or None if there is none"""
+        if self.type != self.TYPE_SRT or \
+                (self.rotation, self.scale_x, self.scale_y) == \
+                (0, 0x1000, 0x1000):
+            return None
+        return (self.rotation, self.scale_x, self.scale_y)
 
 
 class AnimationFrame(Editable):
@@ -13,15 +59,38 @@ class AnimationFrame(Editable):
         self.uint32('data_offset')
         self.uint16('frames')
         self.uint16('u6')
+        self.element = None
+        self.restrict('element')
 
 
 class AnimationSequence(Editable):
+    MODE_FORWARD = 1
+    MODE_FORWARD_LOOP = 2
+    MODE_PINGPONG = 3
+    MODE_PINGPONG_LOOP = 4
+
     def define(self):
         self.uint16('num_frames')
         self.uint16('start_idx')
         self.uint32('type')
         self.uint32('mode')
         self.uint32('frame_ofs')
+        self.frames = []
+        self.restrict('frames')
+
+    @property
+    def element_type(self):
+        return self.type & 0xFFFF
+
+    @property
+    def loops(self):
+        return self.mode in (self.MODE_FORWARD_LOOP, self.MODE_PINGPONG_LOOP)
+
+    def playback(self):
+        """Get the frames in the order they are shown for one cycle"""
+        if self.mode in (self.MODE_PINGPONG, self.MODE_PINGPONG_LOOP):
+            return self.frames+self.frames[-2:0:-1]
+        return list(self.frames)
 
 
 class ABNK(Editable):
@@ -36,13 +105,75 @@ class ABNK(Editable):
         self.uint32('data_offset')
         self.uint32('u18')
         self.uint32('u1c')
+        self.sequences = []
+        self.restrict('sequences')
 
     def load(self, reader):
         start = reader.tell()
         Editable.load(self, reader)
+        # Offsets are relative to the end of magic and size_
+        base = start+8
+        reader.seek(base+self.seq_ofs)
+        self.sequences = [AnimationSequence(reader=reader)
+                          for i in range(self.num_seq)]
+        # Frames may share elements
+        elements = {}
+        for seq in self.sequences:
+            reader.seek(base+self.frame_ofs+seq.frame_ofs)
+            seq.frames = [AnimationFrame(reader=reader)
+                          for i in range(seq.num_frames)]
+            for frame in seq.frames:
+                key = (frame.data_offset, seq.element_type)
+                if key not in elements:
+                    with reader.seek(base+self.data_offset+frame.data_offset):
+                        elements[key] = AnimationElement(seq.element_type,
+                                                         reader=reader)
+                frame.element = elements[key]
         reader.seek(start+self.size_)
 
 
+def transform_image(image, left, top, transform):
+    """Rotate and scale a cell image around the cell origin
+
+    Parameters
+    ----------
+    image : PIL.Image
+        Cell image with its top left corner at (left, top) of the cell
+    left : int
+    top : int
+    transform : tuple
+        (rotation, scale_x, scale_y) as in AnimationElement
+
+    Returns
+    -------
+    image : PIL.Image
+    left : int
+    top : int
+        Position of the new top left corner relative to the origin
+    """
+    rotation, scale_x, scale_y = transform
+    angle = rotation*2*math.pi/0x10000
+    matrix = np.dot([[math.cos(angle), -math.sin(angle)],
+                     [math.sin(angle), math.cos(angle)]],
+                    [[scale_x/4096., 0], [0, scale_y/4096.]])
+    width, height = image.size
+    corners = np.dot(matrix, [[left, left+width, left, left+width],
+                              [top, top, top+height, top+height]])
+    new_left, new_top = np.floor(corners.min(1)).astype(int)
+    new_right, new_bottom = np.ceil(corners.max(1)).astype(int)
+    try:
+        inverse = np.linalg.inv(matrix)
+    except np.linalg.LinAlgError:
+        return Image.new('RGBA', (0, 0)), 0, 0
+    # Output pixel (u, v) samples the source at inverse*(u+new_left, ...)
+    offset = np.dot(inverse, [new_left, new_top])-[left, top]
+    data = (inverse[0, 0], inverse[0, 1], offset[0],
+            inverse[1, 0], inverse[1, 1], offset[1])
+    return (image.transform((new_right-new_left, new_bottom-new_top),
+                            Image.AFFINE, data, Image.NEAREST),
+            new_left, new_top)
+
+
 class NANR(Editable):
     """2d Animations
     """
@@ -61,3 +192,92 @@ class NANR(Editable):
         self.abnk.load(reader)
         self.labl.load(reader)
 
+    def get_frames(self, seq_idx, cer, cgr, clr):
+        """Render one cycle of a sequence
+
+        Cell images come from NCER.get_image and each distinct element is
+        only placed once, so repeated frames cost nothing.
+
+        Parameters
+        ----------
+        seq_idx : int
+        cer : NCER
+        cgr : NCGR
+        clr : NCLR
+
+        Returns
+        -------
+        frames : list of (np.ndarray, int)
+            (height, width, 4) RGBA array and duration in 60 Hz frames of
+            each frame. Every array covers the bounds of all frames
+        """
+        seq = self.abnk.sequences[seq_idx]
+        placed = {}
+        layout = []
+        for frame in seq.playback():
+            element = frame.element
+            key = (element.index, element.transform)
+            try:
+                image, left, top = placed[key]
+            except KeyError:
+                cell = cer.cebk.cells[element.index]
+                if cell.attrs:
+                    image = cer.get_image(element.index, cgr, clr)
+                    left, top = render.cell_bounds(cell)[:2]
+                    if element.transform is not None:
+                        image, left, top = transform_image(
+                            image, left, top, element.transform)
+                    image = np.asarray(image)
+                else:
+                    image = np.zeros((0, 0, 4), dtype=np.uint8)
+                    left = top = 0
+                placed[key] = image, left, top
+            x, y = element.offset
+            layout.append((image, left+x, top+y, frame.frames))
+        if not layout:
+            return []
+        min_x = min(left for image, left, top, duration in layout)
+        min_y = min(top for image, left, top, duration in layout)
+        width = max(left+image.shape[1]
+                    for image, left, top, duration in layout)-min_x
+        height = max(top+image.shape[0]
+                     for image, left, top, duration in layout)-min_y
+        frames = []
+        for image, left, top, duration in layout:
+            rgba = np.zeros((max(height, 1), max(width, 1), 4),
+                            dtype=np.uint8)
+            rgba[top-min_y:top-min_y+image.shape[0],
+                 left-min_x:left-min_x+image.shape[1]] = image
+            frames.append((rgba, duration))
+        return frames
+
+    def get_gif(self, seq_idx, cer, cgr, clr):
+        """Render a sequence as an animated GIF
+
+        All frames share one palette with index 0 transparent.
+
+        Returns
+        -------
+        data : string
+            GIF file data
+        """
+        frames = self.get_frames(seq_idx, cer, cgr, clr)
+        if not frames:
+            raise ValueError('Sequence {0} has no frames'.format(seq_idx))
+        keys = [quantize.color_keys(rgba) for rgba, duration in frames]
+        palette = quantize.make_palette(keys, 256)
+        colors = bgr555_to_rgba(palette)[:, :3].ravel().tolist()
+        images = []
+        for key in keys:
+            image = Image.fromarray(quantize.quantize(key, palette), 'P')
+            image.putpalette(colors)
+            images.append(image)
+        options = {}
+        if self.abnk.sequences[seq_idx].loops:
+            options['loop'] = 0
+        buffer = StringIO()
+        images[0].save(buffer, format='GIF', save_all=True,
+                       append_images=images[1:], transparency=0, disposal=2,
+                       duration=[max(duration*1000//60, 20)
+                                 for rgba, duration in frames], **options)
+        return buffer.getvalue()
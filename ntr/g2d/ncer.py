@@ -1,6 +1,7 @@
 
 import array
 from cStringIO import StringIO
+import functools
 import itertools
 import json
 
@@ -8,6 +9,7 @@ from PIL import Image
 
 from generic.archive import ArchiveList
 from generic.editable import XEditable as Editable
+from ntr.g2d import render
 from util import BinaryIO
 
 
@@ -193,6 +195,8 @@ class NCER(Editable, ArchiveList):
         self.labl = LABL(self)
         self.restrict('labl')
         self._files = None
+        # RenderCache of files, or None for render.png_cache
+        self.png_cache = None
 
     def load(self, reader):
         Editable.load(self, reader)
@@ -211,55 +215,19 @@ class NCER(Editable, ArchiveList):
             writer.writeUInt32(size)
         return writer
 
+    def _image_key(self, cell, cgr, lut):
+        return (('cell', render.cell_bounds(cell)) +
+                tuple((attr.x, attr.y, attr.width, attr.height, attr.tileofs,
+                       attr.pal_id, attr.horizontal_flip, attr.vertical_flip)
+                      for attr in cell.attrs) +
+                (cgr.char.format, cgr.char.data, lut.tobytes()))
+
     def get_image(self, id, cgr, clr):
         cell = self.cebk.cells[id]
-        # maxX = min(cell.maxX for cell in self.cebk.cells)
-        # maxY = min(cell.maxY for cell in self.cebk.cells)
-        # minX = min(cell.minX for cell in self.cebk.cells)
-        # minY = min(cell.minY for cell in self.cebk.cells)
-        try:
-            maxX = cell.maxX
-            maxY = cell.maxY
-            minX = cell.minX
-            minY = cell.minY
-        except AttributeError:
-            maxX = max(attr.x+attr.width for attr in cell.attrs)
-            maxY = max(attr.y+attr.height for attr in cell.attrs)
-            minX = min(attr.x for attr in cell.attrs)
-            minY = min(attr.y for attr in cell.attrs)
-
-        img = Image.new('RGBA', (maxX-minX+1, maxY-minY+1))
-        tiles = cgr.get_tiles()
-        palettes = clr.get_palettes()
-        pix = img.load()
-
-        for attr in cell.attrs:
-            tile_id = attr.tileofs
-            # apply flip outside too?
-            if attr.vertical_flip:
-                flip_y_factor = -1
-            else:
-                flip_y_factor = 1
-            if attr.horizontal_flip:
-                flip_x_factor = -1
-            else:
-                flip_x_factor = 1
-            for scr_y in range(attr.y-minY, attr.y-minY+attr.height, 8)[::flip_y_factor]:
-                for scr_x in range(attr.x-minX, attr.x-minX+attr.width, 8)[::flip_x_factor]:
-                    tile = tiles[tile_id]
-                    palette = palettes[attr.pal_id]
-                    for sub_y, tile_y in enumerate(range(8)[::flip_y_factor]):
-                        for sub_x, tile_x in enumerate(range(8)[::flip_x_factor]):
-                            val = tile[tile_y][tile_x]
-                            try:
-                                if val:
-                                    pix[(scr_x+sub_x, scr_y+sub_y)] = palette[val]
-                                elif 0:
-                                    pix[(scr_x+sub_x, scr_y+sub_y)] = (0, 0, 0, 0)
-                            except IndexError:
-                                continue
-                    tile_id += 1
-        return img
+        lut = render.palette_lut(clr.get_palette_array())
+        return render.cached_image(
+            self._image_key(cell, cgr, lut),
+            lambda: render.render_cell(cgr.char.get_tile_array(), cell, lut))
 
     @property
     def files(self):
@@ -272,12 +240,12 @@ class NCER(Editable, ArchiveList):
             raise ValueError('No dependencies set. '
                              'Call update_dependencies(cgr, clr)')
         self._files = []
+        lut = render.palette_lut(clr.get_palette_array())
         for idx, cell in enumerate(self.cebk.cells):
-            image = self.get_image(idx, cgr, clr)
-            buffer = StringIO()
-            image.save(buffer, format='PNG', pnginfo=cell)
-            self._files.append(buffer.getvalue())
-            buffer.close()
+            self._files.append(render.cached_png(
+                self._image_key(cell, cgr, lut),
+                functools.partial(self.get_image, idx, cgr, clr), cell,
+                self.png_cache))
         return self._files
 
     def update_dependencies(self, cgr, clr):
@@ -1,9 +1,11 @@
 
-import array
-
+import numpy as np
 from PIL import Image
 
 from generic import Editable
+from ntr.g2d import tilecodec
+from util import quantize
+from util.colors import bgr555_to_rgba, rgba_to_bgr555
 from util.io import BinaryIO
 
 
@@ -11,6 +13,38 @@ def default_palette():
     return [(c, c, c, 255) for c in range(16)*16]
 
 
+_keystream_tables = {}
+
+
+def keystream(seed, count, mult, carry):
+    """Low 16 bits of the first count states of a 32-bit LCG
+
+    State n is mult**n*seed + carry*(mult**(n-1) + ... + 1). These factors
+    do not depend on the seed, so they are computed once per generator by
+    repeated doubling and reused.
+
+    Returns
+    -------
+    keys : np.ndarray
+        uint16 array of count keys
+    """
+    try:
+        mults, carries = _keystream_tables[(mult, carry)]
+    except KeyError:
+        mults = np.ones(1, dtype=np.uint32)
+        carries = np.zeros(1, dtype=np.uint32)
+    while len(mults) < count:
+        # Jump ahead by len(mults) states
+        jump_mult = np.uint32(int(mults[-1])*mult & 0xFFFFFFFF)
+        jump_carry = np.uint32((int(carries[-1])*mult+carry) & 0xFFFFFFFF)
+        mults, carries = (np.concatenate([mults, mults*jump_mult]),
+                          np.concatenate([carries,
+                                          carries*jump_mult+jump_carry]))
+    _keystream_tables[(mult, carry)] = mults, carries
+    keys = mults[:count]*np.uint32(seed)+carries[:count]
+    return (keys & 0xFFFF).astype(np.uint16)
+
+
 class CHAR(Editable):
     """Character information"""
     FORMAT_16BIT = 3
@@ -56,168 +90,94 @@ class CHAR(Editable):
         """
         if encryption is NCGR.ENCRYPTION_NONE:
             return
-        enc_data = array.array('H', self.data)
+        enc_data = np.frombuffer(self.data, dtype=np.uint16)
         if encryption == NCGR.ENCRYPTION_REVERSE:
             enc_data = enc_data[::-1]
-        dec_data = array.array('H')
-        key = enc_data[0]
-        for val in enc_data:
-            dec_data.append(val ^ (key & 0xFFFF))
-            key *= self.ENCRYPT_MULT
-            key += self.ENCRYPT_CARRY
-        self.data = dec_data.tostring()
+        if not enc_data.size:
+            return
+        dec_data = enc_data ^ keystream(enc_data[0], enc_data.size,
+                                        self.ENCRYPT_MULT, self.ENCRYPT_CARRY)
+        self.data = dec_data.tobytes()
     decrypt = encrypt
 
-    def get_tiles(self):
-        tiles = []
+    @property
+    def bpp(self):
         if self.format == self.FORMAT_16BIT:
-            subwidth = 4
+            return 4
         elif self.format == self.FORMAT_256BIT:
-            subwidth = 8
-        for tile_id in range(self.datasize/subwidth/8):
-            tile = []
-            for tile_y in range(8):
-                tile.append([])
-                for tile_x in range(subwidth):
-                    val = ord(self.data[tile_id*8*subwidth+
-                                        tile_y*subwidth+tile_x])
-                    if self.format == self.FORMAT_16BIT:
-                        tile[tile_y].append(val & 0xF)
-                        tile[tile_y].append(val >> 0x4)
-                    elif self.format == self.FORMAT_256BIT:
-                        tile[tile_y].append(val)
-            tiles.append(tile)
-        return tiles
+            return 8
+        raise ValueError('Unknown format: {0}'.format(self.format))
 
-    def get_tile(self, tileofs):
-        if self.format == self.FORMAT_16BIT:
-            subwidth = 4
-        elif self.format == self.FORMAT_256BIT:
-            subwidth = 8
-        tile = []
-        for tile_y in range(8):
-            tile.append([])
-            for tile_x in range(subwidth):
-                val = ord(self.data[tileofs+tile_y*subwidth+tile_x])
-                if self.format == self.FORMAT_16BIT:
-                    tile[tile_y].append(val & 0xF)
-                    tile[tile_y].append(val >> 0x4)
-                elif self.format == self.FORMAT_256BIT:
-                    tile[tile_y].append(val)
-        return tile
+    def get_tile_array(self):
+        """Get all tiles as an (N, 8, 8) index array"""
+        indexes = tilecodec.unpack(self.data, self.bpp)
+        return indexes[:indexes.size//64*64].reshape(-1, 8, 8)
 
-    def set_tiles(self, tiles):
-        self.data = ''
-        if self.format == self.FORMAT_16BIT:
-            subwidth = 4
-        elif self.format == self.FORMAT_256BIT:
-            subwidth = 8
-        for tile in tiles:
-            for tile_y in range(8):
-                for tile_x in range(subwidth):
-                    if self.format == self.FORMAT_16BIT:
-                        val = tile[tile_y][tile_x*2]
-                        val |= tile[tile_y][tile_x*2+1] << 4
-                    elif self.format == self.FORMAT_256BIT:
-                        val = tile[tile_y][tile_x]
-                    self.data += chr(val)
+    def set_tile_array(self, tile_array):
+        """Set data from an (N, 8, 8) index array"""
+        self.data = tilecodec.pack(tile_array, self.bpp)
         old_datasize = self.datasize
         self.datasize = len(self.data)
         self.size_ += self.datasize-old_datasize
 
-    def get_pixels(self, width=None, height=None):
-        """pixels = [[[]]]
-        subx = suby = 0
-        blockx = blocky = 0
-        for c in self.data:
-            val = ord(c)
-            if self.format == self.FORMAT_16BIT:
-                pixels[blocky][blockx][suby].append(val & 0xF)
-                pixels[blocky][blockx][suby].append(val >> 0x4)
-                subx += 2
-            elif self.format == self.FORMAT_256BIT:
-                pixels[blocky][blockx][suby].append(val)
-                subx += 1
-            if subx == 8:
-                subx = 0
-                suby += 1
-                if suby == 8:
-                    blockx += 1
-                    if blockx == 8:
-                        blockx = 0
-                        blocky += 1
-                        pixels.append([[[]]])
-                    else:
-                        pixels[blocky].append([[]])
-                else:
-                    pixels[blocky][blockx].append([])"""
+    def get_index_array(self, width=None, height=None):
+        """Get the image as an (height*8, width*8) index array
+
+        Parameters
+        ----------
+        width : int
+            Width in tiles. Defaults to self.width
+        height : int
+            Height in tiles. Defaults to self.height
+        """
         if width is None:
             width = self.width
         if height is None:
             height = self.height
-        pixels = []
-        if self.format == self.FORMAT_16BIT:
-            subwidth = 4
-        elif self.format == self.FORMAT_256BIT:
-            subwidth = 8
-        else:
-            raise ValueError('Unknown format: {0}'.format(self.format))
+        indexes = tilecodec.unpack(self.data, self.bpp)
+        size = width*height*64
+        if indexes.size < size:
+            indexes = np.concatenate([
+                indexes, np.zeros(size-indexes.size, dtype=np.uint8)])
         if self.type == self.TYPE_LINEAR:
-            data_idx = 0
-            for suby in range(height*8):
-                for subx in range(width*4):
-                    val = ord(self.data[data_idx])
-                    if self.format == self.FORMAT_16BIT:
-                        pixels.append(val & 0xF)
-                        pixels.append(val >> 0x4)
-                    elif self.format == self.FORMAT_256BIT:
-                        pixels.append(val)
-                    data_idx += 1
-            return pixels
-        for blocky in range(height):
-            for suby in range(8):
-                for blockx in range(width):
-                    for subx in range(subwidth):
-                        val = ord(self.data[(blocky*width*8*subwidth)+
-                                            (blockx*8*subwidth)+
-                                            (suby*subwidth)+subx])
-                        if self.format == self.FORMAT_16BIT:
-                            pixels.append(val & 0xF)
-                            pixels.append(val >> 0x4)
-                        elif self.format == self.FORMAT_256BIT:
-                            pixels.append(val)
-        return pixels
+            return indexes[:size].reshape(height*8, width*8)
+        return tilecodec.tiles_to_image(indexes[:size].reshape(-1, 8, 8),
+                                        width)
+
+    def set_index_array(self, indexes):
+        """Set data from an (height, width) index array"""
+        indexes = np.asarray(indexes, dtype=np.uint8)
+        if self.type != self.TYPE_LINEAR:
+            indexes = tilecodec.image_to_tiles(indexes)
+        self.data = tilecodec.pack(indexes, self.bpp)
+
+    def get_tiles(self):
+        return self.get_tile_array().tolist()
+
+    def get_tile(self, tileofs):
+        data = self.data[tileofs:tileofs+self.bpp*8]
+        return tilecodec.unpack(data, self.bpp).reshape(8, 8).tolist()
+
+    def set_tiles(self, tiles):
+        self.set_tile_array(np.array(tiles, dtype=np.uint8).reshape(-1, 8, 8))
+
+    def get_pixels(self, width=None, height=None):
+        """Get a flat list of indexes of the image, row by row"""
+        return self.get_index_array(width, height).ravel().tolist()
 
     def set_pixels(self, pixels, width, height):
-        data = array.array('B')
-        if self.format == self.FORMAT_16BIT:
-            subwidth = 4
-        elif self.format == self.FORMAT_256BIT:
-            subwidth = 8
-        else:
-            raise ValueError('Unknown format: {0}'.format(self.format))
-        if self.type == self.TYPE_LINEAR:
-            for pix_idx in range(width*height*8*subwidth):
-                if self.format == self.FORMAT_16BIT:
-                    data.append(pixels[pix_idx*2] |
-                                (pixels[pix_idx*2+1] << 4))
-                elif self.format == self.FORMAT_256BIT:
-                    data.append(pixels[pix_idx])
-        else:
-            for blocky in range(height):
-                for blockx in range(width):
-                    for suby in range(8):
-                        for subx in range(subwidth):
-                            pix_idx = ((blocky*width*8*8) +
-                                       (suby*width*8) +
-                                       (blockx*8) +
-                                       subx*2)
-                            if self.format == self.FORMAT_16BIT:
-                                data.append(pixels[pix_idx] |
-                                            (pixels[pix_idx+1] << 4))
-                            elif self.format == self.FORMAT_256BIT:
-                                data.append(pixels[pix_idx])
-        self.data = data.tostring()
+        """Set data from a flat list of indexes
+
+        Parameters
+        ----------
+        pixels : list
+        width : int
+            Width in tiles
+        height : int
+            Height in tiles
+        """
+        self.set_index_array(np.asarray(pixels, dtype=np.uint8)
+                             .reshape(height*8, width*8))
 
 
 class CPOS(Editable):
@@ -279,7 +239,6 @@ class NCGR(Editable):
 
     def get_image(self, width=None, height=None, clr=None, pal_id=0,
                   transparent=True):
-        data = ''
         if width is None:
             width = self.char.width
         else:
@@ -291,52 +250,49 @@ class NCGR(Editable):
         if clr is None:
             palette = self.palette
         else:
-            palette = clr.get_palettes()[pal_id]
-        for pix in self.char.get_pixels(width, height):
-            if not pix and transparent:
-                data += chr(0)*4
-            else:
-                data += ''.join(map(chr, palette[pix]))
-        return Image.frombytes('RGBA', (width*8, height*8), data)
+            palette = clr.get_palette_array()[pal_id]
+        lut = np.zeros((256, 4), dtype=np.uint8)
+        lut[:len(palette)] = palette[:256]
+        if transparent:
+            lut[0] = 0
+        data = lut[self.char.get_index_array(width, height)]
+        return Image.frombuffer('RGBA', (width*8, height*8), data.tobytes(),
+                                'raw', 'RGBA', 0, 1)
 
     def set_image(self, img, clr, modify_palette=EDIT_ANY, pal_id=0):
+        """Set the character data and palette from an image
+
+        Parameters
+        ----------
+        img : PIL.Image
+        clr : NCLR
+        modify_palette : {EDIT_NONE, EDIT_ANY, ADD_ONLY}
+            If EDIT_NONE, use the existing palette and make no changes.
+            If EDIT_ANY, build a new palette.
+            If ADD_ONLY, add colors in place of unused colors at the end.
+            Colors that do not fit are quantized.
+        pal_id : int
+        """
         img = img.convert('RGBA')
-        if modify_palette == self.EDIT_ANY:
-            palette = [(0xF8, 0xF8, 0xF8, 0)]
-        else:
-            palette = clr.get_palettes()[pal_id]
-        pixels = []
         width, height = img.size
         width >>= 3
         height >>= 3
-        for pix in img.getdata():
-            if pix[3] < 0x80:
-                pixels.append(0)
-                continue
-            color = (pix[0] & 0xF8, pix[1] & 0xF8,
-                     pix[2] & 0xF8, 255)
-            try:
-                index = palette.index(color, 1)
-            except:
-                if modify_palette is self.EDIT_NONE:
-                    raise ValueError('Some colors do not exist'
-                                     ' in current palette')
-                index = len(palette)
-                if index >= 16:
-                    if modify_palette is self.ADD_ONLY:
-                        last = palette[-1]
-                        index = palette.index(last, 1)
-                        if last == len(palette)-1:
-                            raise ValueError('Cannot have more than 16 colors')
-                        palette[index] = color
-                    else:
-                        raise ValueError('Cannot have more than 16 colors')
-                else:
-                    palette.append(color)
-            pixels.append(index)
-        self.char.set_pixels(pixels, width, height)
+        keys = quantize.color_keys(img)[:height*8, :width*8]
+        if modify_palette == self.EDIT_ANY:
+            palette = None
+        else:
+            palette = rgba_to_bgr555(clr.get_palette_array()[pal_id])
+        if modify_palette == self.EDIT_NONE:
+            indexes = quantize.quantize(keys, palette, exact=True)
+        else:
+            free = None if palette is None \
+                else quantize.trailing_slots(palette)
+            palette = quantize.make_palette(keys, 1 << self.char.bpp,
+                                            palette, free)
+            indexes = quantize.quantize(keys, palette)
+        self.char.set_index_array(indexes)
         if modify_palette != self.EDIT_NONE:
-            clr.set_palette(pal_id, palette)
+            clr.set_palette(pal_id, bgr555_to_rgba(palette))
         self.char.width = width
         self.char.height = height
 
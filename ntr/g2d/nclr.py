@@ -4,6 +4,7 @@ import array
 from PIL import Image
 
 from generic.editable import XEditable as Editable
+from util.colors import BGR555Palette, rgba_to_bgr555
 
 
 class PLTT(Editable):
@@ -20,6 +21,7 @@ class PLTT(Editable):
         self.uint32('datasize')
         self.uint32('offset')
         self.data = ''
+        self._colors = BGR555Palette()
 
     def load(self, reader):
         Editable.load(self, reader)
@@ -32,42 +34,30 @@ class PLTT(Editable):
         writer.writePadding(ofs+self.datasize)
         return writer
 
-    def get_palettes(self):
-        palettes = []
+    @property
+    def num_colors(self):
         if self.format == self.FORMAT_16BIT:
-            num = 16
+            return 16
         elif self.format == self.FORMAT_256BIT:
-            num = 256
-        start = 0
-        for pal_id in range(len(self.data)/num):
-            palette = []
-            for i in range(num):
-                val = self.data[start+i]
-                palette.append((((val >> 0) & 0x1f) << 3,
-                               ((val >> 5) & 0x1f) << 3,
-                               ((val >> 10) & 0x1f) << 3,
-                               255))
-            start += num
-            palettes.append(palette)
-        return palettes
+            return 256
+        raise ValueError('Unknown format: {0}'.format(self.format))
+
+    def get_palette_array(self):
+        """Get all palettes as a read-only (palettes, colors, 4) RGBA array
+
+        The conversion is reused until the palette data changes.
+        """
+        colors = self._colors.rgba(self.data)
+        num = self.num_colors
+        return colors[:len(colors)//num*num].reshape(-1, num, 4)
+
+    def get_palettes(self):
+        return [map(tuple, palette)
+                for palette in self.get_palette_array().tolist()]
 
     def get_palette(self, pal_id, transparent=True):
-        palette = []
-        if self.format == self.FORMAT_16BIT:
-            num = 16
-        elif self.format == self.FORMAT_256BIT:
-            num = 256
-        start = pal_id*num
-        for i in range(num):
-            if not num and transparent:
-                palette.append(chr(0)*4)
-                continue
-            val = self.data[start+i]
-            palette.append(chr(((val >> 0) & 0x1f) << 3) +
-                           chr(((val >> 5) & 0x1f) << 3) +
-                           chr(((val >> 10) & 0x1f) << 3) +
-                           chr(255))
-        return palette
+        return [color.tostring()
+                for color in self.get_palette_array()[pal_id]]
 
     def set_palette(self, pal_id, palette):
         """
@@ -78,18 +68,11 @@ class PLTT(Editable):
         palette : list of tuple
             List of 4-/3-int-tuple colors
         """
-        if self.format == self.FORMAT_16BIT:
-            num = 16
-        elif self.format == self.FORMAT_256BIT:
-            num = 256
+        num = self.num_colors
+        values = rgba_to_bgr555([color[:3] for color in palette[:num]])
         start = pal_id*num
-        for i, color in enumerate(palette):
-            if i > num:
-                break
-            r, g, b = color[:3]
-            self.data[start+i] = ((r >> 3) |
-                                  (g >> 3 << 5) |
-                                  (b >> 3 << 10))
+        self.data[start:start+len(values)] = array.array('H',
+                                                         values.tostring())
 
 
 class NCLR(Editable):
@@ -120,5 +103,8 @@ class NCLR(Editable):
     def get_palettes(self):
         return self.pltt.get_palettes()
 
+    def get_palette_array(self):
+        return self.pltt.get_palette_array()
+
     def set_palette(self, pal_id, palette):
         return self.pltt.set_palette(pal_id, palette)
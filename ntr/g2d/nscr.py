@@ -3,10 +3,13 @@ import array
 import colorsys
 import itertools
 
+import numpy as np
 from PIL import Image
 
 from generic.editable import XEditable as Editable
-from util import BinaryIO
+from ntr.g2d import render, tilecodec
+from util import BinaryIO, quantize
+from util.colors import bgr555_to_rgba, rgba_to_bgr555
 
 
 class SCRN(Editable):
@@ -63,39 +66,23 @@ class NSCR(Editable):
         return writer
 
     def get_image(self, cgr=None, clr=None):
-        img = Image.new('RGBA', (self.scrn.width, self.scrn.height))
         if cgr is None:
-            return img
-        tiles = cgr.get_tiles()
-        palettes = clr.get_palettes()
-        pix = img.load()
-
-        scr_x = scr_y = 0
-        for tiledata in self.scrn.data:
-            tile = tiles[tiledata & 0x3FF]
-            if (tiledata >> 10) & 1:
-                flip_y_factor = -1
-            else:
-                flip_y_factor = 1
-            if (tiledata >> 11) & 1:
-                flip_x_factor = -1
-            else:
-                flip_x_factor = 1
-            palette = palettes[(tiledata >> 12) & 0xF]
-            for sub_y in range(8)[::flip_y_factor]:
-                for sub_x in range(8)[::flip_x_factor]:
-                    val = tile[sub_y][sub_x]
-                    if val:
-                        pix[(scr_x+sub_x, scr_y+sub_y)] = palette[val]
-                    else:
-                        pix[(scr_x+sub_x, scr_y+sub_y)] = (0, 0, 0, 0)
-            scr_x += 8
-            if scr_x >= self.scrn.width:
-                scr_x = 0
-                scr_y += 8
-                if scr_y >= self.scrn.height:
-                    break
-        return img
+            return Image.new('RGBA', (self.scrn.width, self.scrn.height))
+        screen_data = self.scrn.data
+        if hasattr(screen_data, 'tostring'):
+            screen_data = screen_data.tostring()
+        lut = render.palette_lut(clr.get_palette_array())
+        width = self.scrn.width
+        height = self.scrn.height
+
+        def render_image():
+            return render.render_screen(
+                cgr.char.get_tile_array(),
+                np.frombuffer(screen_data, dtype=np.uint16), width, height,
+                lut)
+        return render.cached_image(('screen', screen_data, width, height,
+                                    cgr.char.format, cgr.char.data,
+                                    lut.tobytes()), render_image)
 
     def get_target_image(self):
         img = Image.new('RGBA', (self.scrn.width, self.scrn.height))
@@ -150,163 +137,99 @@ class NSCR(Editable):
         screen_pal_id : int
             If modify_screen is EDIT_ANY, this will be the palette used
         """
-        # img = img.convert('P', palette=Image.ADAPTIVE, colors=16)
         img = img.convert('RGBA')
         if modify_tiles is not self.EDIT_ANY:
             if modify_screen is not self.EDIT_ANY:
                 # Not yet implemented though
                 raise ValueError('screen must be editable if tiles are not')
-        pixels = img.load()
-        # pal_str = img.palette.tostring()
-        # clr.set_palette(0, img.getpalette())
+        keys = quantize.color_keys(img)
+        num_colors = 1 << cgr.char.bpp
         if modify_palette is self.EDIT_ANY:
             palettes = []
         else:
-            palettes = clr.get_palettes()
-        tiles = []
+            palettes = list(rgba_to_bgr555(clr.get_palette_array()))
         changes_pal_ids = set()
+
+        def fit(blocks, pal_id):
+            """Map tile keys to indexes of palette pal_id"""
+            while pal_id+1 > len(palettes):
+                palettes.append(None)
+            palette = palettes[pal_id]
+            if modify_palette is self.EDIT_NONE:
+                if palette is None:
+                    palette = [0x7FFF]
+                return quantize.quantize(blocks, palette, exact=True)
+            if palette is None:
+                free = None
+            else:
+                free = quantize.trailing_slots(palette)
+            new_palette = quantize.make_palette(blocks, num_colors, palette,
+                                                free)
+            if palette is None or not np.array_equal(palette, new_palette):
+                changes_pal_ids.add(pal_id)
+            palettes[pal_id] = new_palette
+            return quantize.quantize(blocks, new_palette)
+
         if modify_screen is self.EDIT_NONE:
-            scr_x = scr_y = 0
-            for tiledata in self.scrn.data:
-                tile_id = tiledata & 0x3FF
-                try:
-                    tile = tiles[tile_id]
-                except IndexError:
-                    while tile_id+1 > len(tiles):
-                        tile = []
-                        for i in range(8):
-                            tile.append([0]*8)
-                        tiles.append(tile)
-                if (tiledata >> 10) & 1:
-                    flip_y_factor = -1
-                else:
-                    flip_y_factor = 1
-                if (tiledata >> 11) & 1:
-                    flip_x_factor = -1
-                else:
-                    flip_x_factor = 1
-                pal_id = (tiledata >> 12) & 0xF
-                try:
-                    palette = palettes[pal_id]
-                except:
-                    while pal_id+1 > len(palettes):
-                        palette = [(0xF8, 0xF8, 0xF8, 0)]
-                        palettes.append(palette)
-                for sub_y in range(8)[::flip_y_factor]:
-                    for sub_x in range(8)[::flip_x_factor]:
-                        try:
-                            pix = pixels[(scr_x+sub_x, scr_y+sub_y)]
-                        except IndexError:
-                            tile[sub_y][sub_x] = 0
-                            continue
-                        if pix[3] < 0x80:
-                            tile[sub_y][sub_x] = 0
-                            continue
-                        color = (pix[0] & 0xF8, pix[1] & 0xF8,
-                                 pix[2] & 0xF8, 255)
-                        try:
-                            index = palette.index(color, 1)
-                        except:
-                            if modify_palette is self.EDIT_NONE:
-                                raise ValueError('Some colors do not exist'
-                                                 ' in current palette')
-                            index = len(palette)
-                            if index >= 16:
-                                if modify_palette is self.ADD_ONLY:
-                                    last = palette[-1]
-                                    index = palette.index(last, 1)
-                                    if last == len(palette)-1:
-                                        raise ValueError(
-                                            'Cannot have more '
-                                            'than 16 colors for image')
-                                else:
-                                    raise ValueError(
-                                        'Cannot have more '
-                                        'than 16 colors for image')
-                            changes_pal_ids.add(pal_id)
-                            palette.append(color)
-                        tile[sub_y][sub_x] = index
-                palettes[pal_id] = palette
-                scr_x += 8
-                if scr_x >= self.scrn.width:
-                    scr_x = 0
-                    scr_y += 8
-                    if scr_y >= self.scrn.height:
-                        break
+            rows = self.scrn.height >> 3
+            cols = self.scrn.width >> 3
+            entries = np.asarray(self.scrn.data, dtype=np.uint16)[:rows*cols]
+            blocks = tilecodec.image_to_tiles(
+                self._pad_keys(keys, rows, cols))[:len(entries)]
+            hflip = ((entries >> 10) & 1).astype(bool)
+            vflip = ((entries >> 11) & 1).astype(bool)
+            blocks[hflip] = blocks[hflip][:, :, ::-1]
+            blocks[vflip] = blocks[vflip][:, ::-1, :]
+            pal_ids = entries >> 12
+            indexes = np.zeros(blocks.shape, dtype=np.uint8)
+            for pal_id in np.unique(pal_ids):
+                selected = pal_ids == pal_id
+                indexes[selected] = fit(blocks[selected], pal_id)
+            tile_ids = entries & 0x3FF
+            tiles = np.zeros((tile_ids.max()+1 if len(tile_ids) else 0, 8, 8),
+                             dtype=np.uint8)
+            # Later entries win when a tile is used more than once
+            tiles[tile_ids] = indexes
         else:
-            """minx, miny, maxx, maxy = img.getbbox()
-            minx -= minx % 8
-            miny -= miny % 8
-            # Max do not need to be exact because of the loop condition
-            maxx += 8
-            maxy += 8"""
             if modify_tiles is self.ADD_ONLY:
-                tiles = cgr.get_tiles()
+                tiles = cgr.char.get_tile_array()
             else:
-                tiles = []
-                tile = []
-                for i in range(8):
-                    tile.append([0]*8)
-                tiles.append(tile)
-            data = array.array('H')
+                tiles = np.zeros((1, 8, 8), dtype=np.uint8)
             width, height = img.size
-            for scr_y in range(0, height, 8):
-                for scr_x in range(0, width, 8):
-                    tiledata = 0
-                    pal_id = screen_pal_id
-                    try:
-                        palette = palettes[pal_id]
-                    except:
-                        while pal_id+1 > len(palettes):
-                            palette = [(0xF8, 0xF8, 0xF8, 0)]
-                            palettes.append(palette)
-                    tile = []
-                    for sub_y in range(8):
-                        tile.append([0]*8)
-                        for sub_x in range(8):
-                            pix = pixels[(scr_x+sub_x, scr_y+sub_y)]
-                            if pix[3] < 0x80:
-                                tile[sub_y][sub_x] = 0
-                                continue
-                            color = (pix[0] & 0xF8, pix[1] & 0xF8,
-                                     pix[2] & 0xF8, 255)
-                            try:
-                                index = palette.index(color, 1)
-                            except:
-                                if modify_palette is self.EDIT_NONE:
-                                    raise ValueError('Some colors do not exist'
-                                                     ' in current palette')
-                                index = len(palette)
-                                if index >= 16:
-                                    if modify_palette is self.ADD_ONLY:
-                                        last = palette[-1]
-                                        index = palette.index(last, 1)
-                                        if last == len(palette)-1:
-                                            raise ValueError(
-                                                'Cannot have more '
-                                                'than 16 colors for image')
-                                        palette[index] = color
-                                        changes_pal_ids.add(pal_id)
-                                    else:
-                                        raise ValueError(
-                                            'Cannot have more '
-                                            'than 16 colors for image')
-                                else:
-                                    changes_pal_ids.add(pal_id)
-                                    palette.append(color)
-                            tile[sub_y][sub_x] = index
-                    for tile_id, ref_tile in enumerate(tiles):
-                        if ref_tile == tile:
-                            break
-                    else:
-                        tiles.append(tile)
-                        tile_id = len(tiles)-1
-                    tiledata = tile_id | (pal_id << 12)
-                    data.append(tiledata)
-            self.scrn.width = scr_x+8
-            self.scrn.height = scr_y+8
-            self.scrn.data = data
+            rows = (height+7) >> 3
+            cols = (width+7) >> 3
+            indexes = fit(tilecodec.image_to_tiles(
+                self._pad_keys(keys, rows, cols)), screen_pal_id)
+            known = {}
+            for tile_id, tile in enumerate(tiles):
+                known.setdefault(tile.tostring(), tile_id)
+            new_tiles = []
+            tile_ids = np.empty(len(indexes), dtype=np.uint16)
+            for idx, tile in enumerate(indexes):
+                key = tile.tostring()
+                try:
+                    tile_id = known[key]
+                except KeyError:
+                    tile_id = known[key] = len(tiles)+len(new_tiles)
+                    new_tiles.append(tile[None])
+                tile_ids[idx] = tile_id
+            tiles = np.concatenate([tiles]+new_tiles)
+            data = tile_ids | (screen_pal_id << 12)
+            self.scrn.width = cols*8
+            self.scrn.height = rows*8
+            self.scrn.data = array.array('H', data.astype(np.uint16)
+                                         .tostring())
         for pal_id in changes_pal_ids:
-            clr.set_palette(pal_id, palettes[pal_id])
+            clr.set_palette(pal_id, bgr555_to_rgba(palettes[pal_id]))
         if modify_tiles is not self.EDIT_NONE:
-            cgr.set_tiles(tiles)
+            cgr.char.set_tile_array(tiles)
+
+    @staticmethod
+    def _pad_keys(keys, rows, cols):
+        """Fit color keys to whole tiles, filling with transparency"""
+        padded = np.full((rows*8, cols*8), quantize.TRANSPARENT,
+                         dtype=np.uint16)
+        height = min(rows*8, keys.shape[0])
+        width = min(cols*8, keys.shape[1])
+        padded[:height, :width] = keys[:height, :width]
+        return padded
@@ -0,0 +1,205 @@
+
+"""Compositing of character data into RGBA images
+
+Screens and cells are assembled as index arrays by gathering whole tiles,
+flips are applied by slicing, and colors come from a palette lookup table.
+Rendered images and their PNG files are cached by the content of their
+sources.
+"""
+
+from cStringIO import StringIO
+
+import numpy as np
+from PIL import Image
+
+from ntr.g2d import tilecodec
+from util.cache import LRUCache, RenderCache
+
+image_cache = LRUCache(256)
+png_cache = RenderCache(1024)
+
+
+def palette_lut(palettes):
+    """Build a lookup table from a list of palettes
+
+    Index 0 of every palette and colors past the end of a palette are
+    transparent.
+
+    Parameters
+    ----------
+    palettes : np.ndarray or list of list of tuple
+        RGBA colors, as from NCLR.get_palette_array() or get_palettes()
+
+    Returns
+    -------
+    lut : np.ndarray
+        (max(len(palettes), 16), 256, 4) uint8 array
+    """
+    lut = np.zeros((max(len(palettes), 16), 256, 4), dtype=np.uint8)
+    if isinstance(palettes, np.ndarray):
+        lut[:len(palettes), :palettes.shape[1]] = palettes[:, :256]
+    else:
+        for pal_id, palette in enumerate(palettes):
+            if len(palette):
+                lut[pal_id, :len(palette)] = palette[:256]
+    lut[:, 0] = 0
+    return lut
+
+
+def screen_indexes(tile_array, screen_data, width, height):
+    """Arrange tiles as referenced by screen entries
+
+    Parameters
+    ----------
+    tile_array : np.ndarray
+        (N, 8, 8) tile indexes
+    screen_data : array-like
+        uint16 screen entries: tile id in bits 0-9, horizontal flip in bit
+        10, vertical flip in bit 11 and palette id in bits 12-15
+    width : int
+        Width in pixels
+    height : int
+        Height in pixels
+
+    Returns
+    -------
+    tiles : np.ndarray
+        (rows*cols, 8, 8) flipped tiles. Missing entries and tiles are
+        left as 0
+    pal_ids : np.ndarray
+        (rows*cols, ) palette ids
+    """
+    cols = width//8
+    rows = height//8
+    entries = np.zeros(rows*cols, dtype=np.uint16)
+    screen_data = np.asarray(screen_data, dtype=np.uint16)[:rows*cols]
+    entries[:len(screen_data)] = screen_data
+    # Out of range ids refer to the extra blank tile at the end
+    padded = np.concatenate([tile_array,
+                             np.zeros((1, 8, 8), dtype=np.uint8)])
+    tile_ids = np.minimum(entries & 0x3FF, len(tile_array))
+    tile_ids[len(screen_data):] = len(tile_array)
+    tiles = padded[tile_ids]
+    hflip = ((entries >> 10) & 1).astype(bool)
+    vflip = ((entries >> 11) & 1).astype(bool)
+    tiles[hflip] = tiles[hflip][:, :, ::-1]
+    tiles[vflip] = tiles[vflip][:, ::-1, :]
+    return tiles, entries >> 12
+
+
+def render_screen(tile_array, screen_data, width, height, lut):
+    """Render screen entries to an (height, width, 4) RGBA array"""
+    tiles, pal_ids = screen_indexes(tile_array, screen_data, width, height)
+    rgba = lut[pal_ids[:, None, None], tiles]
+    rows = height//8
+    cols = width//8
+    return rgba.reshape(rows, cols, 8, 8, 4).swapaxes(1, 2)\
+        .reshape(rows*8, cols*8, 4)
+
+
+def cell_bounds(cell):
+    """Get (minX, minY, maxX, maxY) of a cell, all inclusive"""
+    try:
+        return cell.minX, cell.minY, cell.maxX, cell.maxY
+    except AttributeError:
+        return (min(attr.x for attr in cell.attrs),
+                min(attr.y for attr in cell.attrs),
+                max(attr.x+attr.width for attr in cell.attrs),
+                max(attr.y+attr.height for attr in cell.attrs))
+
+
+def render_cell(tile_array, cell, lut):
+    """Render the objects of a cell to an RGBA array
+
+    Objects use one dimensional tile mapping starting at their tileofs.
+    Later objects are drawn over earlier ones. Parts outside of the cell's
+    bounds are clipped.
+
+    Returns
+    -------
+    rgba : np.ndarray
+        (maxY-minY+1, maxX-minX+1, 4) array
+    """
+    min_x, min_y, max_x, max_y = cell_bounds(cell)
+    height = max_y-min_y+1
+    width = max_x-min_x+1
+    canvas = np.zeros((height, width, 4), dtype=np.uint8)
+    for attr in cell.attrs:
+        cols = attr.width//8
+        num = cols*(attr.height//8)
+        tiles = tile_array[attr.tileofs:attr.tileofs+num]
+        if len(tiles) < num:
+            tiles = np.concatenate([
+                tiles, np.zeros((num-len(tiles), 8, 8), dtype=np.uint8)])
+        block = tilecodec.tiles_to_image(tiles, cols)
+        if attr.horizontal_flip:
+            block = block[:, ::-1]
+        if attr.vertical_flip:
+            block = block[::-1]
+        rgba = lut[attr.pal_id][block]
+        # Clip to the canvas
+        top = attr.y-min_y
+        left = attr.x-min_x
+        src_top = max(0, -top)
+        src_left = max(0, -left)
+        bottom = min(height, top+block.shape[0])
+        right = min(width, left+block.shape[1])
+        if bottom <= top+src_top or right <= left+src_left:
+            continue
+        rgba = rgba[src_top:bottom-top, src_left:right-left]
+        target = canvas[top+src_top:bottom, left+src_left:right]
+        mask = rgba[:, :, 3] != 0
+        target[mask] = rgba[mask]
+    return canvas
+
+
+def to_image(rgba):
+    """Create an RGBA image from an (height, width, 4) array"""
+    height, width = rgba.shape[:2]
+    return Image.frombuffer('RGBA', (width, height),
+                            np.ascontiguousarray(rgba).tobytes(),
+                            'raw', 'RGBA', 0, 1)
+
+
+def cached_image(key, render):
+    """Get a copy of a cached image, rendering it if needed
+
+    Parameters
+    ----------
+    key : tuple
+        Everything the image depends on, see RenderCache.digest. Only its
+        digest is kept, not the source data.
+    render : func()
+        Returns the RGBA array of the image
+    """
+    return image_cache.get(RenderCache.digest(key),
+                           lambda: to_image(render())).copy()
+
+
+def encode_png(image, pnginfo=None):
+    """Encode an image as PNG file data"""
+    buffer = StringIO()
+    image.save(buffer, format='PNG', pnginfo=pnginfo)
+    return buffer.getvalue()
+
+
+def cached_png(key, image, pnginfo=None, cache=None):
+    """Get the PNG file data of an image, encoding it only if not cached
+
+    Parameters
+    ----------
+    key : tuple
+        Everything the image depends on. The chunks of pnginfo are added
+        to it
+    image : func()
+        Returns the PIL Image to encode
+    pnginfo : object with chunks or None
+        Extra PNG chunks to write
+    cache : RenderCache or None
+        Cache to use. If None, the in-memory png_cache is used
+    """
+    if cache is None:
+        cache = png_cache
+    chunks = tuple(pnginfo.chunks) if pnginfo is not None else ()
+    return cache.get(('png', key, chunks),
+                     lambda: encode_png(image(), pnginfo))
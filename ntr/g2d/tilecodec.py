@@ -0,0 +1,94 @@
+
+"""Conversion between raw character data and index arrays
+
+Character data stores palette indexes either as 8x8 tiles or linearly.
+4bpp data holds two pixels per byte, left pixel in the low nibble.
+"""
+
+import numpy as np
+
+
+def unpack(data, bpp):
+    """Split raw character data into a flat array of indexes
+
+    Parameters
+    ----------
+    data : string
+    bpp : int
+        Bits per pixel, 4 or 8
+
+    Returns
+    -------
+    indexes : np.ndarray
+        uint8 array of len(data)*8/bpp indexes
+    """
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if bpp == 8:
+        return raw.copy()
+    indexes = np.empty(raw.size*2, dtype=np.uint8)
+    indexes[0::2] = raw & 0xF
+    indexes[1::2] = raw >> 4
+    return indexes
+
+
+def pack(indexes, bpp):
+    """Merge an array of indexes into raw character data
+
+    Parameters
+    ----------
+    indexes : array-like
+        Indexes in data order. Any shape
+    bpp : int
+        Bits per pixel, 4 or 8
+
+    Returns
+    -------
+    data : string
+    """
+    indexes = np.asarray(indexes, dtype=np.uint8).ravel()
+    if bpp == 8:
+        return indexes.tobytes()
+    if indexes.size & 1:
+        indexes = np.append(indexes, np.uint8(0))
+    return ((indexes[0::2] & 0xF) | (indexes[1::2] << 4)).tobytes()
+
+
+def tiles_to_image(tiles, width):
+    """Arrange tiles into an image, row by row
+
+    Parameters
+    ----------
+    tiles : np.ndarray
+        (N, 8, 8) array. Missing tiles of the last row are left as 0
+    width : int
+        Width of the image in tiles
+
+    Returns
+    -------
+    image : np.ndarray
+        (height*8, width*8) array
+    """
+    height = -(-len(tiles) // width)
+    if len(tiles) < width*height:
+        padding = np.zeros((width*height-len(tiles), 8, 8), dtype=tiles.dtype)
+        tiles = np.concatenate([tiles, padding])
+    return tiles.reshape(height, width, 8, 8).swapaxes(1, 2)\
+        .reshape(height*8, width*8)
+
+
+def image_to_tiles(image):
+    """Split an image into tiles, row by row
+
+    Parameters
+    ----------
+    image : np.ndarray
+        (height, width) array. Both dimensions must be multiples of 8
+
+    Returns
+    -------
+    tiles : np.ndarray
+        (height/8*width/8, 8, 8) array
+    """
+    height, width = image.shape
+    return image.reshape(height//8, 8, width//8, 8).swapaxes(1, 2)\
+        .reshape(-1, 8, 8)
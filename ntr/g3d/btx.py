@@ -1,11 +1,18 @@
 
 from collections import namedtuple
+import functools
 import json
 import struct
 from cStringIO import StringIO
 
+import numpy as np
+
 from generic.archive import ArchiveList
+from ntr.g2d import render
+from ntr.g3d import texture
 from ntr.g3d.resdict import G3DResDict
+from util import quantize
+from util.colors import BGR555Palette
 from util.io import BinaryIO
 
 from PIL import Image
@@ -38,9 +45,7 @@ class TexInfo(object):
         self._dataofs = reader.readUInt32()
         if self.infotype == TexInfo.INFO_TEX4X4:
             self._paldataofs = reader.readUInt32()
-            self._datasize <<= 2
-        else:
-            self._datasize <<= 3
+        self._datasize <<= 3
 
     def save(self, writer=None):
         """
@@ -63,6 +68,7 @@ class TexInfo(object):
         self._dataofs_ofs = writer.tell()
         writer.writeUInt32(0)
         if self.infotype == TexInfo.INFO_TEX4X4:
+            self._paldataofs_ofs = writer.tell()
             writer.writeUInt32(0)
         return writer
 
@@ -90,94 +96,54 @@ class TEX(ArchiveList):
         self.texparams = []
         self.palparams = []
         self.texdata = ''
+        self.tex4x4data = ''
+        self.tex4x4paldata = ''
         self.paldata = ''
         self._images = None
+        self._palette_colors = BGR555Palette()
+        # RenderCache of files, or None for render.png_cache
+        self.png_cache = None
         if reader is not None:
             self.load(reader)
 
     def _get_bitmaps(self):
         """List of 2d bitmaps
 
-        Each pixel is a tuple of (index, alpha)
+        Each bitmap is an (indexes, alpha) pair of (height, width) arrays,
+        a (selectors, blocks) pair for 4x4 compressed textures or, for
+        direct color textures, an (height, width, 4) RGBA array.
         """
-        bitmaps = []
-        for param in self.texparams:
-            pixels = []  # 1d
-            if param.format == 1:  # A3I5
-                block = self.texdata[param.ofs:param.ofs +
-                                     param.width*param.height]
-                for value in block:
-                    value = ord(value)
-                    index = value & 0x1F
-                    alpha = ((value >> 5) & 0x7)*36
-                    if not index and param.color0:
-                        alpha = 0
-                    pixels += [(index, alpha)]
-            elif param.format == 2:  # I2 4 colors
-                block = self.texdata[param.ofs:param.ofs +
-                                     (param.width*param.height >> 2)]
-                for value in block:
-                    value = ord(value)
-                    for shift in xrange(0, 8, 2):
-                        index = value >> shift & 0x3
-                        alpha = None
-                        if not index and param.color0:
-                            alpha = 0
-                        pixels += [(index, alpha)]
-            elif param.format == 3:  # I4 16 colors
-                block = self.texdata[param.ofs:param.ofs +
-                                     (param.width*param.height >> 1)]
-                for value in block:
-                    value = ord(value)
-                    for shift in xrange(0, 8, 4):
-                        index = value >> shift & 0xF
-                        alpha = None
-                        if not index and param.color0:
-                            alpha = 0
-                        pixels += [(index, alpha)]
-            elif param.format == 4:  # I8 256 colors
-                block = self.texdata[param.ofs:param.ofs +
-                                     param.width*param.height]
-                for value in block:
-                    index = ord(value)
-                    alpha = None
-                    if not index and param.color0:
-                        alpha = 0
-                    pixels += [(index, alpha)]
-            elif param.format == 6:  # A5I3
-                block = self.texdata[param.ofs:param.ofs +
-                                     param.width*param.height]
-                for value in block:
-                    value = ord(value)
-                    index = value & 0x7
-                    alpha = ((value >> 3) & 0x1F)*8
-                    if not index and param.color0:
-                        alpha = 0
-                    pixels += [(index, alpha)]
-            else:
-                raise ValueError('Unhandled format: %d' % param.format)
-            pixels2d = [pixels[i:i+param.width]
-                        for i in xrange(0, len(pixels), param.width)]
-            # img = Image.frombytes('RGBA', (param.width, param.height),
-            #                       data)
-            bitmaps.append(pixels2d)
-        return bitmaps
+        return [self._get_bitmap(param) for param in self.texparams]
+
+    def _get_bitmap(self, param):
+        if param.format == texture.FORMAT_4X4:
+            return texture.decode_4x4(self.tex4x4data, self.tex4x4paldata,
+                                      param.ofs, param.width, param.height)
+        elif param.format == texture.FORMAT_DIRECT:
+            return texture.decode_direct(self.texdata, param.ofs,
+                                         param.width, param.height)
+        return texture.decode_indexed(self.texdata, param.ofs, param.format,
+                                      param.width, param.height, param.color0)
+
+    def _get_palette_arrays(self, count=256):
+        """List of (colors, 4) RGBA arrays of each palette
+
+        The conversion of the palette data is reused until it changes.
+
+        Parameters
+        ----------
+        count : int or None
+            Maximum number of colors per palette. If None, palettes extend
+            to the end of the palette data
+        """
+        colors = self._palette_colors.rgba(self.paldata)
+        return [colors[param.ofs >> 1:
+                       None if count is None else (param.ofs >> 1)+count]
+                for param in self.palparams]
 
     def _get_palettes(self):
-        palettes = []
-        for param in self.palparams:
-            palette = []
-            data = self.paldata[param.ofs:param.ofs+512]
-            values = [struct.unpack('H', data[i:i+2])[0]
-                      for i in xrange(0, len(data), 2)]
-            for value in values:
-                palette.append(struct.pack('4B',
-                                           (value >> 0 & 0x1F) << 3,
-                                           (value >> 5 & 0x1F) << 3,
-                                           (value >> 10 & 0x1F) << 3,
-                                           255))
-            palettes.append(palette)
-        return palettes
+        return [[color.tostring() for color in palette]
+                for palette in self._get_palette_arrays()]
 
     def _get_imagemap(self):
         imagemap = []
@@ -204,28 +170,67 @@ class TEX(ArchiveList):
                 imagemap.append((texidx, best))
         return imagemap
 
+    def _get_image(self, texidx, palidx, palettes, bitmap=None):
+        """Render a texture with a palette to a PIL Image"""
+        param = self.texparams[texidx]
+        if bitmap is None:
+            bitmap = self._get_bitmap(param)
+        try:
+            palette = palettes[palidx]
+        except IndexError:
+            palette = np.zeros((0, 4), dtype=np.uint8)
+        if param.format == texture.FORMAT_DIRECT:
+            rgba = bitmap
+        elif param.format == texture.FORMAT_4X4:
+            rgba = texture.apply_palette_4x4(bitmap[0], bitmap[1], palette)
+        else:
+            rgba = texture.apply_palette(bitmap[0], bitmap[1], palette)
+        height, width = rgba.shape[:2]
+        image = Image.frombuffer('RGBA', (width, height), rgba.tobytes(),
+                                 'raw', 'RGBA', 0, 1)
+        image.info['pnginfo'] = self._get_pnginfo(texidx, palidx)
+        return image
+
+    def _get_pnginfo(self, texidx, palidx):
+        try:
+            palname = self.paldict.names[palidx]
+        except IndexError:
+            palname = None
+        comment = json.dumps({'texidx': texidx, 'palidx': palidx,
+                              'texname': self.texdict.names[texidx],
+                              'palname': palname,
+                              'format': self.texparams[texidx].format
+                              })
+        pnginfo = PNGInfo()
+        pnginfo.chunks = [('tEXt', 'Comment\0'+comment)]
+        return pnginfo
+
+    def _get_source(self, texidx, palidx):
+        """Get all data that a texture's image is rendered from"""
+        param = self.texparams[texidx]
+        size = param.width*param.height*texture.BITS_PER_TEXEL[param.format]\
+            >> 3
+        try:
+            palofs = self.palparams[palidx].ofs
+        except IndexError:
+            palofs = len(self.paldata)
+        if param.format == texture.FORMAT_4X4:
+            return (param, self.tex4x4data[param.ofs:param.ofs+size],
+                    self.tex4x4paldata[param.ofs >> 1:
+                                       (param.ofs >> 1)+(size >> 1)],
+                    self.paldata[palofs:])
+        elif param.format == texture.FORMAT_DIRECT:
+            return (param, self.texdata[param.ofs:param.ofs+size])
+        return (param, self.texdata[param.ofs:param.ofs+size],
+                self.paldata[palofs:palofs+512])
+
     def _get_images(self):
         self._images = []
         bitmaps = self._get_bitmaps()
-        palettes = self._get_palettes()
+        palettes = self._get_palette_arrays(None)
         for texidx, palidx in self._get_imagemap():
-            palette = palettes[palidx]
-            bitmap = bitmaps[texidx]
-            data = ''
-            for row in bitmap:
-                for pix in row:
-                    if pix[1] is None:
-                        data += palette[pix[0]]
-                    else:
-                        data += palette[pix[0]][:3] + chr(pix[1])
-            image = Image.frombytes('RGBA', (len(row), len(bitmap)), data)
-            comment = json.dumps({'texidx': texidx, 'palidx': palidx,
-                                  'texname': self.texdict.names[texidx],
-                                  'palname': self.paldict.names[palidx]
-                                  })
-            image.info['pnginfo'] = PNGInfo()
-            image.info['pnginfo'].chunks = [('tEXt', 'Comment\0'+comment)]
-            self._images.append(image)
+            self._images.append(self._get_image(texidx, palidx, palettes,
+                                                bitmaps[texidx]))
         return self._images
 
     @property
@@ -239,15 +244,47 @@ class TEX(ArchiveList):
 
     @property
     def files(self):
-        """PNG files of images"""
+        """PNG files of images
+
+        Files are cached by the texture data they are rendered from, so
+        unchanged textures are not rendered or encoded again.
+        """
         files = []
-        for image in self.images:
-            buffer = StringIO()
-            image.save(buffer, format='PNG', pnginfo=image.info['pnginfo'])
-            files.append(buffer.getvalue())
-            buffer.close()
+        if self._images is not None:
+            for image in self._images:
+                files.append(render.cached_png(
+                    (image.mode, image.size, image.tobytes()),
+                    lambda image=image: image, image.info.get('pnginfo'),
+                    self.png_cache))
+            return files
+        palettes = self._get_palette_arrays(None)
+        for texidx, palidx in self._get_imagemap():
+            files.append(render.cached_png(
+                self._get_source(texidx, palidx),
+                functools.partial(self._get_image, texidx, palidx, palettes),
+                self._get_pnginfo(texidx, palidx), self.png_cache))
         return files
 
+    def get_png(self, texidx, palidx):
+        """PNG file of one texture rendered with a palette
+
+        Parameters
+        ----------
+        texidx : int
+            Texture index
+        palidx : int
+            Palette index. Direct color textures ignore it.
+
+        Returns
+        -------
+        data : string
+        """
+        palettes = self._get_palette_arrays(None)
+        return render.cached_png(
+            self._get_source(texidx, palidx),
+            functools.partial(self._get_image, texidx, palidx, palettes),
+            self._get_pnginfo(texidx, palidx), self.png_cache)
+
     def add(self, ref=None, data=''):
         """Add a PIL image file's contents to archive
 
@@ -268,24 +305,33 @@ class TEX(ArchiveList):
     def flush(self):
         """Builds added images into binary archive
 
-        This uses format 3 for building.
+        This uses format 3 for building. Images that came from 4x4
+        compressed textures are compressed again. The 4x4 palettes of
+        images sharing a palidx are placed one after another behind the
+        16-color palettes, and their palette indexes are rebased to
+        their part of it.
         """
         images = self.images
         num = len(images)
         imagemap = zip(xrange(num), [0]*num)  # 1:1
-        pal0 = ['\x00\x00']
-        palettes = {0: pal0}
+        palettes = {0: np.zeros(1, dtype=np.uint16)}
+        palettes4x4 = {}  # palidx => list of palettes
+        pidxs4x4 = []  # (palidx, pidx, color offset in its palettes)
         self.texdata = ''  # Delete old images
+        self.tex4x4data = ''
+        self.tex4x4paldata = ''
         self.texparams = []
         self.palparams = []
         self.paldict.names = ['palette_all_%03d\x00' % i
                               for i in xrange(num)]
         self.texdict.names = ['image_%03d\x00\x00\x00\x00\x00\x00\x00' % i
                               for i in xrange(num)]
+        formats = []
+        keys = {}
+        groups = {}
         for mapidx, (texidx, palidx) in enumerate(imagemap):
-            tex = []
-            format = 3  # 16-color
             image = images[texidx]
+            info = {}
             try:
                 info = json.loads(image.info.get('Comment'))
                 palidx = info.get('palidx', palidx)
@@ -296,47 +342,50 @@ class TEX(ArchiveList):
                     self.paldict.names[palidx] = info['palname']
             except:
                 pass
-            try:
-                pal = palettes[palidx]
-            except:
-                pal = ['\x00\x00']
-                palettes[palidx] = pal
-            has_alpha = None  # None = not determined. False = max colors.
             imagemap[mapidx] = (texidx, palidx)
-            for pix in image.getdata():
-                alpha = pix[3]
-                if not alpha:  # color0=1
-                    if has_alpha is False:
-                        raise OverflowError('Cannot have more than 16 colors'
-                                            ' in palette {0}'.format(palidx))
-                    has_alpha = True
-                    tex.append(0)
-                    continue
-                color = (pix[0] >> 3) << 0 |\
-                    (pix[1] >> 3) << 5 |\
-                    (pix[2] >> 3) << 10
-                color = struct.pack('H', color)
-                try:
-                    index = pal.index(color)
-                except ValueError:
-                    index = len(pal)
-                    if index >= 16:
-                        if has_alpha is None:
-                            has_alpha = False
-                            pal[0] = color
-                            tex.append(0)
-                            continue
-                        print(pal)
-                        raise OverflowError('Cannot have more than 16 colors'
-                                            ' in palette {0}'.format(palidx))
-                    pal.append(color)
-                tex.append(index)
+            if info.get('format') == texture.FORMAT_4X4:
+                formats.append(texture.FORMAT_4X4)
+                continue
+            formats.append(3)  # 16-color
+            keys[mapidx] = quantize.color_keys(image, 1)
+            groups.setdefault(palidx, []).append(mapidx)
+        # Images with the same palidx share one palette. Index 0 is only
+        # used as a color if none of them have transparent pixels
+        transparent = {}
+        for palidx, mapidxs in groups.iteritems():
+            group_keys = [keys[mapidx] for mapidx in mapidxs]
+            transparent[palidx] = \
+                any((quantize.TRANSPARENT == image_keys).any()
+                    for image_keys in group_keys) or \
+                len(quantize.histogram(group_keys)[0]) < 16
+            if transparent[palidx]:
+                palettes[palidx] = quantize.make_palette(
+                    group_keys, 16, palettes.get(palidx, [0])[:1])
+            else:
+                palettes[palidx] = quantize.make_palette(
+                    group_keys, 16, [], transparent=False)
+        for mapidx, (texidx, palidx) in enumerate(imagemap):
+            image = images[mapidx]
+            size = image.size
+            if formats[mapidx] == texture.FORMAT_4X4:
+                tex, pidx, palette = texture.encode_4x4(image)
+                block = palettes4x4.setdefault(palidx, [])
+                pidxs4x4.append((palidx, np.frombuffer(pidx, dtype='<u2'),
+                                 sum(len(colors) for colors in block)))
+                block.append(palette)
+                self.texparams.append(TexParam(len(self.tex4x4data),
+                                               size[0], size[1],
+                                               texture.FORMAT_4X4, 0))
+                self.tex4x4data += tex
+                continue
+            image_keys = keys[mapidx]
+            tex = quantize.quantize(image_keys, palettes[palidx],
+                                    transparent=transparent[palidx]).ravel()
+            color0 = int((image_keys == quantize.TRANSPARENT).any())
             ofs = len(self.texdata)
-            size = images[texidx].size
-            self.texparams.append(TexParam(ofs, size[0], size[1], format,
-                                           int(has_alpha or 0)))
-            self.texdata += ''.join([chr(tex[n] | (tex[n+1] << 4))
-                                     for n in xrange(0, len(tex), 2)])
+            self.texparams.append(TexParam(ofs, size[0], size[1],
+                                           formats[mapidx], color0))
+            self.texdata += (tex[0::2] | (tex[1::2] << 4)).tostring()
             ofs = len(self.texdata)
             if ofs % 8:
                 self.texdata += '\x00'*(8 - (ofs % 8))  # Align
@@ -346,15 +395,32 @@ class TEX(ArchiveList):
                 pal = palettes[i]
             except KeyError:
                 pal = palettes[0]
-            self.paldata += ''.join(pal)
-            for j in range(len(pal), 16):
-                self.paldata += '\x00\x00'
+            self.paldata += pal.astype('<u2').tostring()
+            self.paldata += '\x00\x00'*(16-len(pal))
         for i in xrange(num):
             if i in palettes:
                 ofs = i*32
             else:
                 ofs = 0
             self.palparams.append(PalParam(ofs, 0))
+        # 4x4 palette indexes count color pairs from the PalParam offset,
+        # which stays shared with the 16-color images of that palidx
+        bases = {}
+        for palidx, block in sorted(palettes4x4.items()):
+            ofs = len(self.paldata)
+            if ofs % 8:
+                self.paldata += '\x00'*(8 - (ofs % 8))  # Align
+            bases[palidx] = \
+                (len(self.paldata)-self.palparams[palidx].ofs) >> 2
+            for palette in block:
+                self.paldata += palette.astype('<u2').tostring()
+        for palidx, pidx, colorofs in pidxs4x4:
+            offsets = (pidx.astype(np.int64) & 0x3FFF)+bases[palidx] + \
+                (colorofs >> 1)
+            if offsets.size and offsets.max() > 0x3FFF:
+                raise OverflowError('Too many colors for 4x4 palette data')
+            self.tex4x4paldata += \
+                (offsets | (pidx & 0xC000)).astype('<u2').tostring()
         self.paldict.num = num
         self.texdict.num = num
         self._images = None
@@ -389,7 +455,10 @@ class TEX(ArchiveList):
         self.texdata = reader.read(self.texinfo._datasize)
         reader.seek(start+self.palinfo._dataofs)
         self.paldata = reader.read(self.palinfo._datasize)
-        # TODO 4x4
+        reader.seek(start+self.tex4x4info._dataofs)
+        self.tex4x4data = reader.read(self.tex4x4info._datasize)
+        reader.seek(start+self.tex4x4info._paldataofs)
+        self.tex4x4paldata = reader.read(self.tex4x4info._datasize >> 1)
         if size:
             reader.seek(start+size)
         self._images = None
@@ -439,6 +508,22 @@ class TEX(ArchiveList):
         with writer.seek(self.texinfo._datasize_ofs):
             writer.writeUInt16(size >> 3)  # texinfo datasize
 
+        writer.writeAlign(8)
+        ofs = writer.tell()-start
+        with writer.seek(self.tex4x4info._dataofs_ofs):
+            writer.writeUInt32(ofs)  # tex4x4info dataofs
+        datastart = writer.tell()
+        writer.write(self.tex4x4data)
+        writer.writeAlign(8)
+        size = writer.tell()-datastart
+        with writer.seek(self.tex4x4info._datasize_ofs):
+            writer.writeUInt16(size >> 3)  # tex4x4info datasize
+        ofs = writer.tell()-start
+        with writer.seek(self.tex4x4info._paldataofs_ofs):
+            writer.writeUInt32(ofs)  # tex4x4info paldataofs
+        writer.write(self.tex4x4paldata)
+        writer.writeAlign(8)
+
         writer.writeAlign(8)
         ofs = writer.tell()-start
         with writer.seek(self.palinfo._dataofs_ofs):
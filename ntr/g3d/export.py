@@ -0,0 +1,438 @@
+
+"""Export of BMD models to glTF and Wavefront OBJ
+
+The render commands of each model pick the material of every shape that is
+drawn. Shapes are decoded through the mesh cache of ntr.g3d.geometry and
+their textures are taken from the TEX embedded in the BMD, rendered to PNG
+files.
+
+Node transforms are not applied, so vertices stay in the space of the
+matrix slot they were drawn with. Map models only have a single node.
+"""
+
+from collections import namedtuple, OrderedDict
+import json
+
+import numpy as np
+
+from ntr.g3d import geometry
+from ntr.g3d.sbc import SBC_END, SBC_MAT, SBC_SHP, command_size
+
+TEXPARAM_REPEAT_S = 0x10000
+TEXPARAM_REPEAT_T = 0x20000
+TEXPARAM_FLIP_S = 0x40000
+TEXPARAM_FLIP_T = 0x80000
+
+POLYATTR_BACK = 0x40
+POLYATTR_FRONT = 0x80
+
+GL_FLOAT = 5126
+GL_UNSIGNED_INT = 5125
+GL_ARRAY_BUFFER = 34962
+GL_ELEMENT_ARRAY_BUFFER = 34963
+GL_CLAMP_TO_EDGE = 33071
+GL_MIRRORED_REPEAT = 33648
+GL_REPEAT = 10497
+GL_NEAREST = 9728
+
+Part = namedtuple('Part', 'model name material positions normals texcoords '
+                          'colors triangles')
+MaterialInfo = namedtuple('MaterialInfo', 'name color alpha texture '
+                                          'double_sided wrap')
+
+
+def _name(names, idx, default):
+    try:
+        name = names[idx].rstrip('\x00')
+    except IndexError:
+        name = ''
+    return name or default.format(idx)
+
+
+def draw_calls(model):
+    """Get the shapes drawn by the render commands of a model
+
+    Models without render commands draw each shape with the material of
+    the same index.
+
+    Parameters
+    ----------
+    model : Model
+
+    Returns
+    -------
+    calls : list of (int or None, int)
+        Material and shape index of each draw
+    """
+    sbc = model.sbc
+    calls = []
+    material = None
+    pos = 0
+    while pos < len(sbc):
+        op = sbc[pos] & 0x1F
+        size = command_size(sbc, pos)
+        pos += 1
+        if op == SBC_END:
+            break
+        elif op == SBC_MAT:
+            material = sbc[pos]
+        elif op == SBC_SHP:
+            calls.append((material, sbc[pos]))
+        pos += size
+    if not sbc:
+        num_materials = len(model.materials.materials)
+        calls = [(idx if idx < num_materials else None, idx)
+                 for idx in xrange(len(model.shapes.shapes))]
+    return calls
+
+
+def material_texture(bmd, model, material_idx):
+    """Find the texture and palette of a material in the TEX of a BMD
+
+    Parameters
+    ----------
+    bmd : BMD
+    model : Model
+    material_idx : int
+
+    Returns
+    -------
+    texidx : int or None
+        None if the material is untextured or its texture is missing
+    palidx : int or None
+    """
+    tex = bmd.tex
+    materials = model.materials
+    if not getattr(tex, 'loaded', False) or \
+            material_idx not in materials.tex_map:
+        return None, None
+    name = materials.texmatdict.names[materials.tex_map[material_idx]]
+    try:
+        texidx = [texname.rstrip('\x00') for texname in tex.texdict.names]\
+            .index(name.rstrip('\x00'))
+    except ValueError:
+        return None, None
+    palidx = None
+    if material_idx in materials.pal_map:
+        name = materials.palmatdict.names[materials.pal_map[material_idx]]
+        try:
+            palidx = [palname.rstrip('\x00')
+                      for palname in tex.paldict.names]\
+                .index(name.rstrip('\x00'))
+        except ValueError:
+            pass
+    return texidx, palidx
+
+
+def _texture_size(bmd, material, texidx):
+    if texidx is not None:
+        param = bmd.tex.texparams[texidx]
+        return param.width, param.height
+    if material.orig_width and material.orig_height:
+        return material.orig_width, material.orig_height
+    return None
+
+
+def _wrap(flags, repeat, flip):
+    if not flags & repeat:
+        return GL_CLAMP_TO_EDGE
+    elif flags & flip:
+        return GL_MIRRORED_REPEAT
+    return GL_REPEAT
+
+
+def _gx_color(value):
+    return tuple(((value >> shift) & 0x1F)/31.0 for shift in (0, 5, 10))
+
+
+class Scene(object):
+    """Meshes, materials and textures of every model of a BMD
+
+    Parameters
+    ----------
+    bmd : BMD
+
+    Attributes
+    ----------
+    parts : list of Part
+        Drawn shapes with positions scaled to world units, unit normals and
+        texture coordinates normalized to the texture size, from the top
+        left
+    materials : OrderedDict
+        MaterialInfo of each (model index, material index) used
+    textures : OrderedDict
+        PNG data of each texture file name
+    """
+    def __init__(self, bmd):
+        self.bmd = bmd
+        self.parts = []
+        self.materials = OrderedDict()
+        self.textures = OrderedDict()
+        self._texture_files = {}
+        for model_idx, model in enumerate(bmd.mdl.models):
+            self._add_model(model_idx, model)
+
+    def _add_texture(self, texidx, palidx):
+        key = (texidx, palidx)
+        if key in self._texture_files:
+            return self._texture_files[key]
+        tex = self.bmd.tex
+        name = _name(tex.texdict.names, texidx, 'texture_{0}')
+        filename = name+'.png'
+        if palidx is None:
+            palidx = 0
+        if filename in self.textures:
+            filename = '{0}_{1}.png'.format(
+                name, _name(tex.paldict.names, palidx, '{0}'))
+        self.textures[filename] = tex.get_png(texidx, palidx)
+        self._texture_files[key] = filename
+        return filename
+
+    def _add_material(self, model_idx, model, material_idx):
+        key = (model_idx, material_idx)
+        if key in self.materials or material_idx is None:
+            return
+        material = model.materials.materials[material_idx]
+        texidx, palidx = material_texture(self.bmd, model, material_idx)
+        texture = None
+        if texidx is not None:
+            texture = self._add_texture(texidx, palidx)
+        poly_attr = material.poly_attr
+        self.materials[key] = MaterialInfo(
+            _name(model.materials.matdict.names, material_idx,
+                  'material_{0}'),
+            _gx_color(material.diffuse), ((poly_attr >> 16) & 0x1F)/31.0,
+            texture,
+            poly_attr & (POLYATTR_BACK | POLYATTR_FRONT) ==
+            POLYATTR_BACK | POLYATTR_FRONT,
+            (_wrap(material.tex_param, TEXPARAM_REPEAT_S, TEXPARAM_FLIP_S),
+             _wrap(material.tex_param, TEXPARAM_REPEAT_T, TEXPARAM_FLIP_T)))
+
+    def _add_model(self, model_idx, model):
+        model_name = _name(self.bmd.mdl.mdldict.names, model_idx,
+                           'model_{0}')
+        scale = model.pos_scale_fx32/4096.0
+        for material_idx, shape_idx in draw_calls(model):
+            shape = model.shapes.shapes[shape_idx]
+            mesh = geometry.cached_mesh(shape.data)
+            if not len(mesh.triangles):
+                continue
+            self._add_material(model_idx, model, material_idx)
+            texcoords = None
+            if mesh.texcoords is not None and material_idx is not None:
+                material = model.materials.materials[material_idx]
+                size = _texture_size(
+                    self.bmd, material,
+                    material_texture(self.bmd, model, material_idx)[0])
+                if size is not None:
+                    texcoords = mesh.texcoords/np.array(size,
+                                                        dtype=np.float32)
+            normals = mesh.normals
+            if normals is not None:
+                lengths = np.sqrt((normals**2).sum(axis=1))[:, None]
+                normals = normals/np.where(lengths, lengths, 1)
+            self.parts.append(Part(
+                model_name, _name(model.shapes.shapedict.names, shape_idx,
+                                  'shape_{0}'),
+                (model_idx, material_idx), mesh.positions*scale,
+                normals, texcoords, mesh.colors, mesh.triangles))
+
+
+def _float_lines(prefix, values):
+    values = np.asarray(values)
+    line = prefix+' %.6f'*values.shape[1]+'\n'
+    return (line*len(values)) % tuple(values.ravel().tolist())
+
+
+def to_obj(bmd, name):
+    """Convert the models of a BMD to Wavefront OBJ
+
+    Each model is an object and each drawn shape a group. Vertex colors
+    are written after the position of vertices.
+
+    Parameters
+    ----------
+    bmd : BMD
+    name : string
+        Base name of the OBJ and MTL files
+
+    Returns
+    -------
+    files : OrderedDict
+        Data of each file name, including the textures
+    """
+    scene = Scene(bmd)
+    obj = ['mtllib {0}.mtl\n'.format(name)]
+    counts = [1, 1, 1]  # Next index of v, vt and vn
+    model_name = None
+    for part in scene.parts:
+        if part.model != model_name:
+            model_name = part.model
+            obj.append('o {0}\n'.format(model_name))
+        obj.append('g {0}\n'.format(part.name))
+        if part.colors is not None:
+            obj.append(_float_lines('v', np.hstack([part.positions,
+                                                    part.colors])))
+        else:
+            obj.append(_float_lines('v', part.positions))
+        indexes = [part.triangles+counts[0]]
+        counts[0] += len(part.positions)
+        if part.texcoords is not None:
+            # OBJ texture coordinates start at the bottom
+            obj.append(_float_lines('vt', part.texcoords*[1, -1]+[0, 1]))
+            indexes.append(part.triangles+counts[1])
+            counts[1] += len(part.texcoords)
+        if part.normals is not None:
+            obj.append(_float_lines('vn', part.normals))
+            indexes.append(part.triangles+counts[2])
+            counts[2] += len(part.normals)
+        if part.material in scene.materials:
+            obj.append('usemtl {0}\n'.format(
+                scene.materials[part.material].name))
+        if len(indexes) == 1:
+            corner = '%d'
+        elif part.normals is None:
+            corner = '%d/%d'
+        elif part.texcoords is None:
+            corner = '%d//%d'
+        else:
+            corner = '%d/%d/%d'
+        line = 'f'+(' '+corner)*3+'\n'
+        faces = np.stack(indexes, axis=-1)
+        obj.append((line*len(faces)) % tuple(faces.ravel().tolist()))
+    mtl = []
+    for info in scene.materials.values():
+        mtl.append('newmtl {0}\n'.format(info.name))
+        mtl.append('Kd {0:.6f} {1:.6f} {2:.6f}\n'.format(*info.color))
+        mtl.append('d {0:.6f}\n'.format(info.alpha))
+        if info.texture is not None:
+            mtl.append('map_Kd {0}\n'.format(info.texture))
+        mtl.append('\n')
+    files = OrderedDict()
+    files[name+'.obj'] = ''.join(obj)
+    files[name+'.mtl'] = ''.join(mtl)
+    files.update(scene.textures)
+    return files
+
+
+class _GLTFBuffer(object):
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+        self.views = []
+        self.accessors = []
+
+    def add(self, values, component, type_, target, bounds=False):
+        data = values.tostring()
+        self.views.append({'buffer': 0, 'byteOffset': self.size,
+                           'byteLength': len(data), 'target': target})
+        accessor = {'bufferView': len(self.views)-1,
+                    'componentType': component, 'count': len(values),
+                    'type': type_}
+        if bounds:
+            accessor['min'] = values.min(axis=0).tolist()
+            accessor['max'] = values.max(axis=0).tolist()
+        self.accessors.append(accessor)
+        data += '\x00'*(-len(data) % 4)
+        self.chunks.append(data)
+        self.size += len(data)
+        return len(self.accessors)-1
+
+
+def to_gltf(bmd, name):
+    """Convert the models of a BMD to glTF 2.0
+
+    Each model is a node with a mesh and each drawn shape a primitive of
+    it. Vertex data is stored in a separate binary file.
+
+    Parameters
+    ----------
+    bmd : BMD
+    name : string
+        Base name of the glTF and binary files
+
+    Returns
+    -------
+    files : OrderedDict
+        Data of each file name, including the textures
+    """
+    scene = Scene(bmd)
+    buffer = _GLTFBuffer()
+    images = OrderedDict((filename, idx) for idx, filename
+                         in enumerate(scene.textures))
+    samplers = OrderedDict()
+    textures = OrderedDict()
+    materials = OrderedDict()
+    meshes = OrderedDict()
+    for part in scene.parts:
+        attributes = {'POSITION': buffer.add(
+            part.positions.astype('<f4'), GL_FLOAT, 'VEC3', GL_ARRAY_BUFFER,
+            True)}
+        if part.normals is not None:
+            attributes['NORMAL'] = buffer.add(
+                part.normals.astype('<f4'), GL_FLOAT, 'VEC3',
+                GL_ARRAY_BUFFER)
+        if part.texcoords is not None:
+            attributes['TEXCOORD_0'] = buffer.add(
+                part.texcoords.astype('<f4'), GL_FLOAT, 'VEC2',
+                GL_ARRAY_BUFFER)
+        if part.colors is not None:
+            attributes['COLOR_0'] = buffer.add(
+                part.colors.astype('<f4'), GL_FLOAT, 'VEC3',
+                GL_ARRAY_BUFFER)
+        primitive = {'attributes': attributes, 'indices': buffer.add(
+            part.triangles.ravel().astype('<u4'), GL_UNSIGNED_INT,
+            'SCALAR', GL_ELEMENT_ARRAY_BUFFER)}
+        info = scene.materials.get(part.material)
+        if info is not None:
+            # Vertex colors replace the diffuse color of the material
+            key = part.material+(part.colors is not None, )
+            if key not in materials:
+                material = {'name': info.name, 'pbrMetallicRoughness': {
+                    'baseColorFactor': [1.0]*3+[info.alpha]
+                    if part.colors is not None else
+                    list(info.color)+[info.alpha],
+                    'metallicFactor': 0.0, 'roughnessFactor': 1.0},
+                    'doubleSided': info.double_sided}
+                if info.alpha < 1:
+                    material['alphaMode'] = 'BLEND'
+                elif info.texture is not None:
+                    material['alphaMode'] = 'MASK'
+                if info.texture is not None:
+                    sampler = samplers.setdefault(info.wrap, len(samplers))
+                    texture = textures.setdefault(
+                        (images[info.texture], sampler), len(textures))
+                    material['pbrMetallicRoughness']['baseColorTexture'] = \
+                        {'index': texture}
+                materials[key] = (len(materials), material)
+            primitive['material'] = materials[key][0]
+        meshes.setdefault(part.model, []).append(primitive)
+    gltf = OrderedDict()
+    gltf['asset'] = {'version': '2.0', 'generator': 'PPRE'}
+    gltf['scene'] = 0
+    gltf['scenes'] = [{'nodes': range(len(meshes))}]
+    gltf['nodes'] = [{'name': model_name, 'mesh': idx}
+                     for idx, model_name in enumerate(meshes)]
+    gltf['meshes'] = [{'name': model_name, 'primitives': primitives}
+                      for model_name, primitives in meshes.items()]
+    gltf['materials'] = [material for idx, material in materials.values()]
+    gltf['textures'] = [{'source': image, 'sampler': sampler}
+                        for image, sampler in textures]
+    gltf['images'] = [{'uri': filename} for filename in images]
+    gltf['samplers'] = [{'magFilter': GL_NEAREST, 'wrapS': wrap[0],
+                         'wrapT': wrap[1]} for wrap in samplers]
+    gltf['accessors'] = buffer.accessors
+    gltf['bufferViews'] = buffer.views
+    gltf['buffers'] = [{'uri': name+'.bin', 'byteLength': buffer.size}]
+    for key in ('materials', 'textures', 'images', 'samplers'):
+        if not gltf[key]:
+            del gltf[key]
+    if not buffer.size:
+        for key in ('accessors', 'bufferViews', 'buffers'):
+            del gltf[key]
+    files = OrderedDict()
+    files[name+'.gltf'] = json.dumps(gltf, indent=1)
+    if buffer.size:
+        files[name+'.bin'] = ''.join(buffer.chunks)
+    files.update(scene.textures)
+    return files
@@ -0,0 +1,264 @@
+
+"""Decoding of shape display lists
+
+Shapes hold packed geometry commands: each word has four command bytes,
+lowest first, and is followed by the parameter words of those commands in
+order. Partial vertex commands reuse coordinates of the previous vertex,
+so the list is walked once to collect raw fixed point values per vertex,
+which are then converted together with NumPy.
+
+Decoded meshes are cached by a hash of their display list, so shapes
+shared between models or exported repeatedly are only decoded once.
+"""
+
+from collections import namedtuple
+import hashlib
+import struct
+
+import numpy as np
+
+from util.cache import LRUCache
+
+CMD_NOP = 0x00
+CMD_MTX_RESTORE = 0x14
+CMD_COLOR = 0x20
+CMD_NORMAL = 0x21
+CMD_TEXCOORD = 0x22
+CMD_VTX_16 = 0x23
+CMD_VTX_10 = 0x24
+CMD_VTX_XY = 0x25
+CMD_VTX_XZ = 0x26
+CMD_VTX_YZ = 0x27
+CMD_VTX_DIFF = 0x28
+CMD_DIF_AMB = 0x30
+CMD_BEGIN_VTXS = 0x40
+CMD_END_VTXS = 0x41
+
+PARAM_COUNTS = {
+    0x00: 0, 0x10: 1, 0x11: 0, 0x12: 1, 0x13: 1, 0x14: 1, 0x15: 0,
+    0x16: 16, 0x17: 12, 0x18: 16, 0x19: 12, 0x1A: 9, 0x1B: 3, 0x1C: 3,
+    0x20: 1, 0x21: 1, 0x22: 1, 0x23: 2, 0x24: 1, 0x25: 1, 0x26: 1, 0x27: 1,
+    0x28: 1, 0x29: 1, 0x2A: 1, 0x2B: 1, 0x30: 1, 0x31: 1, 0x32: 1, 0x33: 1,
+    0x34: 32, 0x40: 1, 0x41: 0, 0x50: 1, 0x60: 1, 0x70: 3, 0x71: 2, 0x72: 1,
+}
+
+PRIM_TRIANGLES = 0
+PRIM_QUADS = 1
+PRIM_TRIANGLE_STRIP = 2
+PRIM_QUAD_STRIP = 3
+
+DIF_AMB_VERTEX_COLOR = 0x8000
+
+Mesh = namedtuple('Mesh', 'positions normals texcoords colors matrices '
+                          'triangles')
+
+mesh_cache = LRUCache(1024)
+
+_QUAD_TRIANGLES = [0, 1, 2, 0, 2, 3]
+
+
+def _signed(value, bits):
+    value &= (1 << bits)-1
+    return value-((value >> (bits-1)) << bits)
+
+
+def _signed_array(values, shift, bits):
+    values = (values >> shift) & ((1 << bits)-1)
+    return values-((values >> (bits-1)) << bits)
+
+
+def commands(data):
+    """Unpack a display list
+
+    Parameters
+    ----------
+    data : string or array
+        Packed commands
+
+    Returns
+    -------
+    commands : generator of (int, list)
+        Command and its parameter words. Trailing NOPs are included.
+    """
+    if not isinstance(data, str):
+        data = data.tostring()
+    words = struct.unpack_from('<{0}I'.format(len(data) >> 2), data)
+    pos = 0
+    while pos < len(words):
+        packed = words[pos]
+        pos += 1
+        for shift in (0, 8, 16, 24):
+            cmd = (packed >> shift) & 0xFF
+            try:
+                count = PARAM_COUNTS[cmd]
+            except KeyError:
+                raise ValueError('Unknown geometry command 0x{0:02X}'
+                                 .format(cmd))
+            yield cmd, words[pos:pos+count]
+            pos += count
+
+
+def primitive_triangles(primitive, start, count):
+    """Get the triangles of a primitive
+
+    Parameters
+    ----------
+    primitive : int
+        PRIM_* type
+    start : int
+        Index of the first vertex
+    count : int
+        Number of vertices. Incomplete polygons are dropped.
+
+    Returns
+    -------
+    triangles : np.ndarray
+        (N, 3) vertex indexes, wound like the first polygon
+    """
+    if primitive == PRIM_TRIANGLES:
+        return np.arange(start, start+count-count % 3).reshape(-1, 3)
+    elif primitive == PRIM_QUADS:
+        quads = np.arange(start, start+count-count % 4).reshape(-1, 4)
+        return quads[:, _QUAD_TRIANGLES].reshape(-1, 3)
+    elif primitive == PRIM_TRIANGLE_STRIP:
+        first = start+np.arange(max(count-2, 0))
+        triangles = np.column_stack([first, first+1, first+2])
+        # Every other triangle of a strip is wound the other way
+        triangles[1::2, :2] = triangles[1::2, 1::-1]
+        return triangles
+    first = start+2*np.arange(max(count-2, 0) >> 1)
+    quads = np.column_stack([first, first+1, first+3, first+2])
+    return quads[:, _QUAD_TRIANGLES].reshape(-1, 3)
+
+
+def decode_mesh(data):
+    """Decode the vertices and triangles of a display list
+
+    Positions are in model units, before the position scale of the model.
+    Attributes that are never set by the display list are None.
+
+    Parameters
+    ----------
+    data : string or array
+        Packed commands
+
+    Returns
+    -------
+    mesh : Mesh
+        positions : (N, 3) float32
+        normals : (N, 3) float32 or None
+        texcoords : (N, 2) float32 or None
+            In texels
+        colors : (N, 3) float32 or None
+            RGB from 0 to 1
+        matrices : (N, ) uint8
+            Matrix stack slot restored for each vertex
+        triangles : (M, 3) uint32
+    """
+    vertex = [0, 0, 0]
+    color = 0x7FFF
+    normal = 0
+    texcoord = 0
+    matrix = 0
+    used = set()
+    positions = []
+    attributes = []  # (color, normal, texcoord, matrix) words per vertex
+    triangles = []
+    primitive = None
+    start = 0
+    for cmd, params in commands(data):
+        if CMD_VTX_16 <= cmd <= CMD_VTX_DIFF:
+            param = params[0]
+            if cmd == CMD_VTX_16:
+                vertex = [_signed(param, 16), _signed(param >> 16, 16),
+                          _signed(params[1], 16)]
+            elif cmd == CMD_VTX_10:
+                vertex = [_signed(param >> shift, 10) << 6
+                          for shift in (0, 10, 20)]
+            elif cmd == CMD_VTX_XY:
+                vertex = [_signed(param, 16), _signed(param >> 16, 16),
+                          vertex[2]]
+            elif cmd == CMD_VTX_XZ:
+                vertex = [_signed(param, 16), vertex[1],
+                          _signed(param >> 16, 16)]
+            elif cmd == CMD_VTX_YZ:
+                vertex = [vertex[0], _signed(param, 16),
+                          _signed(param >> 16, 16)]
+            else:
+                vertex = [value+_signed(param >> shift, 10)
+                          for value, shift in zip(vertex, (0, 10, 20))]
+            positions.append(vertex)
+            attributes.append((color, normal, texcoord, matrix))
+        elif cmd == CMD_COLOR:
+            color = params[0]
+            used.add(cmd)
+        elif cmd == CMD_DIF_AMB:
+            if params[0] & DIF_AMB_VERTEX_COLOR:
+                color = params[0]
+                used.add(CMD_COLOR)
+        elif cmd == CMD_NORMAL:
+            normal = params[0]
+            used.add(cmd)
+        elif cmd == CMD_TEXCOORD:
+            texcoord = params[0]
+            used.add(cmd)
+        elif cmd == CMD_MTX_RESTORE:
+            matrix = params[0] & 0x1F
+        elif cmd in (CMD_BEGIN_VTXS, CMD_END_VTXS):
+            if primitive is not None:
+                triangles.append(primitive_triangles(
+                    primitive, start, len(positions)-start))
+            primitive = params[0] & 0x3 if cmd == CMD_BEGIN_VTXS else None
+            start = len(positions)
+    if primitive is not None:
+        triangles.append(primitive_triangles(primitive, start,
+                                             len(positions)-start))
+
+    positions = np.array(positions, dtype=np.float32).reshape(-1, 3)
+    positions /= 4096
+    attributes = np.array(attributes, dtype=np.int64).reshape(-1, 4)
+    colors = normals = texcoords = None
+    if CMD_COLOR in used:
+        colors = np.column_stack([
+            (attributes[:, 0] >> shift) & 0x1F for shift in (0, 5, 10)
+        ]).astype(np.float32)/31
+    if CMD_NORMAL in used:
+        normals = np.column_stack([
+            _signed_array(attributes[:, 1], shift, 10)
+            for shift in (0, 10, 20)]).astype(np.float32)/512
+    if CMD_TEXCOORD in used:
+        texcoords = np.column_stack([
+            _signed_array(attributes[:, 2], shift, 16)
+            for shift in (0, 16)]).astype(np.float32)/16
+    if triangles:
+        triangles = np.concatenate(triangles).astype(np.uint32)
+    else:
+        triangles = np.zeros((0, 3), dtype=np.uint32)
+    return Mesh(positions, normals, texcoords, colors,
+                attributes[:, 3].astype(np.uint8), triangles)
+
+
+def cached_mesh(data):
+    """Decode a display list, reusing the mesh of an identical list
+
+    The arrays of the mesh are shared and read-only.
+
+    Parameters
+    ----------
+    data : string or array
+        Packed commands
+
+    Returns
+    -------
+    mesh : Mesh
+    """
+    if not isinstance(data, str):
+        data = data.tostring()
+
+    def decode():
+        mesh = decode_mesh(data)
+        for values in mesh:
+            if values is not None:
+                values.setflags(write=False)
+        return mesh
+    return mesh_cache.get(hashlib.sha1(data).digest(), decode)
@@ -1,31 +1,82 @@
 
 from compileengine import Decompiler, Variable
 
+SBC_END = 0x01
+SBC_NODE = 0x02
+SBC_MTX = 0x03
+SBC_MAT = 0x04
+SBC_SHP = 0x05
+SBC_NODEDESC = 0x06
+SBC_BB = 0x07
+SBC_BBY = 0x08
+SBC_NODEMIX = 0x09
+SBC_CALLDL = 0x0A
+SBC_POSSCALE = 0x0B
+
+# Size of the parameters of each command without its option bits
+SBC_PARAM_SIZES = {
+    0x00: 0, SBC_END: 0, SBC_NODE: 2, SBC_MTX: 1, SBC_MAT: 1, SBC_SHP: 1,
+    SBC_NODEDESC: 3, SBC_BB: 1, SBC_BBY: 1, SBC_CALLDL: 8, SBC_POSSCALE: 0,
+}
+
+
+def command_size(sbc, pos):
+    """Get the size of the parameters of a render command
+
+    Parameters
+    ----------
+    sbc : sequence of int
+        Render commands
+    pos : int
+        Position of the command byte
+
+    Returns
+    -------
+    size : int
+        Number of parameter bytes following the command byte
+
+    Raises
+    ------
+    ValueError
+        If the command is unknown
+    """
+    op = sbc[pos] & 0x1F
+    opt = sbc[pos] >> 5
+    if op == SBC_NODEMIX:
+        return 2+3*sbc[pos+2]
+    elif op in (SBC_NODEDESC, SBC_BB, SBC_BBY):
+        return SBC_PARAM_SIZES[op]+(opt & 1)+(opt >> 1 & 1)
+    try:
+        return SBC_PARAM_SIZES[op]
+    except KeyError:
+        raise ValueError('Unknown render command 0x{0:02X}'.format(sbc[pos]))
+
 
 class SBC(Decompiler):
     matrices = {}
 
     def parse_next(self):
         cmd = self.read_value(1)
-        if not cmd:
+        op = cmd & 0x1F
+        opt = cmd >> 5
+        if not op:
             return []
-        elif cmd == 0x1:
+        elif op == SBC_END:
             return [self.end()]
-        elif cmd == 0x2:
+        elif op == SBC_NODE:
             node_id = self.read_value(1)
             visible = bool(self.read_value(1))
             return [self.func('node', node_id, visible)]
-        elif cmd == 0b11:
+        elif op == SBC_MTX:
             matrix_id = self.read_value(1)
             return [self.func('matrix', matrix_id)]
-        elif cmd == 0b100:
+        elif op == SBC_MAT:
             material_id = self.read_value(1)
             return [self.func('material', material_id)]
-        elif cmd == 0b101:
+        elif op == SBC_SHP:
             shape_id = self.read_value(1)
             return [self.func('shape', shape_id)]
-        elif cmd == 0b110:
-            opt = cmd >> 5
+        elif op == SBC_NODEDESC:
             node_id = self.read_value(1)
             parent_id = self.read_value(1)
             value = self.read_value(1)
@@ -40,8 +91,7 @@ class SBC(Decompiler):
             if dest is not None:
                 expr = self.assign(dest, expr)
             return [expr]
-        elif cmd == 0b111:
-            opt = cmd >> 5
+        elif op == SBC_BB:
             node_id = self.read_value(1)
             args = [node_id]
             dest = None
@@ -54,8 +104,7 @@ class SBC(Decompiler):
             if dest is not None:
                 expr = self.assign(dest, expr)
             return [expr]
-        elif cmd & 0b11111 == 0b01011:
-            opt = cmd >> 5
+        elif op == SBC_POSSCALE:
             if opt == 0:
                 return [self.func('scale')]
             elif opt == 1:
@@ -0,0 +1,412 @@
+
+"""Decoding of TEX0 texture data
+
+Texels are expanded with NumPy bit operations into palette index and alpha
+arrays, which are turned into RGBA by gathering from the palette.
+"""
+
+import numpy as np
+
+from util.colors import bgr555_to_rgba
+
+FORMAT_A3I5 = 1
+FORMAT_I2 = 2
+FORMAT_I4 = 3
+FORMAT_I8 = 4
+FORMAT_4X4 = 5
+FORMAT_A5I3 = 6
+FORMAT_DIRECT = 7
+
+BITS_PER_TEXEL = {
+    FORMAT_A3I5: 8,
+    FORMAT_I2: 2,
+    FORMAT_I4: 4,
+    FORMAT_I8: 8,
+    FORMAT_4X4: 2,
+    FORMAT_A5I3: 8,
+    FORMAT_DIRECT: 16,
+}
+
+
+def texel_data(data, ofs, format, width, height):
+    """Get the bytes of a texture, padded with zeros if truncated
+
+    Returns
+    -------
+    texels : np.ndarray
+        uint8 array
+    """
+    size = width*height*BITS_PER_TEXEL[format] >> 3
+    texels = np.zeros(size, dtype=np.uint8)
+    chunk = np.frombuffer(data[ofs:ofs+size], dtype=np.uint8)
+    texels[:len(chunk)] = chunk
+    return texels
+
+
+def unpack_bits(texels, bits):
+    """Split bytes into values of bits each, lowest bits first"""
+    shifts = np.arange(0, 8, bits, dtype=np.uint8)
+    return ((texels[:, None] >> shifts) & ((1 << bits)-1)).ravel()
+
+
+def decode_indexed(data, ofs, format, width, height, color0=False):
+    """Decode a paletted texture
+
+    Parameters
+    ----------
+    data : string
+        Texture data block
+    ofs : int
+        Offset of the texture in data
+    format : int
+        One of FORMAT_A3I5, FORMAT_I2, FORMAT_I4, FORMAT_I8, FORMAT_A5I3
+    width : int
+    height : int
+    color0 : bool
+        If set, index 0 is transparent
+
+    Returns
+    -------
+    indexes : np.ndarray
+        (height, width) uint8 palette indexes
+    alpha : np.ndarray
+        (height, width) uint8 alpha values
+    """
+    texels = texel_data(data, ofs, format, width, height)
+    if format == FORMAT_A3I5:
+        indexes = texels & 0x1F
+        alpha = (texels >> 5)*np.uint8(36)
+    elif format == FORMAT_A5I3:
+        indexes = texels & 0x7
+        alpha = (texels >> 3)*np.uint8(8)
+    elif format == FORMAT_I2:
+        indexes = unpack_bits(texels, 2)
+        alpha = np.full(indexes.shape, 255, dtype=np.uint8)
+    elif format == FORMAT_I4:
+        indexes = unpack_bits(texels, 4)
+        alpha = np.full(indexes.shape, 255, dtype=np.uint8)
+    elif format == FORMAT_I8:
+        indexes = texels
+        alpha = np.full(indexes.shape, 255, dtype=np.uint8)
+    else:
+        raise ValueError('Unhandled format: %d' % format)
+    if color0:
+        alpha[indexes == 0] = 0
+    return indexes.reshape(height, width), alpha.reshape(height, width)
+
+
+def decode_direct(data, ofs, width, height):
+    """Decode a direct color texture to an (height, width, 4) RGBA array
+
+    Texels are BGR555 with bit 15 set for opaque texels.
+    """
+    values = texel_data(data, ofs, FORMAT_DIRECT, width, height)\
+        .view('<u2')
+    rgba = bgr555_to_rgba(values)
+    rgba[:, 3] = np.where(values & 0x8000, 255, 0)
+    return rgba.reshape(height, width, 4)
+
+
+def apply_palette(indexes, alpha, palette):
+    """Gather RGBA colors of indexes from a palette
+
+    Parameters
+    ----------
+    indexes : np.ndarray
+        (height, width) palette indexes
+    alpha : np.ndarray
+        (height, width) alpha values
+    palette : np.ndarray
+        (colors, 4) RGBA palette. Missing colors are black
+
+    Returns
+    -------
+    rgba : np.ndarray
+        (height, width, 4) array
+    """
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    lut[:len(palette)] = palette[:256]
+    rgba = lut[indexes]
+    rgba[..., 3] = alpha
+    return rgba
+
+
+def decode_4x4(data, pidx_data, ofs, width, height):
+    """Decode the texels of a 4x4 compressed texture
+
+    Parameters
+    ----------
+    data : string
+        Compressed texel data block
+    pidx_data : string
+        Palette index data block. Each block's entry is at ofs/2
+    ofs : int
+        Offset of the texture in data
+    width : int
+    height : int
+
+    Returns
+    -------
+    selectors : np.ndarray
+        (height, width) uint8 color selectors, 0 to 3
+    blocks : np.ndarray
+        (height/4, width/4) uint16 palette index entries. The palette
+        offset in units of 2 colors is in bits 0-13 and the mode in
+        bits 14-15
+    """
+    texels = texel_data(data, ofs, FORMAT_4X4, width, height)
+    rows = height >> 2
+    cols = width >> 2
+    selectors = unpack_bits(texels, 2).reshape(rows, cols, 4, 4)\
+        .swapaxes(1, 2).reshape(height, width)
+    blocks = np.zeros(rows*cols, dtype=np.uint16)
+    chunk = pidx_data[ofs >> 1:(ofs >> 1)+rows*cols*2]
+    chunk = np.frombuffer(chunk[:len(chunk) & ~1], dtype='<u2')
+    blocks[:len(chunk)] = chunk
+    return selectors, blocks.reshape(rows, cols)
+
+
+def block_colors_4x4(blocks, palette):
+    """Get the four 5-bit RGB colors of each block
+
+    Modes 0 and 1 have a transparent fourth color. Modes 1 and 3
+    interpolate from their first two colors.
+
+    Returns
+    -------
+    colors : np.ndarray
+        (..., 4, 3) int32 array
+    """
+    palette = np.asarray(palette, dtype=np.uint8)
+    base = (blocks & 0x3FFF).astype(np.intp)*2
+    mode = blocks >> 14
+    count = int(base.max())+4 if base.size else 4
+    lut = np.zeros((count, 3), dtype=np.int32)
+    lut[:min(count, len(palette))] = palette[:count, :3] >> 3
+    colors = lut[base[..., None]+np.arange(4)]
+    c0 = colors[..., 0, :]
+    c1 = colors[..., 1, :]
+    half = mode == 1
+    colors[half, 2] = (c0[half]+c1[half]) >> 1
+    full = mode == 3
+    colors[full, 2] = (c0[full]*5+c1[full]*3) >> 3
+    colors[full, 3] = (c0[full]*3+c1[full]*5) >> 3
+    colors[mode < 2, 3] = 0
+    return colors
+
+
+def apply_palette_4x4(selectors, blocks, palette):
+    """Build the RGBA colors of a 4x4 compressed texture
+
+    Parameters
+    ----------
+    selectors : np.ndarray
+        (height, width) color selectors
+    blocks : np.ndarray
+        (height/4, width/4) palette index entries
+    palette : np.ndarray
+        (colors, 4) RGBA palette starting at the texture's palette offset
+
+    Returns
+    -------
+    rgba : np.ndarray
+        (height, width, 4) array
+    """
+    colors = np.empty(blocks.shape+(4, 4), dtype=np.uint8)
+    colors[..., :3] = block_colors_4x4(blocks, palette) << 3
+    colors[..., 3] = 255
+    colors[(blocks >> 14) < 2, 3, 3] = 0
+    height, width = selectors.shape
+    rows = (np.arange(height) >> 2)[:, None]
+    cols = (np.arange(width) >> 2)[None, :]
+    return colors[rows, cols, selectors]
+
+
+def _interpolate(c0, c1, transparent):
+    """Candidate colors of interpolating blocks, matching block_colors_4x4
+
+    Returns
+    -------
+    colors : np.ndarray
+        (N, 4, 3) array. The fourth color of transparent blocks repeats
+        the third so that it is never the closest opaque match
+    """
+    colors = np.empty((len(c0), 4, 3), dtype=np.int32)
+    colors[:, 0] = c0
+    colors[:, 1] = c1
+    colors[:, 2] = np.where(transparent[:, None], (c0+c1) >> 1,
+                            (c0*5+c1*3) >> 3)
+    colors[:, 3] = np.where(transparent[:, None], colors[:, 2],
+                            (c0*3+c1*5) >> 3)
+    return colors
+
+
+def _select(pixels, colors):
+    """Find the closest color of each pixel
+
+    Returns
+    -------
+    selectors : np.ndarray
+        (N, 16) indexes into colors
+    error : np.ndarray
+        (N, ) total squared error of each block
+    """
+    distance = ((pixels[:, :, None, :]-colors[:, None, :, :])**2).sum(-1)
+    selectors = distance.argmin(-1)
+    error = distance.min(-1)
+    return selectors, error
+
+
+def _fit(pixels, selectors, opaque, weights):
+    """Least squares endpoints for a selection of interpolated colors
+
+    Parameters
+    ----------
+    weights : np.ndarray
+        (N, 4) weight of the first endpoint in each block's colors
+
+    Returns
+    -------
+    c0, c1 : np.ndarray
+        (N, 3) endpoints, or None for blocks that cannot be solved
+    solved : np.ndarray
+        (N, ) bool
+    """
+    w0 = np.take_along_axis(weights, selectors, 1)*opaque
+    w1 = (1-np.take_along_axis(weights, selectors, 1))*opaque
+    a = (w0*w0).sum(1)
+    b = (w0*w1).sum(1)
+    c = (w1*w1).sum(1)
+    x = (w0[:, :, None]*pixels).sum(1)
+    y = (w1[:, :, None]*pixels).sum(1)
+    det = a*c-b*b
+    solved = det > 1e-6
+    det = np.where(solved, det, 1)[:, None]
+    c0 = (c[:, None]*x-b[:, None]*y)/det
+    c1 = (a[:, None]*y-b[:, None]*x)/det
+    c0 = np.clip(np.rint(c0), 0, 31).astype(np.int32)
+    c1 = np.clip(np.rint(c1), 0, 31).astype(np.int32)
+    return c0, c1, solved
+
+
+def encode_4x4(rgba, quality=1):
+    """Compress an RGBA image to 4x4 texel blocks
+
+    Blocks with few enough distinct colors are stored exactly with
+    explicit palette colors. The rest interpolate between the two most
+    distant colors of the block, which are then refined by least squares.
+    Pixels with alpha below 128 are transparent.
+
+    Parameters
+    ----------
+    rgba : array-like
+        (height, width, 4) image or an RGBA PIL Image. Dimensions must be
+        multiples of 4
+    quality : int
+        Number of endpoint refinement passes. 0 is fastest
+
+    Returns
+    -------
+    texels : string
+        Compressed texel data
+    pidx : string
+        Palette index data
+    palette : np.ndarray
+        uint16 BGR555 colors referenced by pidx
+
+    Raises
+    ------
+    OverflowError
+        If the palette would exceed the 0x4000 addressable color pairs
+    """
+    rgba = np.asarray(rgba, dtype=np.uint8)
+    height, width = rgba.shape[:2]
+    rows = height >> 2
+    cols = width >> 2
+    num = rows*cols
+    pixels = rgba.reshape(rows, 4, cols, 4, 4).swapaxes(1, 2)\
+        .reshape(num, 16, 4)
+    opaque = pixels[:, :, 3] >= 128
+    pixels = (pixels[:, :, :3] >> 3).astype(np.int32)
+    transparent = ~opaque.all(1)
+    values = pixels[:, :, 0] | (pixels[:, :, 1] << 5) | \
+        (pixels[:, :, 2] << 10)
+
+    # Distinct opaque colors, 0x8000 marks transparent pixels
+    ordered = np.sort(np.where(opaque, values, 0x8000), 1)
+    first = np.ones(ordered.shape, dtype=bool)
+    first[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    first &= ordered != 0x8000
+    count = first.sum(1)
+    rank = np.cumsum(first, 1)-1
+    distinct = np.zeros((num, 4), dtype=np.int32)
+    block_ids, pixel_ids = np.nonzero(first & (rank < 4))
+    distinct[block_ids, rank[block_ids, pixel_ids]] = \
+        ordered[block_ids, pixel_ids]
+    distinct[count == 0] = 0
+    explicit = (count > 2) & (count <= np.where(transparent, 3, 4))
+
+    # Endpoints: the two colors are used directly, otherwise the most
+    # distant pair of opaque pixels
+    distance = ((pixels[:, :, None, :]-pixels[:, None, :, :])**2).sum(-1)
+    distance[~opaque] = -1
+    distance.transpose(0, 2, 1)[~opaque] = -1
+    pair = distance.reshape(num, 256).argmax(1)
+    c0 = pixels[np.arange(num), pair >> 4]
+    c1 = pixels[np.arange(num), pair & 0xF]
+    explicit_colors = np.stack([distinct & 0x1F, (distinct >> 5) & 0x1F,
+                                (distinct >> 10) & 0x1F], -1)
+    few = count <= 2
+    c0[few] = explicit_colors[few, 0]
+    c1[few] = explicit_colors[few, np.where(count == 2, 1, 0)[few]]
+
+    colors = _interpolate(c0, c1, transparent)
+    selectors, error = _select(pixels, colors)
+    error = (error*opaque).sum(1)
+    weights = np.where(transparent[:, None], [1, 0, 0.5, 0.5],
+                       [1, 0, 0.625, 0.375])
+    for unused in xrange(quality):
+        new_c0, new_c1, solved = _fit(pixels, selectors, opaque, weights)
+        new_colors = _interpolate(new_c0, new_c1, transparent)
+        new_selectors, new_error = _select(pixels, new_colors)
+        new_error = (new_error*opaque).sum(1)
+        better = solved & (new_error < error)
+        if not better.any():
+            break
+        c0[better] = new_c0[better]
+        c1[better] = new_c1[better]
+        selectors[better] = new_selectors[better]
+        error[better] = new_error[better]
+
+    # Explicit colors are matched exactly
+    explicit_selectors = _select(pixels, explicit_colors)[0]
+    selectors[explicit] = explicit_selectors[explicit]
+    selectors[~opaque] = 3
+
+    # Shared palette: explicit blocks first as 4 colors, then pairs
+    packed0 = c0[:, 0] | (c0[:, 1] << 5) | (c0[:, 2] << 10)
+    packed1 = c1[:, 0] | (c1[:, 1] << 5) | (c1[:, 2] << 10)
+    keys = np.where(
+        explicit,
+        distinct[:, 0].astype(np.int64) |
+        (distinct[:, 1].astype(np.int64) << 15) |
+        (distinct[:, 2].astype(np.int64) << 30) |
+        (distinct[:, 3].astype(np.int64) << 45),
+        packed0.astype(np.int64) | (packed1.astype(np.int64) << 15))
+    quads, quad_ids = np.unique(keys[explicit], return_inverse=True)
+    pairs, pair_ids = np.unique(keys[~explicit], return_inverse=True)
+    offsets = np.empty(num, dtype=np.int64)
+    offsets[explicit] = quad_ids*2
+    offsets[~explicit] = len(quads)*2+pair_ids
+    if num and offsets.max() > 0x3FFF:
+        raise OverflowError('Too many colors for 4x4 palette data')
+    shifts = np.arange(0, 60, 15)
+    palette = np.concatenate([
+        ((quads[:, None] >> shifts) & 0x7FFF).ravel(),
+        ((pairs[:, None] >> shifts[:2]) & 0x7FFF).ravel()
+    ]).astype(np.uint16)
+
+    modes = np.where(explicit, 2, 3)-transparent*2
+    pidx = (offsets | (modes << 14)).astype('<u2')
+    texels = (selectors.reshape(num*4, 4) << np.arange(0, 8, 2)).sum(1)
+    return texels.astype(np.uint8).tostring(), pidx.tostring(), palette
@@ -1,13 +1,23 @@
-"""Sound Data Archive"""
+"""Sound Data Archive
+
+Members of the FILE block are only read from the archive when they are
+accessed, and members that were not replaced are copied from it as raw
+ranges when the archive is saved. Each record type has an index of its
+entry names, so single sequences or banks can be looked up without
+touching any wave data.
+"""
 
 import array
-from itertools import izip
+from collections import MutableMapping, OrderedDict
 import os
 
 from generic import Editable
 from generic.archive import Archive
 from generic.collection import SizedCollection
-from util import BinaryIO
+from util import BinaryIO, map_file
+
+COPY_CHUNK = 0x100000
+FILE_ALIGN = 0x20
 
 
 class SYMB(Editable):
@@ -24,12 +34,14 @@ class SYMB(Editable):
         self.uint32('size')
         self.array('record_offsets', self.uint32, length=14)
         self.records = {}
+        self.archive_names = []
 
     def load(self, reader):
         reader = BinaryIO.reader(reader)
         start = reader.tell()
         Editable.load(self, reader)
         self.records = {}
+        self.archive_names = []
         for record_ofs, record_name in zip(self.record_offsets,
                                            self.record_names):
             if not record_ofs:
@@ -44,9 +56,11 @@ class SYMB(Editable):
                 for i, (offset, sub_offset) in enumerate(offsets):
                     reader.seek(start+offset)
                     name = reader.readString()
+                    self.archive_names.append(name)
                     reader.seek(start+sub_offset)
                     prefix = (record_name, name)
-                    entries += self.load_entries(reader, start, prefix, num)
+                    entries += self.load_entries(reader, start, prefix,
+                                                 reader.readUInt32())
             else:
                 entries = self.load_entries(reader, start, (record_name,), num)
             self.records[record_name] = entries
@@ -277,6 +291,108 @@ class FAT(Editable):
             reader.read(8)
             self.entries.append(slice(start, stop))
 
+    def save(self, writer=None):
+        self.num = len(self.entries)
+        self.size_ = self.get_size()+16*self.num
+        writer = Editable.save(self, writer)
+        for entry in self.entries:
+            writer.writeUInt32(entry.start)
+            writer.writeUInt32(entry.stop-entry.start)
+            writer.writeUInt32(0)
+            writer.writeUInt32(0)
+        return writer
+
+
+def copy_range(reader, start, size, writer):
+    """Copy data from a reader to a writer in chunks"""
+    with reader.seek(start):
+        while size > 0:
+            chunk = reader.read(min(size, COPY_CHUNK))
+            if not chunk:
+                raise ValueError('Source ends before the end of the range')
+            writer.write(chunk)
+            size -= len(chunk)
+
+
+class Members(object):
+    """Data of the FILE block, read from the archive when accessed
+
+    Only replaced and added members are held in memory.
+
+    Parameters
+    ----------
+    reader : BinaryIO or None
+        Reader of the archive. It has to stay open while members are used
+    entries : list of slice
+        Range of each member in reader
+    """
+    def __init__(self, reader=None, entries=()):
+        self.reader = reader
+        self.entries = list(entries)
+        self.replaced = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        for idx in xrange(len(self)):
+            yield self[idx]
+
+    def _index(self, idx):
+        return xrange(len(self.entries))[idx]
+
+    def __getitem__(self, idx):
+        idx = self._index(idx)
+        try:
+            return self.replaced[idx]
+        except KeyError:
+            entry = self.entries[idx]
+        with self.reader.seek(entry.start):
+            return self.reader.read(entry.stop-entry.start)
+
+    def __setitem__(self, idx, data):
+        self.replaced[self._index(idx)] = data
+
+    def append(self, data):
+        self.replaced[len(self.entries)] = data
+        self.entries.append(None)
+
+    def size(self, idx):
+        idx = self._index(idx)
+        try:
+            return len(self.replaced[idx])
+        except KeyError:
+            return self.entries[idx].stop-self.entries[idx].start
+
+    def magic(self, idx):
+        """Get the first 4 bytes of a member without reading the rest"""
+        idx = self._index(idx)
+        try:
+            return self.replaced[idx][:4]
+        except KeyError:
+            entry = self.entries[idx]
+        with self.reader.seek(entry.start):
+            return self.reader.read(min(4, entry.stop-entry.start))
+
+    def is_replaced(self, idx):
+        return self._index(idx) in self.replaced
+
+    def revert(self):
+        """Drop all replaced members and members added since loading"""
+        self.replaced = {}
+        while self.entries and self.entries[-1] is None:
+            self.entries.pop()
+
+    def write(self, idx, writer):
+        """Write a member, copying it from the archive if not replaced"""
+        idx = self._index(idx)
+        try:
+            writer.write(self.replaced[idx])
+        except KeyError:
+            entry = self.entries[idx]
+            copy_range(self.reader, entry.start, entry.stop-entry.start,
+                       writer)
+
 
 class FILE(Editable):
     def define(self, sdat):
@@ -285,11 +401,80 @@ class FILE(Editable):
         self.uint32('size_')
         self.uint32('num')
         self.uint32('uc')
-        self.files = []
+        self.files = Members()
+
+    def save(self, writer=None, base=0):
+        """Write every member, aligned from base
+
+        The range of each member relative to base is stored in the FAT.
+        """
+        writer = BinaryIO.writer(writer)
+        start = writer.tell()
+        self.num = len(self.files)
+        writer = Editable.save(self, writer)
+        entries = []
+        for idx in xrange(len(self.files)):
+            writer.writeAlign(FILE_ALIGN)
+            ofs = writer.tell()-base
+            self.files.write(idx, writer)
+            entries.append(slice(ofs, writer.tell()-base))
+        writer.writeAlign(FILE_ALIGN)
+        self.sdat.fat.entries = entries
+        self.size_ = writer.tell()-start
+        with writer.seek(start):
+            writer = Editable.save(self, writer)
+        return writer
+
+
+class SDATFiles(MutableMapping):
+    """Members of an SDAT by "RECORD/name.ext"
+
+    Extensions are the lowercase magic of each member. Members can be
+    replaced, but not added or removed.
+    """
+    def __init__(self, sdat):
+        self.sdat = sdat
+        self.file_ids = OrderedDict()
+        for record_name in SYMB.record_names:
+            if record_name not in sdat.index:
+                continue
+            for name, record_id in sdat.index[record_name].iteritems():
+                try:
+                    file_id = sdat.file_id(record_name, record_id)
+                    magic = sdat.file.files.magic(file_id)
+                except IndexError:
+                    continue
+                self.file_ids['{0}/{1}.{2}'.format(
+                    record_name, name, magic.lower())] = file_id
+
+    def __getitem__(self, name):
+        return self.sdat.file.files[self.file_ids[name]]
+
+    def __setitem__(self, name, data):
+        try:
+            self.sdat.file.files[self.file_ids[name]] = data
+        except KeyError:
+            raise KeyError('{0} has no INFO entry'.format(name))
+
+    def __delitem__(self, name):
+        raise TypeError('SDAT members cannot be removed')
+
+    def __iter__(self):
+        return iter(self.file_ids)
+
+    def __len__(self):
+        return len(self.file_ids)
 
 
 class SDAT(Archive, Editable):
-    """Sound Data Archive"""
+    """Sound Data Archive
+
+    Attributes
+    ----------
+    index : dict
+        Record name => OrderedDict of entry name => record id. Entries
+        without a symbol are named by their id
+    """
     extension = ''  # filenames include their own extension
 
     def define(self):
@@ -297,71 +482,219 @@ class SDAT(Archive, Editable):
         self.uint16('endian', default=0xFEFF)
         self.uint16('version', default=0x0001)
         self.uint32('size_')
-        self.uint16('headersize')
+        self.uint16('headersize', default=0x40)
         self.uint16('numblocks', default=4)
         block_ofs = Editable()
         block_ofs.uint32('block_offset')
         block_ofs.uint32('block_size')
         block_ofs.freeze()
-        self.array('block_offsets', block_ofs.base_struct, length=8)
+        # Four blocks and 16 reserved bytes
+        self.array('block_offsets', block_ofs.base_struct, length=6)
         self.symb = SYMB(self)
         self.info = INFO(self)
         self.fat = FAT(self)
         self.file = FILE(self)
+        self.index = {}
         self._files = None
+        self._source = None
+        self._source_stat = None  # os.stat of the file _source maps
+        self._raw_blocks = {}  # magic => (offset, size) in _source
+
+    @classmethod
+    def from_file(cls, path):
+        """Load an archive from a file mapped into memory
+
+        The archive reads from the file until it is saved over it with
+        save_file.
+        """
+        with open(path, 'rb') as handle:
+            sdat = cls(reader=BinaryIO.adapter(map_file(handle)))
+            sdat._source_stat = os.fstat(handle.fileno())
+        return sdat
+
+    def _is_source(self, stat):
+        source = self._source_stat
+        return source is not None and \
+            (stat.st_dev, stat.st_ino) == (source.st_dev, source.st_ino)
+
+    def detach(self):
+        """Read everything the archive still reads from its source
+
+        The source can be overwritten afterwards.
+        """
+        source = self._source
+        if source is None:
+            return
+        with source.seek(0, 2):
+            size = source.tell()
+        with source.seek(0):
+            reader = BinaryIO(source.read(size))
+        if self._source_stat is not None and source.handle:
+            source.handle.close()
+        self._source = self.file.files.reader = reader
+        self._source_stat = None
+
+    def save_file(self, path):
+        """Write the archive to a file
+
+        The file may be the one the archive was loaded from.
+        """
+        try:
+            if self._is_source(os.stat(path)):
+                self.detach()
+        except OSError:
+            pass
+        with open(path, 'wb') as handle:
+            self.save(BinaryIO.adapter(handle))
 
     @property
     def files(self):
-        if self._files is not None:
-            return self._files
-        self._files = files = {}
-        for name in SYMB.record_names:
-            try:
-                self.info.records[name][0].file_id
-            except:
-                continue
-            for name_parts, entry in izip(self.symb.records[name],
-                                          self.info.records[name]):
-                data = self.file.files[entry.file_id]
-                files['/'.join(name_parts)+'.'+data[:4].lower()] = data
-        return files
+        if self._files is None:
+            self._files = SDATFiles(self)
+        return self._files
 
     def reset(self):
-        self._files = {}
+        self.file.files.revert()
+
+    def build_index(self):
+        """Index the entry names of each record type"""
+        self.index = {}
+        for record_name in SYMB.record_names:
+            try:
+                num = len(self.info.records[record_name])
+            except KeyError:
+                continue
+            if record_name == 'SEQARC':
+                names = self.symb.archive_names
+            else:
+                names = [entry[-1] for entry in
+                         self.symb.records.get(record_name, [])]
+            index = self.index[record_name] = OrderedDict()
+            for record_id in xrange(num):
+                try:
+                    name = names[record_id]
+                except IndexError:
+                    name = str(record_id)
+                index.setdefault(name, record_id)
+
+    def record_id(self, record_name, key):
+        """Get the id of an entry
+
+        Parameters
+        ----------
+        record_name : string
+            One of SYMB.record_names
+        key : string or int
+            Name or id of the entry
+
+        Returns
+        -------
+        record_id : int
+        """
+        if isinstance(key, basestring):
+            return self.index[record_name][key]
+        if not 0 <= key < len(self.info.records[record_name]):
+            raise IndexError('No {0} entry {1}'.format(record_name, key))
+        return key
+
+    def file_id(self, record_name, key):
+        """Get the FILE member of an entry of a record type with files"""
+        entry = self.info.records[record_name][
+            self.record_id(record_name, key)]
+        try:
+            file_id = entry.file_id
+        except AttributeError:
+            raise TypeError('{0} entries have no file'.format(record_name))
+        if file_id >= len(self.file.files):
+            raise IndexError('{0} {1} has no file'.format(record_name, key))
+        return file_id
+
+    def get_member(self, record_name, key):
+        """Get the data of an entry by name or id
+
+        Only this member is read from the archive.
+
+        Parameters
+        ----------
+        record_name : string
+            'SEQ', 'SEQARC', 'BANK', 'WAVEARC' or 'STRM'
+        key : string or int
+            Name or id of the entry
+
+        Returns
+        -------
+        data : string
+        """
+        return self.file.files[self.file_id(record_name, key)]
 
     def load(self, reader):
         reader = BinaryIO.reader(reader)
         start = reader.tell()
         Editable.load(self, reader)
         assert self.magic == 'SDAT'
+        self._source = reader
+        self._source_stat = None
+        self._raw_blocks = {}
         for block_ofs, block in zip(self.block_offsets, [
                 self.symb, self.info, self.fat, self.file]):
             if not block_ofs.block_offset:
                 continue
             reader.seek(start+block_ofs.block_offset)
             block.load(reader)
-        self.file.files = []
-        for entry in self.fat.entries:
-            reader.seek(start+entry.start)
-            self.file.files.append(reader.read(entry.stop-entry.start))
+            self._raw_blocks[block.magic] = (start+block_ofs.block_offset,
+                                             block_ofs.block_size)
+        self.file.files = Members(reader, [
+            slice(start+entry.start, start+entry.stop)
+            for entry in self.fat.entries])
+        self.build_index()
+        self._files = None
 
     def save(self, writer=None):
-        for name, data in self.files.iteritems():
-            name = os.path.splitext(name)[0]
-            name_parts = name.split('/')
-            record_name = name_parts.pop(0)
-            if name_parts not in self.symb.records[record_name]:
-                self.symb.records[record_name].append(name_parts)
-                # TODO: handle new info entries?!
+        """Write the archive
+
+        SYMB and INFO are copied as they were loaded, and so are the
+        members that were not replaced.
+
+        Raises
+        ------
+        IOError
+            If writer is a file the archive was loaded from that has been
+            truncated. Use save_file to write over the source.
+        """
         writer = BinaryIO.writer(writer)
+        try:
+            stat = os.fstat(writer.handle.fileno())
+        except (AttributeError, IOError, ValueError):
+            # Not a file
+            pass
+        else:
+            if self._is_source(stat):
+                if stat.st_size < self._source_stat.st_size:
+                    raise IOError('The source of the archive was truncated'
+                                  ' before it was saved')
+                self.detach()
         start = writer.tell()
         writer = Editable.save(self, writer)
+        self.headersize = writer.tell()-start
         for block_ofs, block in zip(self.block_offsets, [
-                self.symb, self.fat, self.info, self.file]):
-            block_ofs.block_offset = writer.tell()-start
-            writer = block.save(writer)
+                self.symb, self.info, self.fat, self.file]):
             writer.writeAlign(4)
+            block_ofs.block_offset = writer.tell()-start
+            if block is self.fat:
+                # Rewritten once the members are placed
+                self.fat.entries = [slice(0, 0)]*len(self.file.files)
+                writer = self.fat.save(writer)
+            elif block is self.file:
+                writer = self.file.save(writer, start)
+            elif block.magic in self._raw_blocks:
+                block_start, size = self._raw_blocks[block.magic]
+                copy_range(self._source, block_start, size, writer)
+            else:
+                writer = block.save(writer)
             block_ofs.block_size = writer.tell()-start-block_ofs.block_offset
+        self.size_ = writer.tell()-start
+        with writer.seek(start+self.block_offsets[2].block_offset):
+            self.fat.save(writer)
         with writer.seek(start):
             writer = Editable.save(self, writer)
         return writer
@@ -0,0 +1,441 @@
+
+"""Sound sequences
+
+Sequence data is a stream of commands shared by every track. Track 0
+starts at the beginning of the data and opens the other tracks at their
+own offsets. Offsets of commands are relative to the start of the data.
+
+Commands are read one at a time from the COMMANDS table, either into a
+listing by SSEQDecompiler or as events of a track in playback order, which
+follow jumps, calls and loops. Playback events are streamed straight into
+the tracks of a MIDI file.
+"""
+
+from collections import namedtuple
+import struct
+
+from compileengine import Decompiler
+
+from generic import Editable
+from util import BinaryIO
+from util import midi
+
+# Ticks per quarter note
+RESOLUTION = 48
+# Depth of the call stack of the sound driver
+MAX_CALLS = 3
+
+Event = namedtuple('Event', 'offset cmd name args next')
+
+COMMANDS = {
+    0x80: ('rest', ('var', )),
+    0x81: ('program', ('var', )),
+    0x93: ('open_track', ('u8', 'u24')),
+    0x94: ('jump', ('u24', )),
+    0x95: ('call', ('u24', )),
+    0xA0: ('random', ()),
+    0xA1: ('variable', ()),
+    0xA2: ('if', ()),
+    0xB0: ('var_set', ('u8', 's16')),
+    0xB1: ('var_add', ('u8', 's16')),
+    0xB2: ('var_sub', ('u8', 's16')),
+    0xB3: ('var_mul', ('u8', 's16')),
+    0xB4: ('var_div', ('u8', 's16')),
+    0xB5: ('var_shift', ('u8', 's16')),
+    0xB6: ('var_random', ('u8', 's16')),
+    0xB8: ('var_eq', ('u8', 's16')),
+    0xB9: ('var_ge', ('u8', 's16')),
+    0xBA: ('var_gt', ('u8', 's16')),
+    0xBB: ('var_le', ('u8', 's16')),
+    0xBC: ('var_lt', ('u8', 's16')),
+    0xBD: ('var_ne', ('u8', 's16')),
+    0xC0: ('pan', ('u8', )),
+    0xC1: ('volume', ('u8', )),
+    0xC2: ('master_volume', ('u8', )),
+    0xC3: ('transpose', ('s8', )),
+    0xC4: ('pitch_bend', ('s8', )),
+    0xC5: ('bend_range', ('u8', )),
+    0xC6: ('priority', ('u8', )),
+    0xC7: ('note_wait', ('u8', )),
+    0xC8: ('tie', ('u8', )),
+    0xC9: ('portamento', ('u8', )),
+    0xCA: ('modulation_depth', ('u8', )),
+    0xCB: ('modulation_speed', ('u8', )),
+    0xCC: ('modulation_type', ('u8', )),
+    0xCD: ('modulation_range', ('u8', )),
+    0xCE: ('portamento_on', ('u8', )),
+    0xCF: ('portamento_time', ('u8', )),
+    0xD0: ('attack', ('u8', )),
+    0xD1: ('decay', ('u8', )),
+    0xD2: ('sustain', ('u8', )),
+    0xD3: ('release', ('u8', )),
+    0xD4: ('loop_start', ('u8', )),
+    0xD5: ('expression', ('u8', )),
+    0xD6: ('print_variable', ('u8', )),
+    0xE0: ('modulation_delay', ('u16', )),
+    0xE1: ('tempo', ('u16', )),
+    0xE3: ('sweep_pitch', ('s16', )),
+    0xFC: ('loop_end', ()),
+    0xFD: ('return', ()),
+    0xFE: ('allocate_tracks', ('u16', )),
+    0xFF: ('end', ()),
+}
+NOTE_ARGS = ('u8', 'var')
+
+_FIXED = {
+    'u8': struct.Struct('<B'),
+    's8': struct.Struct('<b'),
+    'u16': struct.Struct('<H'),
+    's16': struct.Struct('<h'),
+}
+
+# MIDI controllers set directly by a command argument
+CONTROLLERS = {
+    'pan': midi.CONTROL_PAN,
+    'volume': midi.CONTROL_VOLUME,
+    'expression': midi.CONTROL_EXPRESSION,
+    'modulation_depth': midi.CONTROL_MODULATION,
+}
+
+
+def _read_args(data, ofs, formats):
+    args = []
+    for format in formats:
+        if format == 'var':
+            value = 0
+            while True:
+                byte = ord(data[ofs])
+                ofs += 1
+                value = (value << 7) | (byte & 0x7F)
+                if not byte & 0x80:
+                    break
+        elif format == 'u24':
+            value = struct.unpack_from('<I', data[ofs:ofs+3]+'\x00')[0]
+            ofs += 3
+        else:
+            value = _FIXED[format].unpack_from(data, ofs)[0]
+            ofs += _FIXED[format].size
+        args.append(value)
+    return args, ofs
+
+
+def _formats(cmd):
+    if cmd < 0x80:
+        return NOTE_ARGS
+    return COMMANDS[cmd][1]
+
+
+def read_event(data, ofs):
+    """Read the command at an offset of sequence data
+
+    Notes are named 'note' with (key, velocity, duration) arguments. The
+    'random' and 'variable' prefixes have the name of the command they
+    modify, its arguments but the last one, and then either the range of
+    the random value or the variable holding it.
+
+    Parameters
+    ----------
+    data : string
+        Sequence data
+    ofs : int
+
+    Returns
+    -------
+    event : Event
+
+    Raises
+    ------
+    KeyError
+        If the command is unknown
+    IndexError, struct.error
+        If the command runs past the end of data
+    """
+    cmd = ord(data[ofs])
+    pos = ofs+1
+    if cmd < 0x80:
+        args, pos = _read_args(data, pos, NOTE_ARGS)
+        return Event(ofs, cmd, 'note', tuple([cmd]+args), pos)
+    name = COMMANDS[cmd][0]
+    if name in ('random', 'variable'):
+        sub_cmd = ord(data[pos])
+        args, pos = _read_args(data, pos+1, _formats(sub_cmd)[:-1])
+        if sub_cmd < 0x80:
+            args.insert(0, sub_cmd)
+        if name == 'random':
+            last, pos = _read_args(data, pos, ('s16', 's16'))
+        else:
+            last, pos = _read_args(data, pos, ('u8', ))
+        sub_name = 'note' if sub_cmd < 0x80 else COMMANDS[sub_cmd][0]
+        return Event(ofs, cmd, name, tuple([sub_name]+args+last), pos)
+    args, pos = _read_args(data, pos, COMMANDS[cmd][1])
+    return Event(ofs, cmd, name, tuple(args), pos)
+
+
+def track_events(data, start=0, loops=1):
+    """Follow a track in playback order
+
+    Jumps, calls, returns and loops are followed and not yielded. Endless
+    loops, and jumps back to an earlier offset, are only repeated loops
+    times. Calls deeper than MAX_CALLS are skipped. Random values are the
+    middle of their range, and values held in variables are taken as 0.
+
+    Parameters
+    ----------
+    data : string
+        Sequence data
+    start : int
+        Offset of the first command of the track
+    loops : int
+        Number of repeats of endless loops
+
+    Yields
+    ------
+    event : Event
+    """
+    pos = start
+    calls = []
+    loop_stack = []
+    repeats = {}
+    while pos < len(data):
+        event = read_event(data, pos)
+        pos = event.next
+        name = event.name
+        if name in ('random', 'variable'):
+            if name == 'random':
+                value = (event.args[-2]+event.args[-1])//2
+                args = event.args[1:-2]
+            else:
+                value = 0
+                args = event.args[1:-1]
+            name = event.args[0]
+            event = event._replace(name=name, args=args+(value, ))
+        if name == 'end':
+            return
+        elif name == 'jump':
+            target = event.args[0]
+            if target <= event.offset:
+                count = repeats.get(event.offset, 0)
+                if count >= loops:
+                    return
+                repeats[event.offset] = count+1
+            pos = target
+        elif name == 'call':
+            if len(calls) < MAX_CALLS:
+                calls.append(pos)
+                pos = event.args[0]
+        elif name == 'return':
+            if not calls:
+                return
+            pos = calls.pop()
+        elif name == 'loop_start':
+            loop_stack.append([pos, event.args[0] or loops+1])
+        elif name == 'loop_end':
+            if loop_stack:
+                loop_stack[-1][1] -= 1
+                if loop_stack[-1][1] > 0:
+                    pos = loop_stack[-1][0]
+                else:
+                    loop_stack.pop()
+        else:
+            yield event
+
+
+def write_track(events, track):
+    """Stream the events of a track into a MIDI track
+
+    Parameters
+    ----------
+    events : iterable of Event
+        Events in playback order, as from track_events
+    track : util.midi.MidiTrack
+
+    Returns
+    -------
+    opened : list of (int, int)
+        Track id and offset of every track opened by these events
+    """
+    tick = 0
+    transpose = 0
+    note_wait = True
+    opened = []
+    for event in events:
+        name = event.name
+        args = event.args
+        if name == 'note':
+            key, velocity, duration = args
+            track.note(tick, min(max(key+transpose, 0), 127),
+                       min(max(velocity, 1), 127), duration)
+            if note_wait:
+                tick += duration
+        elif name == 'rest':
+            tick += args[0]
+        elif name == 'open_track':
+            opened.append(tuple(args))
+        elif name == 'program':
+            if args[0] >> 7:
+                track.control(tick, midi.CONTROL_BANK, args[0] >> 7)
+            track.program(tick, args[0])
+        elif name in CONTROLLERS:
+            track.control(tick, CONTROLLERS[name], args[0])
+        elif name == 'pitch_bend':
+            track.pitch_bend(tick, args[0]*64)
+        elif name == 'bend_range':
+            track.bend_range(tick, args[0])
+        elif name == 'tempo':
+            track.tempo(tick, args[0])
+        elif name == 'transpose':
+            transpose = args[0]
+        elif name == 'note_wait':
+            note_wait = bool(args[0])
+    return opened
+
+
+def to_midi(data, loops=1, start=0):
+    """Convert sequence data to a MIDI file
+
+    Each track becomes a MIDI track on the channel of its track id.
+
+    Parameters
+    ----------
+    data : string
+        Sequence data
+    loops : int
+        Number of repeats of endless loops
+    start : int
+        Offset of track 0
+
+    Returns
+    -------
+    midi_file : util.midi.MidiFile
+    """
+    midi_file = midi.MidiFile(RESOLUTION)
+    pending = [(0, start)]
+    started = set()
+    while pending:
+        track_id, start = pending.pop(0)
+        if (track_id, start) in started:
+            continue
+        started.add((track_id, start))
+        track = midi_file.add_track(track_id)
+        pending.extend(write_track(track_events(data, start, loops), track))
+    return midi_file
+
+
+class SSEQDecompiler(Decompiler):
+    """Lists commands of sequence data until the end of a track
+
+    Parameters
+    ----------
+    handle : BinaryIO
+        Reader at a command of the sequence data
+    data_start : int
+        Position of the start of the sequence data in handle
+    """
+    def __init__(self, handle, data_start=0):
+        Decompiler.__init__(self, handle)
+        self.data_start = data_start
+        with handle.seek(data_start):
+            self.data = handle.read()
+
+    def parse_next(self):
+        ofs = self.handle.tell()-self.data_start
+        try:
+            event = read_event(self.data, ofs)
+        except KeyError:
+            self.handle.seek(self.data_start+ofs+1)
+            return [self.unknown(ord(self.data[ofs]), 1)]
+        except (IndexError, struct.error):
+            return [self.end()]
+        self.handle.seek(self.data_start+event.next)
+        if event.name == 'end':
+            return [self.end()]
+        expr = self.func(event.name, *event.args)
+        if event.name == 'jump':
+            return [self.end(expr)]
+        return [expr]
+
+
+class SSEQ(Editable):
+    """Sound sequence"""
+    def define(self):
+        self.string('magic', length=4, default='SSEQ')
+        self.uint16('endian', default=0xFEFF)
+        self.uint16('version', default=0x100)
+        self.uint32('size_')
+        self.uint16('headersize', default=0x10)
+        self.uint16('numblocks', default=1)
+        self.string('data_magic', length=4, default='DATA')
+        self.uint32('data_size')
+        self.uint32('data_offset', default=0x1C)
+        self.data = ''
+
+    def load(self, reader):
+        reader = BinaryIO.reader(reader)
+        start = reader.tell()
+        Editable.load(self, reader)
+        reader.seek(start+self.data_offset)
+        self.data = reader.read(self.size_-self.data_offset)
+
+    def save(self, writer=None):
+        writer = BinaryIO.writer(writer)
+        start = writer.tell()
+        self.data_offset = self.get_size()
+        writer = Editable.save(self, writer)
+        writer.write(self.data)
+        writer.writeAlign(4)
+        self.size_ = writer.tell()-start
+        self.data_size = self.size_-self.headersize
+        with writer.seek(start):
+            writer = Editable.save(self, writer)
+        return writer
+
+    def decompile(self):
+        """Get a listing of the commands of track 0"""
+        decompiler = SSEQDecompiler(BinaryIO(self.data))
+        decompiler.parse()
+        return decompiler
+
+    def events(self, start=0, loops=1):
+        """Get the events of a track in playback order"""
+        return track_events(self.data, start, loops)
+
+    def to_midi(self, loops=1):
+        """Get the sequence as MIDI file data"""
+        return to_midi(self.data, loops).save().getvalue()
+
+
+class SSAR(Editable):
+    """Sound sequence archive
+
+    Sequences of an archive share their sequence data and start at the
+    offset of their record.
+    """
+    def define(self):
+        self.string('magic', length=4, default='SSAR')
+        self.uint16('endian', default=0xFEFF)
+        self.uint16('version', default=0x100)
+        self.uint32('size_')
+        self.uint16('headersize', default=0x10)
+        self.uint16('numblocks', default=1)
+        self.string('data_magic', length=4, default='DATA')
+        self.uint32('data_size')
+        self.uint32('data_offset')
+        self.uint32('num')
+        self.offsets = []
+        self.restrict('offsets')
+        self.data = ''
+
+    def load(self, reader):
+        reader = BinaryIO.reader(reader)
+        start = reader.tell()
+        Editable.load(self, reader)
+        self.offsets = []
+        for i in xrange(self.num):
+            self.offsets.append(reader.readUInt32())
+            reader.read(8)
+        reader.seek(start+self.data_offset)
+        self.data = reader.read(self.size_-self.data_offset)
+
+    def to_midi(self, idx, loops=1):
+        """Get a sequence as MIDI file data"""
+        return to_midi(self.data, loops, self.offsets[idx]).save().getvalue()
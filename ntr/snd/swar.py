@@ -0,0 +1,77 @@
+
+from generic import Editable
+from generic.archive import ArchiveList
+from ntr.snd.swav import SWAV, WaveInfo
+from util import BinaryIO
+
+
+class SWAR(ArchiveList, Editable):
+    """Sound wave archive
+
+    Members are WaveInfo and files are complete SWAV files of each wave.
+    """
+    extension = '.swav'
+
+    def define(self):
+        self.string('magic', length=4, default='SWAR')
+        self.uint16('endian', default=0xFEFF)
+        self.uint16('version', default=0x100)
+        self.uint32('size_')
+        self.uint16('headersize', default=0x10)
+        self.uint16('numblocks', default=1)
+        self.string('data_magic', length=4, default='DATA')
+        self.uint32('data_size')
+        self.array('reserved', self.uint32, length=8)
+        self.uint32('num')
+        self.waves = []
+        self.restrict('waves')
+
+    @property
+    def files(self):
+        files = []
+        for info in self.waves:
+            swav = SWAV()
+            swav.info = info
+            files.append(swav.save().getvalue())
+        return files
+
+    def add(self, ref=None, data=''):
+        self.waves.append(SWAV(reader=BinaryIO.reader(data)).info)
+
+    def reset(self):
+        self.waves = []
+
+    def load(self, reader):
+        reader = BinaryIO.reader(reader)
+        start = reader.tell()
+        Editable.load(self, reader)
+        offsets = [reader.readUInt32() for i in xrange(self.num)]
+        self.waves = []
+        for offset in offsets:
+            reader.seek(start+offset)
+            self.waves.append(WaveInfo(reader=reader))
+
+    def save(self, writer=None):
+        writer = BinaryIO.writer(writer)
+        start = writer.tell()
+        self.num = len(self.waves)
+        writer = Editable.save(self, writer)
+        offset_pos = writer.tell()
+        for info in self.waves:
+            writer.writeUInt32(0)
+        offsets = []
+        for info in self.waves:
+            offsets.append(writer.tell()-start)
+            writer = info.save(writer)
+        self.size_ = writer.tell()-start
+        self.data_size = self.size_-self.headersize
+        with writer.seek(offset_pos):
+            for offset in offsets:
+                writer.writeUInt32(offset)
+        with writer.seek(start):
+            writer = Editable.save(self, writer)
+        return writer
+
+    def get_wavs(self):
+        """Get every wave as WAV file data"""
+        return [info.get_wav() for info in self.waves]
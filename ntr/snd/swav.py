@@ -0,0 +1,256 @@
+
+"""Sound waves
+
+Waves are 8 or 16 bit signed PCM, or IMA-ADPCM with a 4 byte header
+holding the initial sample and step index followed by 4 bit codes, low
+nibble first.
+
+Each ADPCM code moves the step index and the sample by amounts clamped to
+their ranges. Clamped additions compose into another clamped addition, so
+both running values are computed for all codes at once with a prefix scan
+of these compositions instead of one code at a time.
+"""
+
+import struct
+import wave
+
+import numpy as np
+
+from generic import Editable
+from util import BinaryIO
+
+FORMAT_PCM8 = 0
+FORMAT_PCM16 = 1
+FORMAT_ADPCM = 2
+
+ADPCM_INDEXES = np.array([-1, -1, -1, -1, 2, 4, 6, 8], dtype=np.int64)
+ADPCM_STEPS = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41,
+    45, 50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190,
+    209, 230, 253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724,
+    796, 876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272,
+    2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132,
+    7845, 8630, 9493, 10442, 11487, 12635, 13899, 15289, 16818, 18500,
+    20350, 22385, 24623, 27086, 29794, 32767], dtype=np.int64)
+ADPCM_MAX_INDEX = len(ADPCM_STEPS)-1
+# The hardware keeps samples within +/-0x7FFF
+ADPCM_MAX_SAMPLE = 0x7FFF
+
+
+def _scan_clamps(add, lo, hi):
+    """Compose clamped additions along the last axis in place
+
+    Afterwards entry i is x -> min(max(x+add[i], lo[i]), hi[i]) of the
+    additions up to and including i.
+    """
+    size = add.shape[-1]
+    shift = 1
+    while shift < size:
+        later = add[..., shift:]
+        new_lo = np.clip(lo[..., :-shift]+later, lo[..., shift:],
+                         hi[..., shift:])
+        new_hi = np.clip(hi[..., :-shift]+later, lo[..., shift:],
+                         hi[..., shift:])
+        add[..., shift:] = add[..., :-shift]+later
+        lo[..., shift:] = new_lo
+        hi[..., shift:] = new_hi
+        shift <<= 1
+
+
+def clamped_sums(start, deltas, low, high, chunk=1024):
+    """Get the running values of x = min(max(x+delta, low), high)
+
+    Additions are composed within chunks first, then the chunks are
+    composed with each other.
+
+    Parameters
+    ----------
+    start : int
+        Initial value between low and high
+    deltas : np.ndarray
+        (N, ) amounts added in turn
+    low : int
+    high : int
+    chunk : int
+        Number of additions composed together
+
+    Returns
+    -------
+    values : np.ndarray
+        (N, ) int64 value after each addition
+    """
+    num = len(deltas)
+    if not num:
+        return np.zeros(0, dtype=np.int64)
+    # Padding with zeros adds functions that leave values unchanged
+    add = np.zeros(-(-num//chunk)*chunk, dtype=np.int64)
+    add[:num] = deltas
+    add = add.reshape(-1, chunk)
+    lo = np.full(add.shape, low, dtype=np.int64)
+    hi = np.full(add.shape, high, dtype=np.int64)
+    _scan_clamps(add, lo, hi)
+    totals = [array[:, -1].copy() for array in (add, lo, hi)]
+    _scan_clamps(*totals)
+    starts = np.empty(len(add), dtype=np.int64)
+    starts[0] = start
+    starts[1:] = np.clip(start+totals[0], totals[1], totals[2])[:-1]
+    return np.clip(starts[:, None]+add, lo, hi).ravel()[:num]
+
+
+def decode_adpcm(data):
+    """Decode IMA-ADPCM data
+
+    Parameters
+    ----------
+    data : string
+        Header and codes
+
+    Returns
+    -------
+    samples : np.ndarray
+        int16 samples, two per code byte
+    """
+    sample, index = struct.unpack_from('<hH', data)
+    index = min(index, ADPCM_MAX_INDEX)
+    codes = np.frombuffer(data, dtype=np.uint8, offset=4)
+    codes = np.stack([codes & 0xF, codes >> 4], -1).ravel().astype(np.int64)
+    magnitudes = codes & 0x7
+    # Step index in effect for each code
+    indexes = np.empty(len(codes), dtype=np.int64)
+    if len(codes):
+        indexes[0] = index
+        indexes[1:] = clamped_sums(index, ADPCM_INDEXES[magnitudes[:-1]], 0,
+                                   ADPCM_MAX_INDEX)
+    steps = ADPCM_STEPS[indexes]
+    diffs = (steps >> 3)+(magnitudes & 1)*(steps >> 2) + \
+        ((magnitudes >> 1) & 1)*(steps >> 1)+(magnitudes >> 2)*steps
+    diffs[codes & 0x8 != 0] *= -1
+    return clamped_sums(sample, diffs, -ADPCM_MAX_SAMPLE,
+                        ADPCM_MAX_SAMPLE).astype(np.int16)
+
+
+def decode_samples(data, format):
+    """Decode wave data
+
+    Parameters
+    ----------
+    data : string
+    format : int
+        FORMAT_PCM8, FORMAT_PCM16 or FORMAT_ADPCM
+
+    Returns
+    -------
+    samples : np.ndarray
+        int8 samples for FORMAT_PCM8, int16 samples otherwise
+    """
+    if format == FORMAT_PCM8:
+        return np.frombuffer(data, dtype=np.int8).copy()
+    elif format == FORMAT_PCM16:
+        return np.frombuffer(data[:len(data) & ~1], dtype='<i2')\
+            .astype(np.int16)
+    elif format == FORMAT_ADPCM:
+        return decode_adpcm(data)
+    raise ValueError('Unknown wave format: {0}'.format(format))
+
+
+def to_wav(samples, rate):
+    """Build WAV file data of mono samples
+
+    Parameters
+    ----------
+    samples : np.ndarray
+        int8 or int16 samples
+    rate : int
+        Sample rate in Hz
+
+    Returns
+    -------
+    data : string
+    """
+    writer = BinaryIO()
+    handle = wave.open(writer, 'wb')
+    handle.setnchannels(1)
+    handle.setframerate(rate)
+    if samples.dtype == np.int8:
+        handle.setsampwidth(1)
+        # 8 bit WAV samples are unsigned
+        handle.writeframes((samples.astype(np.int16)+128).astype(np.uint8)
+                           .tostring())
+    else:
+        handle.setsampwidth(2)
+        handle.writeframes(samples.astype('<i2').tostring())
+    handle.close()
+    return writer.getvalue()
+
+
+class WaveInfo(Editable):
+    """Wave header shared by SWAV files and SWAR members
+
+    Loop offset and length are in words and include the ADPCM header.
+    """
+    def define(self):
+        self.uint8('format')
+        self.uint8('loop')
+        self.uint16('rate')
+        self.uint16('time')
+        self.uint16('loop_offset')
+        self.uint32('loop_length')
+        self.data = ''
+
+    def load(self, reader):
+        Editable.load(self, reader)
+        self.data = reader.read((self.loop_offset+self.loop_length)*4)
+
+    def save(self, writer=None):
+        self.loop_length = (len(self.data)+3)//4-self.loop_offset
+        writer = Editable.save(self, writer)
+        writer.write(self.data)
+        writer.writeAlign(4)
+        return writer
+
+    def get_samples(self):
+        """Decode the wave
+
+        Returns
+        -------
+        samples : np.ndarray
+            int8 samples for FORMAT_PCM8, int16 samples otherwise
+        """
+        return decode_samples(self.data, self.format)
+
+    def get_wav(self):
+        """Get the wave as WAV file data"""
+        return to_wav(self.get_samples(), self.rate)
+
+
+class SWAV(Editable):
+    """Sound wave file"""
+    def define(self):
+        self.string('magic', length=4, default='SWAV')
+        self.uint16('endian', default=0xFEFF)
+        self.uint16('version', default=0x100)
+        self.uint32('size_')
+        self.uint16('headersize', default=0x10)
+        self.uint16('numblocks', default=1)
+        self.string('data_magic', length=4, default='DATA')
+        self.uint32('data_size')
+        self.info = WaveInfo()
+
+    def load(self, reader):
+        reader = BinaryIO.reader(reader)
+        Editable.load(self, reader)
+        self.info.load(reader)
+
+    def save(self, writer=None):
+        writer = BinaryIO.writer(writer)
+        start = writer.tell()
+        writer = Editable.save(self, writer)
+        writer = self.info.save(writer)
+        self.size_ = writer.tell()-start
+        self.data_size = self.size_-self.headersize
+        with writer.seek(start):
+            writer = Editable.save(self, writer)
+        return writer
+
+    def get_wav(self):
+        return self.info.get_wav()
@@ -1,4 +1,7 @@
 
+import struct
+
+import numpy as np
 from PIL import Image
 
 from generic import Editable
@@ -6,6 +9,50 @@ from generic.collection import SizedCollection, Collection2d
 from util import BinaryIO
 from util.colors import color_gen
 
+PERMISSION_SIZE = 0x20
+PERMISSION_FLAG_DARK = 0x80
+
+
+def permission_offset(game, data):
+    """Get the offset of the permission grid in land data
+
+    Parameters
+    ----------
+    game : Game
+    data : string
+        Land data file
+
+    Returns
+    -------
+    offset : int
+    """
+    if game.is_hgss():
+        return 0x14+struct.unpack_from('<H', data, 0x12)[0]
+    return 0x10
+
+
+def render_permissions(permissions, colors, res=8):
+    """Color a permission grid
+
+    Parameters
+    ----------
+    permissions : np.ndarray
+        (height, width, 2) uint8 permission and flags of each tile
+    colors : np.ndarray
+        (256, 4) uint8 RGBA color of each permission
+    res : int
+        Pixels per tile
+
+    Returns
+    -------
+    rgba : np.ndarray
+        (height*res, width*res, 4) uint8 array. Tiles with the dark flag
+        are a quarter as bright.
+    """
+    rgba = colors[permissions[..., 0]]
+    rgba[(permissions[..., 1] & PERMISSION_FLAG_DARK) != 0, :3] //= 4
+    return rgba.repeat(res, axis=0).repeat(res, axis=1)
+
 
 class Permission(Editable):
     def define(self, game):
@@ -99,27 +146,30 @@ class LandDataMap(Editable):
             Editable.save(self, writer)
         return writer
 
+    def get_permission_array(self):
+        """Get the permission grid
+
+        Returns
+        -------
+        permissions : np.ndarray
+            (32, 32, 2) uint8 permission and flags of each tile
+        """
+        return np.frombuffer(self.permissions.save().getvalue(),
+                             dtype=np.uint8).reshape(PERMISSION_SIZE,
+                                                     PERMISSION_SIZE, 2)
+
     def get_perm_image(self, res=8):
-        image = Image.new('RGBA', (0x20*res, 0x20*res))
-        pix = image.load()
-        idx = 0
-        colors = {}
+        permissions = self.get_permission_array()
+        # Colors are handed out in order of first appearance
+        values, first = np.unique(permissions[..., 0], return_index=True)
+        colors = np.zeros((256, 4), dtype=np.uint8)
         gen = color_gen()
-        for y in range(0x20):
-            for x in range(0x20):
-                entry = self.permissions.entries[idx]
-                perm = entry.perm
-                try:
-                    color = colors[perm]
-                except KeyError:
-                    color = next(gen)
-                    colors[perm] = color
-                if entry.flags & 0x80:
-                    color = tuple(c/4 for c in color[:3])+(255,)
-                for sub_y in range(res):
-                    for sub_x in range(res):
-                        pix[x*res+sub_x, y*res+sub_y] = color
-                idx += 1
+        for value in values[np.argsort(first)]:
+            colors[value] = next(gen)
+        # Images made from arrays share their memory and are read-only
+        image = Image.fromarray(render_permissions(permissions, colors, res),
+                                'RGBA').copy()
+        pix = image.load()
         color = (0xaa, 0xaa, 0xaa, 255)
         for y in range(0, 0x20, 4):
             for x in range(0, 0x20, 4):
@@ -24,7 +24,9 @@ class OverworldSprite(Editable):
         # many other values...
 
     def get_btx(self):
-        btx = BTX(reader=self.collection.game.get_mmodel(self.file_id))
+        game = self.collection.game
+        btx = BTX(reader=game.get_mmodel(self.file_id))
+        btx.tex.png_cache = game.render_cache
         return btx
 
 
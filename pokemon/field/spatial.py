@@ -0,0 +1,284 @@
+
+"""Spatial lookups of events and map objects across a map matrix
+
+Event coordinates are tiles of the whole matrix, while the objects of a
+land data map are placed relative to the center of its cell. Both are
+put into one grid of buckets in matrix tiles, so rectangle and tile
+queries only look at the buckets they overlap.
+
+A MatrixIndex remembers a digest of each events and land data file it
+indexed. refresh() re-indexes only the files that changed since, so it
+can be called after every commit.
+"""
+
+from collections import namedtuple
+import hashlib
+
+from pokemon.field.land_data.land_data_map import LandDataMap, \
+    PERMISSION_SIZE
+from pokemon.field.map_matrix import MapMatrix
+from pokemon.field.zone_events import ZoneEvents
+from util import BinaryIO
+
+NO_MAP = 0xFFFF
+
+KIND_FURNITURE = 'furniture'
+KIND_OVERWORLD = 'overworld'
+KIND_WARP = 'warp'
+KIND_TRIGGER = 'trigger'
+KIND_OBJECT = 'object'
+
+# source is ('events', events file) or ('land_data', cell x, cell y) and
+# index is the position of the item in its list there. target is the
+# destination map header of warps.
+Entry = namedtuple('Entry', 'kind source index x y width height target')
+
+
+class SpatialIndex(object):
+    """Bucket grid of rectangles
+
+    Parameters
+    ----------
+    bucket_size : int
+        Width and height of buckets in tiles
+    """
+    def __init__(self, bucket_size=PERMISSION_SIZE):
+        self.bucket_size = bucket_size
+        self.entries = {}  # id => Entry
+        self.buckets = {}  # (bucket x, bucket y) => set of ids
+        self.sources = {}  # source => list of ids
+        self.targets = {}  # warp target => set of ids
+        self._next_id = 0
+
+    def _bucket_range(self, x, y, width, height):
+        size = self.bucket_size
+        for bucket_y in xrange(y//size, (y+max(height, 1)-1)//size+1):
+            for bucket_x in xrange(x//size, (x+max(width, 1)-1)//size+1):
+                yield bucket_x, bucket_y
+
+    def add(self, entry):
+        entry_id = self._next_id
+        self._next_id += 1
+        self.entries[entry_id] = entry
+        for bucket in self._bucket_range(entry.x, entry.y, entry.width,
+                                         entry.height):
+            self.buckets.setdefault(bucket, set()).add(entry_id)
+        self.sources.setdefault(entry.source, []).append(entry_id)
+        if entry.target is not None:
+            self.targets.setdefault(entry.target, set()).add(entry_id)
+
+    def remove(self, source):
+        """Remove every entry of a source"""
+        for entry_id in self.sources.pop(source, []):
+            entry = self.entries.pop(entry_id)
+            for bucket in self._bucket_range(entry.x, entry.y, entry.width,
+                                             entry.height):
+                self.buckets[bucket].discard(entry_id)
+                if not self.buckets[bucket]:
+                    del self.buckets[bucket]
+            if entry.target is not None:
+                self.targets[entry.target].discard(entry_id)
+                if not self.targets[entry.target]:
+                    del self.targets[entry.target]
+
+    def _sorted(self, entry_ids, kinds=None):
+        return [self.entries[entry_id] for entry_id in sorted(entry_ids)
+                if kinds is None or self.entries[entry_id].kind in kinds]
+
+    def query(self, x, y, width=1, height=1, kinds=None):
+        """Get the entries overlapping a rectangle
+
+        Parameters
+        ----------
+        x : int
+        y : int
+        width : int
+        height : int
+        kinds : container or None
+            KIND_* types to include. If None, all are included
+
+        Returns
+        -------
+        entries : list of Entry
+            In the order they were added
+        """
+        found = set()
+        for bucket in self._bucket_range(x, y, width, height):
+            for entry_id in self.buckets.get(bucket, ()):
+                entry = self.entries[entry_id]
+                if entry.x < x+width and x < entry.x+max(entry.width, 1) \
+                        and entry.y < y+height \
+                        and y < entry.y+max(entry.height, 1):
+                    found.add(entry_id)
+        return self._sorted(found, kinds)
+
+    def at(self, x, y, kinds=None):
+        """Get the entries covering a tile
+
+        See Also
+        --------
+        query
+        """
+        return self.query(x, y, 1, 1, kinds)
+
+    def warps_to(self, map_id):
+        """Get the warps leading to a map header
+
+        Returns
+        -------
+        entries : list of Entry
+        """
+        return self._sorted(self.targets.get(map_id, ()))
+
+
+def event_entries(events, source):
+    """Get the entries of zone events
+
+    Parameters
+    ----------
+    events : ZoneEvents
+    source : tuple
+        Source of the entries
+
+    Returns
+    -------
+    entries : generator of Entry
+    """
+    for kind, items in ((KIND_FURNITURE, events.furniture),
+                        (KIND_OVERWORLD, events.overworlds),
+                        (KIND_WARP, events.warps)):
+        for index, item in enumerate(items):
+            yield Entry(kind, source, index, item.x, item.y, 1, 1,
+                        item.map if kind == KIND_WARP else None)
+    for index, trigger in enumerate(events.triggers):
+        yield Entry(KIND_TRIGGER, source, index, trigger.x, trigger.y,
+                    trigger.width, trigger.height, None)
+
+
+def object_entries(land_data, source, cell_x, cell_y):
+    """Get the entries of the objects of a land data map
+
+    Parameters
+    ----------
+    land_data : LandDataMap
+    source : tuple
+        Source of the entries
+    cell_x : int
+        Matrix cell of the map
+    cell_y : int
+
+    Returns
+    -------
+    entries : generator of Entry
+    """
+    center = PERMISSION_SIZE >> 1
+    for index, obj in enumerate(land_data.objects.entries):
+        yield Entry(KIND_OBJECT, source, index,
+                    cell_x*PERMISSION_SIZE+center+obj.x,
+                    cell_y*PERMISSION_SIZE+center+obj.y, 1, 1, None)
+
+
+def map_event_ids(game, map_ids):
+    """Get the events file of map headers
+
+    Parameters
+    ----------
+    game : Game
+    map_ids : iterable of int
+
+    Returns
+    -------
+    event_ids : list of int
+        Unique events files in order of first use
+    """
+    from pokemon.map import Map
+    header = Map(game)
+    event_ids = []
+    for map_id in map_ids:
+        header.load_id(map_id, shallow=True)
+        if header.event_idx not in event_ids:
+            event_ids.append(header.event_idx)
+    return event_ids
+
+
+class MatrixIndex(SpatialIndex):
+    """Spatial index of the events and map objects of a map matrix
+
+    Parameters
+    ----------
+    game : Game
+    matrix_id : int
+        Map matrix file
+    event_ids : list of int or None
+        Events files placed on the matrix. If None, these are taken from
+        the map headers of the matrix cells, for matrices that have them.
+    bucket_size : int
+        Width and height of buckets in tiles
+    """
+    def __init__(self, game, matrix_id, event_ids=None,
+                 bucket_size=PERMISSION_SIZE):
+        SpatialIndex.__init__(self, bucket_size)
+        self.game = game
+        self.matrix_id = matrix_id
+        self.event_ids = event_ids
+        self.indexed = {}  # source => sha1 digest of its data
+        self._header_events = (None, [])  # (map headers, events files)
+        self.refresh()
+
+    def _matrix_sources(self, matrix):
+        sources = {}
+        files = self.game.land_data_archive.files
+        for cell_y in xrange(matrix.height):
+            for cell_x in xrange(matrix.width):
+                land_data_id = matrix.land_data_maps[cell_x, cell_y]
+                if land_data_id != NO_MAP and land_data_id < len(files):
+                    sources[('land_data', cell_x, cell_y)] = \
+                        files[land_data_id]
+        event_ids = self.event_ids
+        if event_ids is None:
+            map_ids = []
+            if matrix.has_map_definition_ids:
+                map_ids = sorted(set(matrix.map_definitions.entries))
+            if self._header_events[0] != map_ids:
+                self._header_events = (map_ids,
+                                       map_event_ids(self.game, map_ids))
+            event_ids = self._header_events[1]
+        files = self.game.event_archive.files
+        for event_idx in event_ids:
+            sources[('events', event_idx)] = files[event_idx]
+        return sources
+
+    def refresh(self):
+        """Index the files that changed since they were last indexed
+
+        Returns
+        -------
+        count : int
+            Number of files indexed again
+        """
+        matrix = MapMatrix(reader=BinaryIO.reader(
+            self.game.map_matrix_archive.files[self.matrix_id]))
+        sources = self._matrix_sources(matrix)
+        count = 0
+        for source in set(self.indexed)-set(sources):
+            self.remove(source)
+            del self.indexed[source]
+            count += 1
+        for source, data in sources.items():
+            digest = hashlib.sha1(data).digest()
+            if self.indexed.get(source) == digest:
+                continue
+            self.remove(source)
+            if source[0] == 'events':
+                entries = event_entries(
+                    ZoneEvents(self.game, reader=BinaryIO.reader(data)),
+                    source)
+            else:
+                entries = object_entries(
+                    LandDataMap(self.game, reader=BinaryIO.reader(data)),
+                    source, source[1], source[2])
+            for entry in entries:
+                self.add(entry)
+            self.indexed[source] = digest
+            count += 1
+        return count
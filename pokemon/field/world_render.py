@@ -0,0 +1,187 @@
+
+"""Overview images of whole map matrices
+
+Every cell of a map matrix is the 32x32 permission grid of a land data
+map. Cells are rendered on their own, shaded by their altitude, and
+assembled into the overview as blocks of one array.
+
+Rendered cells are cached by a digest of their permission grid and
+altitude, so only cells that changed since the last render are drawn
+again. The last overview of each matrix is kept as well and only its
+changed blocks are replaced.
+"""
+
+import hashlib
+
+import numpy as np
+from PIL import Image
+
+from pokemon.field.land_data.land_data_map import PERMISSION_SIZE, \
+    permission_offset, render_permissions
+from pokemon.field.map_matrix import MapMatrix
+from util import BinaryIO
+from util.cache import LRUCache
+from util.colors import color_gen
+
+NO_MAP = 0xFFFF
+
+
+def permission_colors():
+    """Get the overview color of each permission
+
+    Returns
+    -------
+    colors : np.ndarray
+        (256, 4) uint8 RGBA array
+    """
+    gen = color_gen()
+    return np.array([next(gen) for value in xrange(256)], dtype=np.uint8)
+
+
+class WorldRenderer(object):
+    """Renders and caches permission overviews of map matrices
+
+    Parameters
+    ----------
+    game : Game
+    res : int
+        Pixels per permission tile
+    max_cells : int
+        Number of rendered cells kept in memory
+
+    Attributes
+    ----------
+    colors : np.ndarray
+        (256, 4) RGBA color of each permission
+    """
+    def __init__(self, game, res=2, max_cells=4096):
+        self.game = game
+        self.res = res
+        self.colors = permission_colors()
+        self.cells = LRUCache(max_cells)
+        self.overviews = {}  # matrix_id => (keys, rgba)
+
+    def get_matrix(self, matrix_id):
+        return MapMatrix(reader=BinaryIO.reader(
+            self.game.map_matrix_archive.files[matrix_id]))
+
+    def cell_source(self, files, land_data_id, shade=1.0):
+        """Get everything a cell is rendered from
+
+        Parameters
+        ----------
+        files : list
+            Land data files
+        land_data_id : int
+            Land data file of the cell
+        shade : float
+            Brightness from 0 to 1
+
+        Returns
+        -------
+        source : tuple or None
+            Permission grid bytes and shade. None if the cell is empty
+        """
+        if land_data_id == NO_MAP:
+            return None
+        try:
+            data = files[land_data_id]
+        except IndexError:
+            return None
+        ofs = permission_offset(self.game, data)
+        return (data[ofs:ofs+PERMISSION_SIZE*PERMISSION_SIZE*2], shade)
+
+    def render_cell(self, source):
+        """Render a cell from its source
+
+        Parameters
+        ----------
+        source : tuple
+            From cell_source
+
+        Returns
+        -------
+        rgba : np.ndarray
+            (32*res, 32*res, 4) uint8 array. It is shared and read-only.
+        """
+        data, shade = source
+
+        def render():
+            # Truncated land data is padded with empty tiles
+            permissions = np.zeros((PERMISSION_SIZE, PERMISSION_SIZE, 2),
+                                   dtype=np.uint8)
+            chunk = np.frombuffer(data, dtype=np.uint8)
+            permissions.ravel()[:len(chunk)] = chunk
+            rgba = render_permissions(permissions, self.colors, self.res)
+            rgba[..., :3] = (rgba[..., :3]*shade).astype(np.uint8)
+            rgba.setflags(write=False)
+            return rgba
+        key = (hashlib.sha1(data).digest(), shade, self.res)
+        return self.cells.get(key, render)
+
+    def render(self, matrix_id, matrix=None):
+        """Render the overview of a map matrix
+
+        Cells with a higher altitude are brighter.
+
+        Parameters
+        ----------
+        matrix_id : int
+            Map matrix file
+        matrix : MapMatrix or None
+            Edited matrix to render instead of the stored one
+
+        Returns
+        -------
+        rgba : np.ndarray
+            (height*32*res, width*32*res, 4) uint8 array. It is replaced
+            by the next render of the same matrix.
+        """
+        if matrix is None:
+            matrix = self.get_matrix(matrix_id)
+        shape = (matrix.height, matrix.width)
+        land_data_ids = np.array(matrix.land_data_maps.entries[:],
+                                 dtype=np.uint16).reshape(shape)
+        if matrix.has_mystery_zone:
+            # This layer holds the altitude of each cell
+            altitudes = np.array(matrix.mystery_details.entries[:],
+                                 dtype=np.float32).reshape(shape)
+            low, high = altitudes.min(), altitudes.max()
+            shades = 0.5+0.5*(altitudes-low)/max(high-low, 1)
+        else:
+            shades = np.ones(shape, dtype=np.float32)
+        files = self.game.land_data_archive.files
+        size = PERMISSION_SIZE*self.res
+        keys, overview = self.overviews.get(matrix_id, (None, None))
+        if keys is None or keys.shape != shape:
+            keys = np.empty(shape, dtype=object)
+            overview = np.zeros((shape[0]*size, shape[1]*size, 4),
+                                dtype=np.uint8)
+        for y in xrange(shape[0]):
+            for x in xrange(shape[1]):
+                source = self.cell_source(files, land_data_ids[y, x],
+                                          float(shades[y, x]))
+                if source == keys[y, x]:
+                    continue
+                keys[y, x] = source
+                block = overview[y*size:(y+1)*size, x*size:(x+1)*size]
+                if source is None:
+                    block[:] = 0
+                else:
+                    block[:] = self.render_cell(source)
+        self.overviews[matrix_id] = (keys, overview)
+        return overview
+
+    def render_image(self, matrix_id, matrix=None):
+        """Render the overview of a map matrix to a PIL Image
+
+        See Also
+        --------
+        render
+        """
+        return Image.fromarray(self.render(matrix_id, matrix).copy(), 'RGBA')
+
+    def clear(self):
+        """Drop all rendered cells and overviews"""
+        self.cells.clear()
+        self.overviews.clear()
@@ -13,6 +13,7 @@ from ntr.overlay import OverlayTable
 from ctr.garc import GARC
 from util import cached_property, subclasses
 from util import BinaryIO
+from util.cache import ArchiveCache, RenderCache
 from generic import Editable
 
 GAME_CODES = {
@@ -149,6 +150,8 @@ class Game(Editable, Version):
     """
     versions = {'': 0}
     commands_files = ()
+    archive_class = NARC
+    archive_cache_size = 0x4000000
 
     def __init__(self):
         Editable.__init__(self)
@@ -162,6 +165,7 @@ class Game(Editable, Version):
         self.color = '#E5E4E2'
         self.header = None
         self.config = {}
+        self.archive_cache = ArchiveCache(self.archive_cache_size)
 
     @classmethod
     def from_workspace(cls, workspace, init=False):
@@ -272,12 +276,45 @@ class Game(Editable, Version):
                                  self.files.directory, *parts), mode)
 
     def archive(self, filename):
-        return NARC(open(os.path.join(self.files.directory, 'fs', filename)))
+        """Get a parsed archive from the workspace's file system
+
+        Archives are cached until their file changes or they get evicted,
+        so repeated lookups do not parse them again. The returned archive
+        is shared; write any changes back with save_archive.
+
+        Parameters
+        ----------
+        filename : string
+            Path of the archive relative to fs/
+
+        Returns
+        -------
+        archive : Archive
+        """
+        return self.archive_cache.get(
+            os.path.join(self.files.directory, 'fs', filename),
+            self.archive_class)
 
     def save_archive(self, archive, filename):
-        with open(os.path.join(self.files.directory, 'fs', filename), 'wb')\
-                as handle:
+        path = os.path.join(self.files.directory, 'fs', filename)
+        with open(path, 'wb') as handle:
             archive.save(BinaryIO.adapter(handle))
+        self.archive_cache.update(path, archive)
+
+    def close(self):
+        """Release all cached archives"""
+        self.archive_cache.clear()
+
+    @cached_property
+    def render_cache(self):
+        """Cache of rendered PNG files kept in the workspace
+
+        Textures and cells given this cache are only rendered again when
+        their source data changes, also across sessions. Files are stored
+        under cache/render.
+        """
+        return RenderCache(directory=os.path.join(self.files.directory,
+                                                  'cache', 'render'))
 
     def __getattr__(self, name):
         if name[-8:] == '_archive':
@@ -524,9 +561,7 @@ class XY(Game):
     personal_archive_file = 'a/2/1/8'
     wotbl_archive_file = 'a/2/1/4'
     script_archive_file = 'a/0/1/1'
-
-    def archive(self, filename):
-        return GARC(open(os.path.join(self.files.directory, 'fs', filename)))
+    archive_class = GARC
 
 
 class ORAS(XY):
@@ -1,6 +1,8 @@
 
+import ctypes
 import re
 
+import numpy as np
 from PIL import Image
 
 from atomic.atomic_struct import SIMULATING_PLACEHOLDER
@@ -19,77 +21,138 @@ palette = (
 
 palette_2bpp = (0, 3, 2, 1)
 
+_palette_array = np.array(palette, dtype=np.uint8)
+_palette_2bpp_array = np.array(palette_2bpp, dtype=np.uint8)
+# Shift of each pixel of a tile row, leftmost pixel in the highest bits
+_ROW_SHIFTS = np.arange(14, -1, -2, dtype=np.uint16)
+
+
+def decode_glyphs(data):
+    """Decode glyph data
+
+    Each glyph is 2x2 tiles of 8 rows. A row is a uint16 of 2bpp pixels.
+
+    Parameters
+    ----------
+    data : string
+        Data of any number of 64 byte glyphs
+
+    Returns
+    -------
+    pixels : np.ndarray
+        (N, 16, 16) uint8 array of values 0-3
+    """
+    rows = np.frombuffer(data, dtype='<u2', count=len(data)//64*32)
+    values = (rows.reshape(-1, 2, 2, 8)[..., None] >> _ROW_SHIFTS) & 0x3
+    # (glyph, tile_y, tile_x, y, x) to (glyph, tile_y, y, tile_x, x)
+    return values.transpose(0, 1, 3, 2, 4).reshape(-1, 16, 16)\
+        .astype(np.uint8)
+
+
+def encode_glyphs(pixels):
+    """Encode (N, 16, 16) pixel values as glyph data"""
+    pixels = np.asarray(pixels, dtype=np.uint16).reshape(-1, 2, 8, 2, 8)
+    rows = (pixels.transpose(0, 1, 3, 2, 4) << _ROW_SHIFTS).sum(-1)
+    return rows.astype('<u2').tostring()
+
+
+def glyph_bboxes(pixels):
+    """Get the bounding region of glyphs
+
+    Parameters
+    ----------
+    pixels : np.ndarray
+        (N, 16, 16) pixel values
+
+    Returns
+    -------
+    bboxes : np.ndarray
+        (N, 4) array of width, height, x, y. Empty glyphs are (0, 0, 0, 2)
+    """
+    mask = np.asarray(pixels) != 0
+    cols = mask.any(1)
+    rows = mask.any(2)
+    min_x = cols.argmax(1)
+    min_y = rows.argmax(1)
+    max_x = cols.shape[1]-1-cols[:, ::-1].argmax(1)
+    max_y = rows.shape[1]-1-rows[:, ::-1].argmax(1)
+    bboxes = np.stack([max_x-min_x+1, max_y-min_y+1, min_x, min_y], -1)
+    bboxes[~cols.any(1)] = (0, 0, 0, 2)
+    return bboxes
+
+
+def bdf_rows(pixels, widths):
+    """Format the BITMAP rows of glyphs for 2bpp BDF
+
+    Parameters
+    ----------
+    pixels : np.ndarray
+        (N, 16, 16) pixel values
+    widths : array-like
+        (N, ) number of pixels of each row to keep
+
+    Returns
+    -------
+    bitmaps : list of string
+        Hex rows of each glyph, padded to whole bytes
+    """
+    widths = np.asarray(widths, dtype=np.int64)
+    values = _palette_2bpp_array[pixels].astype(np.int64)
+    values *= np.arange(16) < widths[:, None, None]
+    # Leftmost pixel in the highest bits of a 32 bit row
+    lines = (values << np.arange(30, -1, -2)).sum(-1)
+    num_bytes = np.maximum(-(-widths*2 // 8), 1)
+    lines >>= (32-num_bytes*8)[:, None]
+    bitmaps = []
+    for glyph_lines, size in zip(lines.tolist(), num_bytes.tolist()):
+        bitmaps.append('\n'.join('{0:0{1}X}'.format(line, size*2)
+                                 for line in glyph_lines))
+    return bitmaps
+
+
+def glyph_image(pixels, columns=16):
+    """Render glyphs in rows of columns glyphs as an RGBA image"""
+    pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1, 16, 16)
+    columns = max(1, min(columns, len(pixels)))
+    rows = -(-len(pixels) // columns)
+    grid = np.zeros((rows*columns, 16, 16), dtype=np.uint8)
+    grid[:len(pixels)] = pixels
+    grid = grid.reshape(rows, columns, 16, 16).transpose(0, 2, 1, 3)\
+        .reshape(rows*16, columns*16)
+    rgba = _palette_array[grid]
+    return Image.frombuffer('RGBA', (columns*16, rows*16), rgba.tostring(),
+                            'raw', 'RGBA', 0, 1)
+
 
 class Glyph(Editable):
     def define(self):
         tile = self.array(SIMULATING_PLACEHOLDER, self.uint16, length=8)
         self.array('tiles', lambda x: tile, length=4)
 
+    def get_pixels(self):
+        """Get the (16, 16) pixel values of this glyph"""
+        rows = np.array([list(tile) for tile in self.tiles], dtype='<u2')
+        return decode_glyphs(rows.tostring())[0]
+
+    def set_pixels(self, pixels):
+        rows = np.frombuffer(encode_glyphs(pixels), dtype='<u2')
+        for idx, tile in enumerate(rows.reshape(4, 8).tolist()):
+            for sub_y, row in enumerate(tile):
+                self.tiles[idx][sub_y] = row
+
     def to_image(self):
-        img = Image.new('RGBA', (16, 16))
-        pix = img.load()
-
-        pix_x = pix_y = 0
-        for tile_y in range(2):
-            for sub_y in range(8):
-                pix_x = 0
-                for tile_x in range(2):
-                    tile = self.tiles[tile_y*2+tile_x][sub_y]
-                    for sub_x in range(8)[::-1]:
-                        pix[pix_x, pix_y] = palette[(tile >> (sub_x*2)) & 0x3]
-                        pix_x += 1
-                pix_y += 1
-        return img
+        return glyph_image(self.get_pixels())
 
     def bdf_bitmap(self, width):
-        # width, height, x_ofs, y_ofs = self.get_bbox()
-        lines = []
-        y = 0
-        for tile_y in range(2):
-            for sub_y in range(8):
-                """if y < 16-height:
-                    y += 1
-                    continue
-                elif y > 16-y_ofs:
-                    break"""
-                line = 0
-                x = 2  # x = 1
-                for tile_x in range(2):
-                    tile = self.tiles[tile_y*2+tile_x][sub_y]
-                    for sub_x in range(8)[::-1]:
-                        if x > width*2:
-                            break
-                        """if (tile >> (sub_x*2)) & 0x3 == 1:
-                            # HACK: BDF only supports 1bpp! Only keeping main
-                            line |= 1
-                        line <<= 1
-                        x += 1
-                        """
-                        val = (tile >> (sub_x*2)) & 0x3
-                        line |= palette_2bpp[val]
-                        line <<= 2
-                        x += 2
-                line <<= -x % 8
-                x += -x % 8
-                lines.append('{line:0{fill}X}'.format(line=line, fill=x/4))
-                y += 1
-        return '\n'.join(lines)
+        return bdf_rows(self.get_pixels()[None], [width])[0]
 
     def set_line(self, y, width, line):
-        tile_y = y/8
-        sub_y = y % 8
-        x = (width*2)-2
         line >>= -(width*2) % 8
-        for tile_x in range(2):
-            tile = 0
-            for sub_x in range(8)[::-1]:
-                if x < 0:
-                    break
-                val = palette_2bpp[(line >> x) & 0x3]
-                # line >>= 2
-                tile |= val << (sub_x*2)
-                x -= 2
-            self.tiles[tile_y*2+tile_x][sub_y] = tile
+        pixels = self.get_pixels()
+        shifts = width*2-2-np.arange(16)*2
+        pixels[y] = np.where(shifts >= 0, _palette_2bpp_array[
+            (line >> np.maximum(shifts, 0)) & 0x3], 0)
+        self.set_pixels(pixels)
 
     def get_bbox(self):
         """Returns the bounding region of the Glyph
@@ -101,26 +164,8 @@ class Glyph(Editable):
         x : int
         y : int
         """
-        min_x = min_y = 16
-        max_x = max_y = 0
-        y = 0
-        for tile_y in range(2):
-            for sub_y in range(8):
-                x = 0
-                for tile_x in range(2):
-                    tile = self.tiles[tile_y*2+tile_x][sub_y]
-                    for sub_x in range(8)[::-1]:
-                        val = (tile >> (sub_x*2)) & 0x3
-                        if val != 0:
-                            min_x = min(x, min_x)
-                            min_y = min(y, min_y)
-                            max_x = max(x, max_x)
-                            max_y = max(y, max_y)
-                        x += 1
-                y += 1
-        if min_x == min_y == 16 and max_x == max_y == 0:
-            return 0, 0, 0, 2
-        return (max_x-min_x+1, max_y-min_y+1, min_x, min_y)
+        return tuple(int(value)
+                     for value in glyph_bboxes(self.get_pixels()[None])[0])
 
 
 class Font(Editable):
@@ -158,12 +203,36 @@ class Font(Editable):
         self.footer_offset = base_glyph.get_size()*self.num+self.headersize
         writer = Editable.save(self, writer)
         writer = self.glyphs.save(writer)
-        self.widths = [0]*self.num
-        for i, glyph in enumerate(self.glyphs):
-            self.widths[i] = width = glyph.get_bbox()[0]
-            writer.writeUInt8(width)
+        self.widths = glyph_bboxes(self.get_glyph_array())[:, 0].tolist()
+        writer.write(np.array(self.widths, dtype=np.uint8).tostring())
         return writer
 
+    def get_glyph_array(self):
+        """Decode every glyph at once
+
+        Returns
+        -------
+        pixels : np.ndarray
+            (num, 16, 16) uint8 array of values 0-3
+        """
+        try:
+            entries = self.glyphs.entries
+        except AttributeError:
+            return np.zeros((0, 16, 16), dtype=np.uint8)
+        return decode_glyphs(ctypes.string_at(ctypes.addressof(entries),
+                                              ctypes.sizeof(entries)))
+
+    def set_glyph_array(self, pixels):
+        """Replace every glyph with (num, 16, 16) pixel values"""
+        data = encode_glyphs(pixels)
+        self.num = len(data)//64
+        self.glyphs = SizedCollection(Glyph().base_struct, length=self.num)
+        self.glyphs.load(BinaryIO(data))
+
+    def to_image(self, columns=16):
+        """Render every glyph in rows of columns glyphs"""
+        return glyph_image(self.get_glyph_array(), columns)
+
     def resize(self, num):
         self.glyphs.resize(num)
         new_widths = [0]*num
@@ -175,7 +244,8 @@ class Font(Editable):
         """Returns the contents of a BDF font file"""
         table, rtable = load_table()
         entries = {}
-        for glyph_id, glyph in enumerate(self.glyphs):
+        bitmaps = bdf_rows(self.get_glyph_array(), self.widths[:self.num])
+        for glyph_id, bitmap in enumerate(bitmaps):
             try:
                 char = table[glyph_id+1].decode('unicode-escape')
                 if char[:2] == '\\x':
@@ -195,7 +265,7 @@ BITMAP
 ENDCHAR
 """.format(ucode=ucode, width=width, glyph_id=glyph_id,
                 # height=height-2, x_ofs=x_ofs, y_ofs=y_ofs-2,
-                bitmap=glyph.bdf_bitmap(width))
+                bitmap=bitmap)
 
         bdf = """STARTFONT 2.3
 FONT -ppre-pokemon-native--16-160-75-75
@@ -249,7 +319,7 @@ CHARS {num}
                     continue
                 ucode = int(match.group(1), 16)
                 break
-            entries[ucode] = entry = Glyph()
+            entries[ucode] = rows = []
             ecode = None
             width = height = None
             x_ofs = 0
@@ -289,23 +359,38 @@ CHARS {num}
                         line = reader.readline()
                         if line.startswith('ENDCHAR'):
                             break
-                        entry.set_line(y, width, int(line, 16))
+                        if 0 <= y < 16:
+                            rows.append((y, width, int(line, 16)))
                     else:
                         continue
                     break
             num -= 1
+        ucodes = list(entries)
+        records = []
+        for idx, ucode in enumerate(ucodes):
+            for y, width, line in entries[ucode]:
+                # Align the first 16 pixels to the top of 32 bits
+                line >>= -(width*2) % 8
+                keep = min(width, 16)
+                line >>= (width-keep)*2
+                records.append((idx, y, line << ((16-keep)*2)))
+        glyph_pixels = np.zeros((len(ucodes), 16, 16), dtype=np.uint8)
+        if records:
+            idxs, ys, lines = np.array(records, dtype=np.int64).T
+            glyph_pixels[idxs, ys] = _palette_2bpp_array[
+                (lines[:, None] >> np.arange(30, -1, -2)) & 0x3]
         num = len(entries)
         for ucode in entries:
             if ucode & 0xF000 == 0x8000:
                 num = max(ucode-0x7FFF, num)
-        self.num = num
-        self.glyphs = SizedCollection(Glyph().base_struct, length=num)
-        for ucode in entries:
+        pixels = np.zeros((num, 16, 16), dtype=np.uint8)
+        for idx, ucode in enumerate(ucodes):
             if ucode & 0xF000 == 0x8000:
                 glyph_id = ucode-0x8000
             else:
                 glyph_id = rtable[unichr(ucode).encode('unicode-escape')]-1
-            self.glyphs[glyph_id] = entries[ucode]._data
+            pixels[glyph_id] = glyph_pixels[idx]
+        self.set_glyph_array(pixels)
 
 if __name__ == '__main__':
     import sys
@@ -0,0 +1,255 @@
+
+"""Measurement of Gen IV text against the size of text boxes
+
+Text is converted to character codes, with each VAR placeholder collapsed
+into a single code of VAR_BASE+its kind. A lookup table maps every code to
+its width in pixels, so every line of every entry is measured with one
+gather of the table and one sum per line.
+
+Lines end at \\n, \\r and \\f. \\n moves to the next row of the box, \\r
+scrolls the box up by a row and \\f clears it. A line overflows when it is
+wider than the box or when it lands below the last row.
+"""
+
+from collections import namedtuple
+import re
+
+import numpy as np
+
+from pokemon.msgdata.msg import Text, encode4
+
+LINE_BREAK = 0xE000
+SCROLL = 0x25BC
+PAGE = 0x25BD
+VAR = 0xFFFE
+# Codes of VAR placeholders, offset by their kind
+VAR_BASE = 0x10000
+
+_BREAKS = (LINE_BREAK, SCROLL, PAGE)
+_LINE_SPLIT = re.compile(r'\\[nrf]|[\n\r\f]')
+
+Overflow = namedtuple('Overflow', 'bank entry line row width text')
+
+
+def width_table(widths, spacing=0, var_widths=None, var_width=0):
+    """Build the width of every character code
+
+    Parameters
+    ----------
+    widths : array-like
+        Width of each glyph, as Font.widths. Glyph i is code i+1
+    spacing : int
+        Pixels added after each glyph
+    var_widths : dict or None
+        Width of VAR placeholders by kind
+    var_width : int
+        Width of VAR placeholders of any other kind
+
+    Returns
+    -------
+    table : np.ndarray
+        Width of each code. Control and unknown codes have no width
+    """
+    table = np.zeros(VAR_BASE*2, dtype=np.int32)
+    widths = np.asarray(widths, dtype=np.int32)[:VAR_BASE-1]
+    table[1:len(widths)+1] = widths+spacing
+    table[list(_BREAKS)] = 0
+    table[VAR_BASE:] = var_width
+    if var_widths:
+        for kind, width in var_widths.items():
+            table[VAR_BASE+kind] = width
+    return table
+
+
+def tokenize(text):
+    """Get the character codes of text with one code per VAR placeholder
+
+    Parameters
+    ----------
+    text : string
+
+    Returns
+    -------
+    codes : list
+    """
+    string = encode4(text)
+    codes = []
+    idx = 0
+    while idx < len(string):
+        code = string[idx]
+        if code == VAR:
+            codes.append(VAR_BASE+string[idx+1])
+            idx += 3+string[idx+2]
+        else:
+            codes.append(code)
+            idx += 1
+    return codes
+
+
+class TextLayout(object):
+    """Measures the lines of text rendered with a font
+
+    Parameters
+    ----------
+    font : Font or array-like
+        Font, or the width of each of its glyphs
+    max_width : int
+        Width of the text box in pixels
+    max_lines : int or None
+        Number of rows of the text box. If None, rows are not checked
+    var_widths : dict or None
+        Maximum width of VAR placeholders by kind
+    var_width : int
+        Maximum width of VAR placeholders of any other kind
+    spacing : int
+        Pixels added after each glyph
+    """
+    def __init__(self, font, max_width, max_lines=None, var_widths=None,
+                 var_width=0, spacing=0):
+        self.max_width = max_width
+        self.max_lines = max_lines
+        self.table = width_table(getattr(font, 'widths', font), spacing,
+                                 var_widths, var_width)
+
+    def measure(self, texts):
+        """Measure every line of several texts at once
+
+        Parameters
+        ----------
+        texts : list of string
+
+        Returns
+        -------
+        owners : np.ndarray
+            (lines, ) index of the text of each line
+        widths : np.ndarray
+            (lines, ) width of each line in pixels
+        rows : np.ndarray
+            (lines, ) row of the text box each line is shown on
+        """
+        codes = [tokenize(text) for text in texts]
+        lengths = np.array([len(text_codes) for text_codes in codes],
+                           dtype=np.intp)
+        flat = np.zeros(lengths.sum(), dtype=np.int32)
+        pos = 0
+        for text_codes in codes:
+            flat[pos:pos+len(text_codes)] = text_codes
+            pos += len(text_codes)
+        owner = np.repeat(np.arange(len(codes)), lengths)
+        is_break = np.in1d(flat, _BREAKS)
+        # Each text has one more line than it has breaks. A break ends the
+        # line it is on
+        breaks = np.bincount(owner, is_break, len(codes)).astype(np.intp)
+        num_lines = breaks+1
+        first_line = np.cumsum(num_lines)-num_lines
+        first_break = np.cumsum(breaks)-breaks
+        prior = np.cumsum(is_break)-is_break
+        line = first_line[owner]+prior-first_break[owner]
+        widths = np.bincount(line, self.table[flat],
+                             num_lines.sum()).astype(np.int32)
+        owners = np.repeat(np.arange(len(codes)), num_lines)
+        ends = np.zeros(len(widths), dtype=np.int32)
+        ends[line[is_break]] = flat[is_break]
+        # Rows advance after \n and restart after \f or a new text. After \r
+        # the box scrolls, so the next line stays on the same row
+        step = np.zeros(len(widths), dtype=np.intp)
+        step[1:] = ends[:-1] == LINE_BREAK
+        restart = np.zeros(len(widths), dtype=bool)
+        restart[first_line] = True
+        restart[1:] |= ends[:-1] == PAGE
+        total = np.cumsum(step)
+        rows = total-np.maximum.accumulate(np.where(restart, total, 0))
+        return owners, widths, rows
+
+    def overflows(self, texts, keys=None):
+        """Find the lines that do not fit in the text box
+
+        Parameters
+        ----------
+        texts : list of string
+        keys : list or None
+            (bank, entry) of each text. If None, (None, index) is used
+
+        Returns
+        -------
+        overflows : list of Overflow
+            Bank, entry, line within the entry, row, width and text of each
+            line that is too wide or below the last row
+        """
+        owners, widths, rows = self.measure(texts)
+        bad = widths > self.max_width
+        if self.max_lines is not None:
+            bad |= rows >= self.max_lines
+        if not bad.any():
+            return []
+        first_line = np.searchsorted(owners, np.arange(len(texts)))
+        overflows = []
+        for idx in np.flatnonzero(bad):
+            owner = owners[idx]
+            line = idx-first_line[owner]
+            if keys is None:
+                bank, entry = None, owner
+            else:
+                bank, entry = keys[owner]
+            overflows.append(Overflow(
+                bank, entry, int(line), int(rows[idx]), int(widths[idx]),
+                _LINE_SPLIT.split(texts[owner])[line]))
+        return overflows
+
+    def check_text(self, text, bank=None):
+        """Find the overflowing lines of a text bank
+
+        Parameters
+        ----------
+        text : Text
+        bank : int or None
+            Bank reported for each overflow
+
+        Returns
+        -------
+        overflows : list of Overflow
+        """
+        entries = sorted(text.ids)
+        return self.overflows([text[entry] for entry in entries],
+                              [(bank, entry) for entry in entries])
+
+    def check_game(self, game):
+        """Find the overflowing lines of every text bank of a game
+
+        Every entry of the game is measured in a single pass.
+
+        Parameters
+        ----------
+        game : Game
+
+        Returns
+        -------
+        overflows : list of Overflow
+        """
+        texts = []
+        keys = []
+        for bank, data in enumerate(game.text_archive.files):
+            text = Text(game).load(data)
+            for entry in sorted(text.ids):
+                texts.append(text[entry])
+                keys.append((bank, entry))
+        return self.overflows(texts, keys)
+
+
+if __name__ == '__main__':
+    import sys
+    from pokemon import Game
+    from pokemon.graphic.font import Font
+
+    try:
+        game = Game.from_workspace(sys.argv[1])
+        max_width = int(sys.argv[2])
+        max_lines = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    except:
+        print('Usage: {0} <workspace/> <max width> [max lines]'
+              .format(sys.argv[0]))
+        exit()
+    font = Font(reader=game.font_archive.files[0])
+    layout = TextLayout(font, max_width, max_lines)
+    for overflow in layout.check_game(game):
+        print('{0}/{1}:{2} row {3}, {4}px: {5}'.format(*overflow))
@@ -102,6 +102,70 @@ def compress(string, incr=15):
     return newstring
 
 
+def encode4(text):
+    """Convert Gen IV text to character codes
+
+    Parameters
+    ----------
+    text : string
+        Text as stored in Text.files
+
+    Returns
+    -------
+    string : list
+        Character codes, without the terminator
+    """
+    load_table()
+    string = []
+    cidx = 0
+    while cidx < len(text):
+        char = text[cidx]
+        cidx += 1
+        if char == '\\':
+            char = text[cidx]
+            cidx += 1
+            if char == 'x':
+                # n = int(text[cidx:cidx+2], 16)
+                n = rtable['\\x'+text[cidx:cidx+2]]
+                cidx += 2
+            elif char == 'n':
+                n = 0xE000
+            elif char == 'r':
+                n = 0x25BC
+            elif char == 'f':
+                n = 0x25BD
+            elif char == 'u':
+                n = rtable['\\u'+text[cidx:cidx+4]]
+                cidx += 4
+            elif char == '?':
+                n = int(text[cidx:cidx+4], 16)
+                cidx += 4
+            else:
+                n = 1
+            string.append(n)
+        elif char == '\n':
+            string.append(0xE000)
+        elif char == '\r':
+            string.append(0x25BC)
+        elif char == '\f':
+            string.append(0x25BD)
+        elif char == 'V' and text[cidx:cidx+3] == 'AR(':
+            eov = text.find(')', cidx+3)
+            if eov == -1:
+                raise RuntimeError('Could not find end of VAR()')
+            args = []
+            for arg in text[cidx+3:eov].split(','):
+                args.append(int(arg.strip(), 0))
+            cidx = eov+1
+            string.append(0xFFFE)
+            string.append(args.pop(0))
+            string.append(len(args))
+            string.extend(args)
+        else:
+            string.append(rtable[char])
+    return string
+
+
 class TableEntry(Editable):
     def define(self, version=game.Version(4, 0)):
         self.uint32('offset')
@@ -342,53 +406,7 @@ class Text(Archive, Editable):
                     except KeyError:
                         flags = key = None
                         text = ''
-                    string = []
-                    cidx = 0
-                    while cidx < len(text):
-                        char = text[cidx]
-                        cidx += 1
-                        if char == '\\':
-                            char = text[cidx]
-                            cidx += 1
-                            if char == 'x':
-                                # n = int(text[cidx:cidx+2], 16)
-                                n = rtable['\\x'+text[cidx:cidx+2]]
-                                cidx += 2
-                            elif char == 'n':
-                                n = 0xE000
-                            elif char == 'r':
-                                n = 0x25BC
-                            elif char == 'f':
-                                n = 0x25BD
-                            elif char == 'u':
-                                n = rtable['\\u'+text[cidx:cidx+4]]
-                                cidx += 4
-                            elif char == '?':
-                                n = int(text[cidx:cidx+4], 16)
-                                cidx += 4
-                            else:
-                                n = 1
-                            string.append(n)
-                        elif char == '\n':
-                            string.append(0xE000)
-                        elif char == '\r':
-                            string.append(0x25BC)
-                        elif char == '\f':
-                            string.append(0x25BD)
-                        elif char == 'V' and text[cidx:cidx+3] == 'AR(':
-                            eov = text.find(')', cidx+3)
-                            if eov == -1:
-                                raise RuntimeError('Could not find end of VAR()')
-                            args = []
-                            for arg in text[cidx+3:eov].split(','):
-                                args.append(int(arg.strip(), 0))
-                            cidx = eov+1
-                            string.append(0xFFFE)
-                            string.append(args.pop(0))
-                            string.append(len(args))
-                            string.extend(args)
-                        else:
-                            string.append(rtable[char])
+                    string = encode4(text)
                     if flags and 'c' in flags:
                             string = compress(string, 15)
                     string.append(0xFFFF)
@@ -0,0 +1,408 @@
+"""Headless batch processing of workspaces
+
+Job files describe work to run against one or more workspaces without any
+user interface. They can be JSON, either a list of jobs or an object with a
+"jobs" list::
+
+    {"jobs": [
+        {"action": "export", "record": "personal",
+         "output": "{game}_personal.json"},
+        {"action": "transform", "record": "personal",
+         "set": {"catchrate": 255}},
+        {"action": "transform", "record": "waza",
+         "function": "mypackage.balance:adjust_move"},
+        {"action": "import", "record": "personal",
+         "input": "personal.json"},
+        {"action": "sqlite", "output": "{game}.db"}
+    ]}
+
+or Python files that define a `jobs` list of the same dicts. Functions
+defined in a Python job file can be referenced by name alone in "function".
+Transform functions are called as func(game, index, record) and may either
+modify the record in place or return a replacement.
+
+Record-level work is split into chunks and run across a process pool. Only
+the parent process writes archives, once per job.
+
+Invoke as `python main5.py batch [options] JOBFILE WORKSPACE [WORKSPACE...]`
+"""
+
+import importlib
+import imp
+import json
+import multiprocessing
+import os
+
+from pokemon.field.encounters import Encounters
+from pokemon.field.zone_events import ZoneEvents
+from pokemon.game import Game
+from pokemon.msgdata.msg import Text
+from pokemon.poketool.evo import Evolutions
+from pokemon.poketool.personal import Personal
+from pokemon.poketool.trainer import Trainer
+from pokemon.poketool.waza import Waza
+from pokemon.poketool.wotbl import LevelMoves
+from ppre.cli import parse_options
+
+
+class RecordType(object):
+    """Describes how members of a Game archive are parsed
+
+    Parameters
+    ----------
+    archive : string
+        Name of the Game archive. 'personal' refers to
+        game.personal_archive
+    factory : func(game)
+        Creates an empty record
+    """
+    def __init__(self, archive, factory):
+        self.archive = archive
+        self.factory = factory
+
+    def load(self, game, data):
+        record = self.factory(game)
+        record.load(data)
+        return record
+
+    def to_dict(self, record):
+        return record.to_dict()
+
+    def from_dict(self, record, value):
+        record.from_dict(value)
+
+    @staticmethod
+    def save(record):
+        data = record.save()
+        if hasattr(data, 'getvalue'):
+            data = data.getvalue()
+        return data
+
+
+class TextRecordType(RecordType):
+    """Text banks are handled as a mapping of entry names to strings"""
+    def to_dict(self, record):
+        return dict(record.files)
+
+    def from_dict(self, record, value):
+        record.files.update(value)
+
+
+RECORD_TYPES = {
+    'personal': RecordType('personal', Personal),
+    'evo': RecordType('evo', lambda game: Evolutions()),
+    'wotbl': RecordType('wotbl', LevelMoves),
+    'waza': RecordType('waza', Waza),
+    'trainer': RecordType('trainer', Trainer),
+    'encounter': RecordType('encounter', Encounters),
+    'event': RecordType('event', ZoneEvents),
+    'text': TextRecordType('text', Text),
+}
+
+_job_modules = {}
+
+
+def load_job_module(path):
+    """Load a Python job file once per process"""
+    path = os.path.abspath(path)
+    try:
+        return _job_modules[path]
+    except KeyError:
+        module = imp.load_source('_ppre_job_{0}'.format(len(_job_modules)),
+                                 path)
+        _job_modules[path] = module
+        return module
+
+
+def load_jobs(path):
+    """Read the list of jobs from a JSON or Python job file"""
+    if path.endswith('.py'):
+        return list(load_job_module(path).jobs)
+    with open(path) as handle:
+        jobs = json.load(handle)
+    try:
+        return jobs['jobs']
+    except TypeError:
+        return jobs
+
+
+def resolve_function(name, job_path):
+    """Find a transform function
+
+    Parameters
+    ----------
+    name : string
+        Either 'package.module:function' or the name of a function defined
+        in the Python job file
+    job_path : string
+        Path of the job file
+    """
+    if ':' in name:
+        module_name, func_name = name.split(':', 1)
+        module = importlib.import_module(module_name)
+    elif job_path.endswith('.py'):
+        module = load_job_module(job_path)
+        func_name = name
+    else:
+        raise ValueError('Function "{0}" must be given as module:function'
+                         .format(name))
+    return getattr(module, func_name)
+
+
+def parse_records(records):
+    """Expand a record selection into a list of indexes
+
+    Parameters
+    ----------
+    records : list or string
+        List of indexes or a string of comma separated indexes and
+        inclusive ranges, eg "1-151,250"
+    """
+    if not isinstance(records, basestring):
+        return [int(record) for record in records]
+    indexes = []
+    for part in records.split(','):
+        if '-' in part:
+            start, stop = part.split('-', 1)
+            indexes.extend(xrange(int(start), int(stop)+1))
+        elif part.strip():
+            indexes.append(int(part))
+    return indexes
+
+
+def shard(entries, num):
+    """Split entries into at most num consecutive chunks"""
+    size = max(1, -(-len(entries) // max(num, 1)))
+    return [entries[i:i+size] for i in xrange(0, len(entries), size)]
+
+
+_worker = {}
+
+
+def _init_worker(workspace, job_path, game=None):
+    if game is None:
+        game = Game.from_workspace(workspace)
+    _worker['game'] = game
+    _worker['job_path'] = job_path
+    _worker['serial'] = None
+
+
+def _process_chunk(task):
+    """Run one job over a chunk of (index, value) entries in a worker
+
+    Returns
+    -------
+    results : list
+        (index, value) pairs. For exports, value is the record dict.
+        Otherwise it is the new record data. Unchanged records are omitted.
+    """
+    serial, job, entries = task
+    game = _worker['game']
+    if _worker['serial'] != serial:
+        # Archives may have been rewritten by the parent since last job
+        game.archive_cache.clear()
+        _worker['serial'] = serial
+    record_type = RECORD_TYPES[job['record']]
+    files = getattr(game, record_type.archive+'_archive').files
+    action = job['action']
+    if action == 'transform' and 'function' in job:
+        func = resolve_function(job['function'], _worker['job_path'])
+    else:
+        func = None
+    results = []
+    for index, value in entries:
+        try:
+            data = files[index]
+        except IndexError:
+            data = None
+        try:
+            if data is None:
+                record = record_type.factory(game)
+            else:
+                record = record_type.load(game, data)
+            if action == 'export':
+                results.append((index, record_type.to_dict(record)))
+                continue
+            elif action == 'import':
+                record_type.from_dict(record, value)
+            elif func is not None:
+                record = func(game, index, record) or record
+            else:
+                record_type.from_dict(record, job['set'])
+            new_data = record_type.save(record)
+        except Exception as err:
+            raise RuntimeError('{0} {1}[{2}]: {3}'.format(
+                action, job['record'], index, err))
+        if new_data != data:
+            results.append((index, new_data))
+    return results
+
+
+class BatchRunner(object):
+    """Runs jobs against a single workspace
+
+    Parameters
+    ----------
+    workspace : string
+        Workspace directory
+    job_path : string
+        Path of the job file. Used to resolve functions
+    processes : int or None
+        Number of worker processes. If None, the number of CPUs is used.
+        If 1, everything is run in this process.
+    """
+    chunks_per_process = 4
+
+    def __init__(self, workspace, job_path, processes=None):
+        self.workspace = workspace
+        self.job_path = job_path
+        self.game = Game.from_workspace(workspace)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.serial = 0
+        if processes > 1:
+            self.pool = multiprocessing.Pool(processes, _init_worker,
+                                              (workspace, job_path))
+        else:
+            self.pool = None
+            _init_worker(workspace, job_path, self.game)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.game.close()
+
+    def format_path(self, path):
+        return path.format(
+            workspace=os.path.basename(os.path.normpath(self.workspace)),
+            game=self.game.game_name)
+
+    def map(self, job, entries):
+        """Run a job over (index, value) entries, yielding result pairs"""
+        self.serial += 1
+        tasks = [(self.serial, job, chunk)
+                 for chunk in shard(entries,
+                                    self.processes*self.chunks_per_process)]
+        if self.pool is None:
+            chunks = (_process_chunk(task) for task in tasks)
+        else:
+            chunks = self.pool.imap_unordered(_process_chunk, tasks)
+        for chunk in chunks:
+            for result in chunk:
+                yield result
+
+    def run(self, job):
+        try:
+            action = getattr(self, 'action_'+job['action'])
+        except (KeyError, AttributeError):
+            raise ValueError('Unknown action: {0}'.format(job.get('action')))
+        return action(job)
+
+    def archive_for(self, job):
+        try:
+            record_type = RECORD_TYPES[job['record']]
+        except KeyError:
+            raise ValueError('Unknown record type: {0}'
+                             .format(job.get('record')))
+        filename = getattr(self.game, record_type.archive+'_archive_file')
+        return self.game.archive(filename), filename
+
+    def selected(self, job, archive):
+        if 'records' in job:
+            return parse_records(job['records'])
+        return range(len(archive.files))
+
+    def write(self, archive, filename, results):
+        """Merge record data into an archive and save it once"""
+        changed = 0
+        for index, data in results:
+            while len(archive.files) <= index:
+                archive.add()
+            archive.files[index] = data
+            changed += 1
+        if changed:
+            self.game.save_archive(archive, filename)
+        return changed
+
+    def action_export(self, job):
+        archive, filename = self.archive_for(job)
+        entries = [(index, None) for index in self.selected(job, archive)]
+        out = dict((str(index), value)
+                   for index, value in self.map(job, entries))
+        with open(self.format_path(job['output']), 'w') as handle:
+            json.dump(out, handle, sort_keys=True, indent=2)
+        return len(out)
+
+    def action_import(self, job):
+        archive, filename = self.archive_for(job)
+        with open(self.format_path(job['input'])) as handle:
+            values = json.load(handle)
+        entries = sorted((int(index), value)
+                         for index, value in values.iteritems())
+        if 'records' in job:
+            wanted = set(parse_records(job['records']))
+            entries = [entry for entry in entries if entry[0] in wanted]
+        return self.write(archive, filename, self.map(job, entries))
+
+    def action_transform(self, job):
+        if 'function' not in job and 'set' not in job:
+            raise ValueError('transform requires "function" or "set"')
+        archive, filename = self.archive_for(job)
+        entries = [(index, None) for index in self.selected(job, archive)]
+        return self.write(archive, filename, self.map(job, entries))
+
+    def action_sqlite(self, job):
+        from ppre.database import export
+
+        tables = job.get('tables')
+        if isinstance(tables, basestring):
+            tables = tables.split(',')
+        changed = export(self.game, self.format_path(job['output']), tables,
+                         job.get('force', False))
+        return sum(changed.values())
+
+
+def run(job_path, workspaces, processes=None):
+    """Run all jobs of a job file against each workspace"""
+    jobs = load_jobs(job_path)
+    for workspace in workspaces:
+        runner = BatchRunner(workspace, job_path, processes)
+        try:
+            for job in jobs:
+                count = runner.run(job)
+                print('{0}: {1} {2} ({3} records)'.format(
+                    workspace, job['action'], job.get('record', ''), count))
+        finally:
+            runner.close()
+
+
+def main(argv):
+    try:
+        options, args = parse_options(argv)
+        job_path = args[0]
+        workspaces = args[1:]
+        if not workspaces:
+            raise ValueError
+    except (ValueError, IndexError):
+        print("""Usage: %s [options] JOBFILE WORKSPACE [WORKSPACE...]
+
+    Runs the jobs in JOBFILE (.json or .py) against each WORKSPACE
+
+    OPTIONS
+        -j N --jobs N
+            Number of worker processes. Defaults to the number of CPUs
+        --
+            No further options.
+        """ % argv[0])
+        return 1
+    run(job_path, workspaces, options['processes'])
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+
+    exit(main(sys.argv))
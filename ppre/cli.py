@@ -0,0 +1,114 @@
+"""Shared running of the headless command line tools
+
+The exporters build a list of tasks in the parent process and run them
+across a process pool whose workers each load their input once. They all
+take the -j/--jobs option to size that pool.
+"""
+
+import multiprocessing
+
+JOBS_OPTION = (('-j', '--jobs'), 'processes', int)
+
+
+def parse_options(argv, options=()):
+    """Parse the leading options of a command line
+
+    Options end at the first argument not starting with '-' or after
+    '--'. -j/--jobs is always accepted and stored as 'processes'.
+
+    Parameters
+    ----------
+    argv : list
+        Arguments, starting with the program name
+    options : list of (flags, name, convert)
+        flags is a tuple of option strings. convert is called with the
+        argument following the flag, or is None for flags without one,
+        which are stored as True.
+
+    Returns
+    -------
+    values : dict
+        Name => converted value of each option given. 'processes' is
+        always set and None if not given
+    args : list
+        Remaining arguments
+
+    Raises
+    ------
+    ValueError
+        If an option is unknown or its argument is invalid
+    IndexError
+        If an option is missing its argument
+    """
+    flags = {}
+    for option in (JOBS_OPTION, )+tuple(options):
+        for flag in option[0]:
+            flags[flag] = option
+    values = {'processes': None}
+    argc = 1
+    while argc < len(argv) and argv[argc][:1] == '-':
+        arg = argv[argc]
+        argc += 1
+        if arg == '--':
+            break
+        try:
+            unused, name, convert = flags[arg]
+        except KeyError:
+            raise ValueError('Unknown option: {0}'.format(arg))
+        if convert is None:
+            values[name] = True
+        else:
+            values[name] = convert(argv[argc])
+            argc += 1
+    return values, argv[argc:]
+
+
+def run_tasks(func, tasks, processes=None, initializer=None, initargs=(),
+              ordered=False):
+    """Run tasks across a process pool, or in this process
+
+    The pool is only started for more than one process and task. Tasks
+    run in this process rely on the caller having already set up what
+    initializer would set up in the workers.
+
+    Parameters
+    ----------
+    func : func(task)
+        Module level function run for each task
+    tasks : list
+    processes : int or None
+        Number of worker processes. If None, the number of CPUs is used.
+    initializer : func(*initargs) or None
+        Called once in each worker process
+    initargs : tuple
+    ordered : bool
+        If True, results are yielded in task order. Otherwise they are
+        yielded as they complete.
+
+    Returns
+    -------
+    results : generator
+        Result of each task. The pool is shut down once it is exhausted
+        or closed.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield func(task)
+        return
+    pool = multiprocessing.Pool(processes, initializer, initargs)
+    try:
+        if ordered:
+            results = pool.imap(func, tasks)
+        else:
+            results = pool.imap_unordered(func, tasks)
+        for result in results:
+            yield result
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
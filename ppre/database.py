@@ -0,0 +1,403 @@
+"""Export of game records to a SQLite database
+
+Every supported record type gets its own table keyed by member id, with
+nested dicts flattened into columns (base_stat.hp becomes base_stat_hp) and
+fixed lists of values spread over numbered columns (types_0, types_1).
+Lists of structures become child tables keyed by (id, idx), eg
+trainer_pokemon or evo_entries. Text banks are stored in a single text
+table keyed by (bank, id) and joined onto the named views personal_named,
+waza_named and trainer_named.
+
+Re-exporting into an existing database only touches records whose source
+archive members changed since the last export::
+
+    SELECT DISTINCT trainer_pokemon.id FROM trainer_pokemon
+    WHERE level < 20 AND 33 IN (moves_0, moves_1, moves_2, moves_3)
+
+Invoke as `python -m ppre.database [options] WORKSPACE DATABASE` or use the
+"sqlite" batch action.
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import sqlite3
+
+from ppre.batch import RECORD_TYPES, RecordType
+from pokemon.game import Game
+from util.cache import ArchiveCache
+
+
+class TrainerRecordType(RecordType):
+    """Trainers along with their party from trainer_pokemon"""
+    sources = ('trainer', 'trainer_pokemon')
+
+    def load(self, game, data, pokemon_data=None):
+        trainer = RecordType.load(self, game, data)
+        if pokemon_data is not None:
+            trainer.load_pokemon(pokemon_data)
+        return trainer
+
+    def to_dict(self, record):
+        value = record.to_dict()
+        value['pokemon'] = [poke.to_dict() for poke in record.pokemon or []]
+        return value
+
+
+TABLES = OrderedDict((name, RECORD_TYPES[name]) for name in (
+    'personal', 'evo', 'wotbl', 'waza', 'encounter', 'event', 'text'))
+TABLES['trainer'] = TrainerRecordType('trainer',
+                                      RECORD_TYPES['trainer'].factory)
+
+# View name => (table, text bank key)
+NAMED_VIEWS = OrderedDict([
+    ('personal_named', ('personal', 'pokemon_names')),
+    ('waza_named', ('waza', 'move_names')),
+    ('trainer_named', ('trainer', 'trainer_names')),
+])
+
+
+def record_sources(record_type):
+    """Names of the archives a record is built from"""
+    return getattr(record_type, 'sources', (record_type.archive, ))
+
+
+def flatten(value, prefix=''):
+    """Split a record dict into columns and child lists
+
+    Parameters
+    ----------
+    value : dict
+        Record as returned by to_dict
+    prefix : string
+        Prefix for all column names
+
+    Returns
+    -------
+    columns : OrderedDict
+        Column name => scalar value
+    children : OrderedDict
+        Column name => list of dicts
+    """
+    columns = OrderedDict()
+    children = OrderedDict()
+    for key in sorted(value):
+        sub_value = value[key]
+        name = prefix+key
+        if isinstance(sub_value, dict):
+            sub_columns, sub_children = flatten(sub_value, name+'_')
+            columns.update(sub_columns)
+            children.update(sub_children)
+        elif isinstance(sub_value, (list, tuple)):
+            if any(isinstance(item, dict) for item in sub_value):
+                children[name] = sub_value
+            else:
+                for idx, item in enumerate(sub_value):
+                    columns['{0}_{1}'.format(name, idx)] = item
+        else:
+            columns[name] = sub_value
+    return columns, children
+
+
+def quote(name):
+    return '"{0}"'.format(name.replace('"', '""'))
+
+
+def sql_value(value):
+    if isinstance(value, str):
+        try:
+            return value.decode('utf8')
+        except UnicodeDecodeError:
+            return sqlite3.Binary(value)
+    return value
+
+
+def member_hash(datas):
+    """Digest of the source data of one record"""
+    digest = hashlib.sha1()
+    for data in datas:
+        if data is None:
+            data = ''
+        digest.update('{0}:'.format(len(data)))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class DatabaseExporter(object):
+    """Materialises a workspace's records into a SQLite database
+
+    Parameters
+    ----------
+    game : Game
+        Source game
+    path : string
+        Path of the database. It is created if it does not exist.
+    """
+    def __init__(self, game, path):
+        self.game = game
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.columns = {}
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS _archives (
+                record TEXT PRIMARY KEY, stat TEXT);
+            CREATE TABLE IF NOT EXISTS _members (
+                record TEXT, id INTEGER, hash TEXT, error TEXT,
+                PRIMARY KEY (record, id));
+            CREATE TABLE IF NOT EXISTS _tables (
+                record TEXT, name TEXT, PRIMARY KEY (record, name));
+            CREATE TABLE IF NOT EXISTS text (
+                bank INTEGER, id INTEGER, name TEXT, value TEXT,
+                PRIMARY KEY (bank, id));
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def table(self, record, name, keys, columns):
+        """Ensure a table exists with the given key and value columns"""
+        try:
+            existing = self.columns[name]
+        except KeyError:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS {0} ({1}, '
+                              'PRIMARY KEY ({2}))'.format(
+                                  quote(name),
+                                  ', '.join(quote(key)+' INTEGER'
+                                            for key in keys),
+                                  ', '.join(quote(key) for key in keys)))
+            self.conn.execute('INSERT OR IGNORE INTO _tables VALUES (?, ?)',
+                              (record, name))
+            existing = self.columns[name] = set(
+                row[1] for row in self.conn.execute(
+                    'PRAGMA table_info({0})'.format(quote(name))))
+        for column in columns:
+            if column not in existing:
+                self.conn.execute('ALTER TABLE {0} ADD COLUMN {1}'.format(
+                    quote(name), quote(column)))
+                existing.add(column)
+
+    def insert(self, record, name, keys, value):
+        """Insert a record dict and its child lists"""
+        columns, children = flatten(value)
+        self.table(record, name, keys.keys(), columns.keys())
+        row = keys.items()+columns.items()
+        self.conn.execute('INSERT OR REPLACE INTO {0} ({1}) VALUES ({2})'
+                          .format(quote(name),
+                                  ', '.join(quote(col) for col, v in row),
+                                  ', '.join('?'*len(row))),
+                          [sql_value(v) for col, v in row])
+        for child_name, items in children.iteritems():
+            key_name = 'idx' if len(keys) == 1 else 'idx{0}'.format(len(keys))
+            for idx, item in enumerate(items):
+                child_keys = OrderedDict(keys)
+                child_keys[key_name] = idx
+                if not isinstance(item, dict):
+                    item = {'value': item}
+                self.insert(record, name+'_'+child_name, child_keys, item)
+
+    def delete(self, record, index, following=False):
+        """Delete the rows of a record member
+
+        Parameters
+        ----------
+        record : string
+            Key of TABLES
+        index : int
+            Member id
+        following : bool
+            If True, the rows of all later members are deleted as well
+        """
+        where = 'id >= ?' if following else 'id = ?'
+        if record == 'text':
+            self.delete_text(index, following)
+        else:
+            tables = [row[0] for row in self.conn.execute(
+                'SELECT name FROM _tables WHERE record = ?', (record, ))]
+            for name in tables:
+                self.conn.execute('DELETE FROM {0} WHERE {1}'.format(
+                    quote(name), where), (index, ))
+        self.conn.execute('DELETE FROM _members WHERE record = ? AND '+where,
+                          (record, index))
+
+    def delete_text(self, bank, following=False):
+        """Delete the entries of a text bank
+
+        The text table is keyed by (bank, id), so text members are deleted
+        by bank.
+        """
+        where = 'bank >= ?' if following else 'bank = ?'
+        self.conn.execute('DELETE FROM text WHERE '+where, (bank, ))
+
+    def insert_text(self, bank, text):
+        for idx in sorted(text.ids):
+            name = text.ids[idx]
+            self.conn.execute(
+                'INSERT OR REPLACE INTO text VALUES (?, ?, ?, ?)',
+                (bank, idx, name, text.files[name]))
+
+    def sync_record(self, record, force=False):
+        """Bring one record type up to date
+
+        Parameters
+        ----------
+        record : string
+            Key of TABLES
+        force : bool
+            If True, rehash every member even if the archives appear
+            unchanged
+
+        Returns
+        -------
+        changed : int
+            Number of members that were (re)exported
+        """
+        record_type = TABLES[record]
+        try:
+            filenames = [getattr(self.game, source+'_archive_file')
+                         for source in record_sources(record_type)]
+        except (AttributeError, KeyError):
+            return 0
+        paths = [os.path.join(self.game.files.directory, 'fs', filename)
+                 for filename in filenames]
+        try:
+            stat = json.dumps([ArchiveCache.stat_key(path) for path in paths])
+        except OSError:
+            return 0
+        stored = self.conn.execute(
+            'SELECT stat FROM _archives WHERE record = ?',
+            (record, )).fetchone()
+        if not force and stored is not None and stored[0] == stat:
+            return 0
+        archives = [self.game.archive(filename) for filename in filenames]
+        hashes = dict(self.conn.execute(
+            'SELECT id, hash FROM _members WHERE record = ?', (record, )))
+        count = len(archives[0].files)
+        changed = 0
+        for index in xrange(count):
+            datas = [archive.files[index] if index < len(archive.files)
+                     else None for archive in archives]
+            digest = member_hash(datas)
+            if hashes.get(index) == digest:
+                continue
+            self.delete(record, index)
+            error = None
+            try:
+                value = record_type.load(self.game, *datas)
+                if record == 'text':
+                    self.insert_text(index, value)
+                else:
+                    self.insert(record, record, OrderedDict([('id', index)]),
+                                record_type.to_dict(value))
+            except Exception as err:
+                error = '{0}: {1}'.format(type(err).__name__, err)
+                self.delete(record, index)
+            self.conn.execute('INSERT INTO _members VALUES (?, ?, ?, ?)',
+                              (record, index, digest, error))
+            changed += 1
+        self.delete(record, count, following=True)
+        self.conn.execute('INSERT OR REPLACE INTO _archives VALUES (?, ?)',
+                          (record, stat))
+        self.conn.commit()
+        return changed
+
+    def create_views(self):
+        """(Re)create the views joining records to their names"""
+        for view, (table, key) in NAMED_VIEWS.iteritems():
+            self.conn.execute('DROP VIEW IF EXISTS {0}'.format(quote(view)))
+            if not self.conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND "
+                    "name = ?", (table, )).fetchone():
+                continue
+            try:
+                bank = self.game.locale_text_id(key)
+            except KeyError:
+                continue
+            self.conn.execute(
+                'CREATE VIEW {0} AS SELECT {1}.*, text.value AS name '
+                'FROM {1} LEFT JOIN text ON text.bank = {2} '
+                'AND text.id = {1}.id'.format(quote(view), quote(table),
+                                               int(bank)))
+        self.conn.commit()
+
+    def sync(self, records=None, force=False):
+        """Bring the database up to date with the workspace
+
+        Parameters
+        ----------
+        records : list or None
+            Keys of TABLES to export. If None, all of them are.
+        force : bool
+            If True, rehash every member
+
+        Returns
+        -------
+        changed : dict
+            Record type => number of members that were (re)exported
+        """
+        if records is None:
+            records = TABLES.keys()
+        changed = OrderedDict()
+        for record in records:
+            changed[record] = self.sync_record(record, force)
+        self.create_views()
+        return changed
+
+
+def export(game, path, records=None, force=False):
+    """Export or re-sync a game's records into the database at path"""
+    exporter = DatabaseExporter(game, path)
+    try:
+        return exporter.sync(records, force)
+    finally:
+        exporter.close()
+
+
+def main(argv):
+    try:
+        records = None
+        force = False
+        argc = 1
+        while argc < len(argv) and argv[argc][:1] == '-':
+            arg = argv[argc]
+            argc += 1
+            if arg == '--':
+                break
+            elif arg in ('-r', '--records'):
+                records = argv[argc].split(',')
+                argc += 1
+            elif arg in ('-f', '--force'):
+                force = True
+            else:
+                raise ValueError
+        workspace, path = argv[argc:argc+2]
+        for record in records or ():
+            if record not in TABLES:
+                raise ValueError
+    except (ValueError, IndexError):
+        print("""Usage: %s [options] WORKSPACE DATABASE
+
+    Exports the records of WORKSPACE into the SQLite DATABASE. Only
+    records that changed since the last export are updated.
+
+    OPTIONS
+        -r TYPES --records TYPES
+            Comma separated record types to export. Defaults to all of
+            %s
+        -f --force
+            Check every record even if the archives appear unchanged
+        --
+            No further options.
+        """ % (argv[0], ', '.join(TABLES)))
+        return 1
+    game = Game.from_workspace(workspace)
+    for record, count in export(game, path, records, force).iteritems():
+        print('{0}: {1} records updated'.format(record, count))
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+
+    exit(main(sys.argv))
@@ -0,0 +1,368 @@
+"""Structured comparison of workspaces
+
+Compares two workspaces, or two revisions of a workspace tracked by
+vcs.GitControl, archive by archive. Files with identical blob hashes are
+skipped without being parsed. Within archives, only members that differ are
+decoded, and members of known record archives are reported field by field
+using their Editable schemas.
+
+Changes are yielded one at a time so large diffs are never held in memory::
+
+    for change in diff(WorkspaceSource('a'), WorkspaceSource('b'), game):
+        print(change)
+
+Invoke as `python -m ppre.diff [options] OLD [NEW]`
+"""
+
+import hashlib
+import os
+
+from ctr.garc import GARC
+from ntr.narc import NARC
+from ppre.batch import RECORD_TYPES
+from pokemon.game import Game
+
+ARCHIVE_CLASSES = {
+    'NARC': NARC,
+    'CRAG': GARC,
+}
+
+
+class Change(object):
+    """One difference between two workspaces
+
+    Parameters
+    ----------
+    kind : string
+        'added', 'removed' or 'modified'
+    path : string
+        File path relative to the workspace
+    member : int or None
+        Archive member index. None if the whole file is affected
+    field : string or None
+        Dotted field path within the decoded record. None if the record
+        could not be decoded
+    old : object
+        Old value. Raw data if field is None
+    new : object
+        New value. Raw data if field is None
+    """
+    def __init__(self, kind, path, member=None, field=None, old=None,
+                 new=None):
+        self.kind = kind
+        self.path = path
+        self.member = member
+        self.field = field
+        self.old = old
+        self.new = new
+
+    def __str__(self):
+        location = self.path
+        if self.member is not None:
+            location += '[{0}]'.format(self.member)
+        if self.field is not None:
+            return '{0} {1}: {2!r} -> {3!r}'.format(
+                self.kind, location+'.'+self.field, self.old, self.new)
+        sizes = ['-' if value is None else '{0} bytes'.format(len(value))
+                 for value in (self.old, self.new)]
+        return '{0} {1} ({2} -> {3})'.format(self.kind, location, *sizes)
+
+    def __repr__(self):
+        return '<Change {0}>'.format(self)
+
+
+def blob_hash(data):
+    """Git's object id for a blob of data"""
+    digest = hashlib.sha1('blob {0}\0'.format(len(data)))
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class WorkspaceSource(object):
+    """Files of a workspace directory on disk
+
+    Parameters
+    ----------
+    directory : string
+        Workspace directory
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def paths(self):
+        """Sorted relative paths of all files
+
+        Git metadata and the cache/ directory of rendered files are left
+        out.
+        """
+        paths = []
+        for root, dirs, files in os.walk(self.directory):
+            rel = os.path.relpath(root, self.directory)
+            dirs[:] = [name for name in dirs if name != '.git' and
+                       not (rel == '.' and name == 'cache')]
+            for name in files:
+                if rel != '.':
+                    name = os.path.join(rel, name)
+                paths.append(name.replace(os.sep, '/'))
+        return sorted(paths)
+
+    def read(self, path):
+        with open(os.path.join(self.directory, path), 'rb') as handle:
+            return handle.read()
+
+    def digest(self, path):
+        chunk_size = 0x100000
+        full_path = os.path.join(self.directory, path)
+        digest = hashlib.sha1('blob {0}\0'.format(os.path.getsize(full_path)))
+        with open(full_path, 'rb') as handle:
+            while True:
+                chunk = handle.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+class GitSource(object):
+    """Files of a workspace at a git revision
+
+    Parameters
+    ----------
+    control : vcs.GitControl
+        Controller of the workspace repository
+    revision : string
+        Any git revision, eg 'HEAD~2'
+    """
+    def __init__(self, control, revision):
+        self.control = control
+        self.revision = revision
+        self.blobs = {}
+        listing = control.call('ls-tree', '-r', '-z', revision)
+        for line in listing.split('\0'):
+            if not line:
+                continue
+            info, path = line.split('\t', 1)
+            mode, kind, sha = info.split()
+            if kind == 'blob':
+                self.blobs[path] = sha
+
+    def paths(self):
+        return sorted(self.blobs)
+
+    def read(self, path):
+        return self.control.call('cat-file', 'blob', self.blobs[path])
+
+    def digest(self, path):
+        return self.blobs[path]
+
+
+def diff_values(old, new, field=''):
+    """Compare two to_dict() values recursively
+
+    Returns
+    -------
+    changes : generator of (field, old, new)
+        field is a dotted path with list indexes as numbers
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in sorted(set(old) | set(new)):
+            sub_field = '{0}.{1}'.format(field, key) if field else str(key)
+            for change in diff_values(old.get(key), new.get(key), sub_field):
+                yield change
+    elif isinstance(old, (list, tuple)) and isinstance(new, (list, tuple)):
+        for idx in xrange(max(len(old), len(new))):
+            sub_field = '{0}.{1}'.format(field, idx) if field else str(idx)
+            for change in diff_values(old[idx] if idx < len(old) else None,
+                                      new[idx] if idx < len(new) else None,
+                                      sub_field):
+                yield change
+    elif old != new:
+        yield field, old, new
+
+
+def record_archives(game):
+    """Map of workspace paths of record archives to their record types"""
+    archives = {}
+    if game is None:
+        return archives
+    for record_type in RECORD_TYPES.itervalues():
+        try:
+            filename = getattr(game, record_type.archive+'_archive_file')
+        except (AttributeError, KeyError):
+            continue
+        archives['fs/'+filename] = record_type
+    return archives
+
+
+def load_archive(data):
+    try:
+        archive_class = ARCHIVE_CLASSES[data[:4]]
+    except KeyError:
+        return None
+    try:
+        return archive_class(data)
+    except Exception:
+        return None
+
+
+def diff_record(record_type, game, path, member, old_data, new_data):
+    """Yield field changes of one record. Falls back to a raw change"""
+    try:
+        old = record_type.to_dict(record_type.load(game, old_data))
+        new = record_type.to_dict(record_type.load(game, new_data))
+    except Exception:
+        yield Change('modified', path, member, None, old_data, new_data)
+        return
+    for field, old_value, new_value in diff_values(old, new):
+        yield Change('modified', path, member, field, old_value, new_value)
+
+
+def diff_file(path, old_data, new_data, game=None, record_type=None):
+    """Compare two versions of one file
+
+    Parameters
+    ----------
+    path : string
+        Path relative to the workspace
+    old_data : string
+    new_data : string
+    game : Game or None
+        Game used to decode records
+    record_type : ppre.batch.RecordType or None
+        Type of the members if this is a record archive
+
+    Returns
+    -------
+    changes : generator of Change
+    """
+    old_archive = load_archive(old_data)
+    new_archive = load_archive(new_data) if old_archive is not None else None
+    if new_archive is None:
+        yield Change('modified', path, None, None, old_data, new_data)
+        return
+    old_files = old_archive.files
+    new_files = new_archive.files
+    for member in xrange(max(len(old_files), len(new_files))):
+        if member >= len(old_files):
+            yield Change('added', path, member, None, None, new_files[member])
+        elif member >= len(new_files):
+            yield Change('removed', path, member, None, old_files[member],
+                         None)
+        elif old_files[member] != new_files[member]:
+            if record_type is None:
+                yield Change('modified', path, member, None,
+                             old_files[member], new_files[member])
+                continue
+            for change in diff_record(record_type, game, path, member,
+                                      old_files[member], new_files[member]):
+                yield change
+
+
+def diff(old, new, game=None):
+    """Compare two sources file by file
+
+    Parameters
+    ----------
+    old : WorkspaceSource or GitSource
+    new : WorkspaceSource or GitSource
+    game : Game or None
+        Game used to decode records. If None, members are only compared
+        as raw data
+
+    Returns
+    -------
+    changes : generator of Change
+    """
+    archives = record_archives(game)
+    old_paths = old.paths()
+    new_paths = set(new.paths())
+    for path in sorted(new_paths.difference(old_paths)):
+        yield Change('added', path, None, None, None, new.read(path))
+    for path in old_paths:
+        if path not in new_paths:
+            yield Change('removed', path, None, None, old.read(path), None)
+        elif old.digest(path) != new.digest(path):
+            for change in diff_file(path, old.read(path), new.read(path),
+                                    game, archives.get(path)):
+                yield change
+
+
+def diff_revisions(control, version='HEAD', new_version=None, game=None):
+    """Compare two revisions of a GitControl workspace
+
+    Parameters
+    ----------
+    control : vcs.GitControl
+    version : string
+        Old revision
+    new_version : string or None
+        New revision. If None, the working tree is used
+    game : Game or None
+        If None, it is loaded from the workspace
+
+    Returns
+    -------
+    changes : generator of Change
+    """
+    if game is None:
+        game = Game.from_workspace(control.directory)
+    old = GitSource(control, version)
+    if new_version is None:
+        new = WorkspaceSource(control.directory)
+    else:
+        new = GitSource(control, new_version)
+    return diff(old, new, game)
+
+
+def main(argv):
+    from vcs import GitControl
+
+    try:
+        revisions = []
+        argc = 1
+        while argc < len(argv) and argv[argc][:1] == '-':
+            arg = argv[argc]
+            argc += 1
+            if arg == '--':
+                break
+            elif arg in ('-r', '--revision'):
+                revisions.append(argv[argc])
+                argc += 1
+            else:
+                raise ValueError
+        workspaces = argv[argc:]
+        if revisions:
+            if len(revisions) > 2 or len(workspaces) != 1:
+                raise ValueError
+        elif len(workspaces) != 2:
+            raise ValueError
+    except (ValueError, IndexError):
+        print("""Usage: %s [options] OLD NEW
+       %s -r REV [-r NEWREV] WORKSPACE
+
+    Lists the differences between two workspaces or two revisions of a
+    workspace. Without NEWREV, REV is compared to the working tree.
+
+    OPTIONS
+        -r REV --revision REV
+            Git revision of WORKSPACE to compare
+        --
+            No further options.
+        """ % (argv[0], argv[0]))
+        return 1
+    game = Game.from_workspace(workspaces[-1])
+    if revisions:
+        changes = diff_revisions(GitControl(workspaces[0]), game=game,
+                                 *revisions)
+    else:
+        changes = diff(WorkspaceSource(workspaces[0]),
+                       WorkspaceSource(workspaces[1]), game)
+    for change in changes:
+        print(change)
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+
+    exit(main(sys.argv))
@@ -0,0 +1,151 @@
+"""Headless export of 3d models to glTF or OBJ
+
+Either the map models of a workspace, taken from its land data, or every
+BMD member of a NARC are converted across a process pool. Each worker
+loads the archive once and decodes the models it is given. Shapes that
+repeat within a worker are only decoded once.
+
+Models are written as OUTPUT/<member index>/<member index>.gltf (or .obj)
+next to their binary data, material library and PNG textures.
+
+Invoke as `python main5.py models [options] WORKSPACE|NARC OUTPUT`
+"""
+
+import os
+
+from ntr.g3d import export as g3d_export
+from ntr.g3d.bmd import BMD
+from ntr.narc import NARC
+from pokemon.field.land_data.land_data_map import LandDataMap
+from pokemon.game import Game
+from ppre.cli import parse_options, run_tasks
+from ppre.sprites import member_data
+from util import BinaryIO
+
+FORMATS = {
+    'gltf': g3d_export.to_gltf,
+    'obj': g3d_export.to_obj,
+}
+
+
+def model_format(format):
+    """Check the name of an output format"""
+    if format not in FORMATS:
+        raise ValueError('Unknown model format: {0}'.format(format))
+    return format
+
+
+_worker = {}
+
+
+def _init_worker(path):
+    if os.path.isdir(path):
+        _worker['game'] = Game.from_workspace(path)
+        _worker['files'] = _worker['game'].land_data_archive.files
+        return
+    _worker['game'] = None
+    with open(path, 'rb') as handle:
+        data = handle.read()
+    if data[:4] == 'BMD0':
+        _worker['files'] = [data]
+    else:
+        _worker['files'] = NARC(data).files
+
+
+def member_bmd(index):
+    """Get the BMD data of an archive member of the worker
+
+    Returns
+    -------
+    data : string or None
+        None if the member has no model
+    """
+    data = _worker['files'][index]
+    if _worker['game'] is not None:
+        data = LandDataMap(_worker['game'], reader=BinaryIO.reader(data)).bmd
+    else:
+        data = member_data(data)
+    if data[:4] != 'BMD0':
+        return None
+    return data
+
+
+def _export_task(args):
+    index, directory, format = args
+    try:
+        data = member_bmd(index)
+        if data is None:
+            return 0
+        bmd = BMD(reader=BinaryIO.reader(data))
+        name = '{0:04d}'.format(index)
+        target = os.path.join(directory, name)
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        for filename, file_data in FORMATS[format](bmd, name).items():
+            with open(os.path.join(target, filename), 'wb') as handle:
+                handle.write(file_data)
+        return len(bmd.mdl.models)
+    except Exception as err:
+        raise RuntimeError('{0}: {1}'.format(index, err))
+
+
+def export(path, directory, format='gltf', processes=None):
+    """Convert the models of a workspace or NARC
+
+    Parameters
+    ----------
+    path : string
+        Workspace directory for its map models, or a NARC or BMD file
+    directory : string
+        Output directory
+    format : string
+        'gltf' or 'obj'
+    processes : int or None
+        Number of worker processes. If None, the number of CPUs is used.
+        If 1, everything is run in this process.
+
+    Returns
+    -------
+    count : int
+        Number of models written
+    """
+    model_format(format)
+    _init_worker(path)
+    tasks = [(index, directory, format)
+             for index in xrange(len(_worker['files']))]
+    return sum(run_tasks(_export_task, tasks, processes, _init_worker,
+                         (path, )))
+
+
+def main(argv):
+    try:
+        options, args = parse_options(argv, [
+            (('-f', '--format'), 'format', model_format)])
+        path, directory = args[:2]
+    except (ValueError, IndexError):
+        print("""Usage: %s [options] WORKSPACE|NARC OUTPUT
+
+    Converts the map models of a workspace, or the BMD members of a NARC,
+    into the OUTPUT directory
+
+    OPTIONS
+        -f FORMAT --format FORMAT
+            gltf or obj. Defaults to gltf
+        -j N --jobs N
+            Number of worker processes. Defaults to the number of CPUs
+        --
+            No further options.
+        """ % argv[0])
+        return 1
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    count = export(path, directory, options.get('format', 'gltf'),
+                   options['processes'])
+    print('{0}: {1} models'.format(path, count))
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+
+    exit(main(sys.argv))
@@ -0,0 +1,151 @@
+"""Headless conversion of sound sequences to MIDI
+
+Every SEQ and SEQARC member of the SDATs of a game, or of a single SDAT,
+is converted to MIDI files across a process pool. Each worker maps the
+SDATs and only reads the sequences it is given.
+
+Sequences are written as OUTPUT/<SDAT name>/<sequence name>.mid and the
+sequences of archives as OUTPUT/<SDAT name>/<archive name>/<index>.mid
+
+Invoke as `python main5.py sequences [options] SDAT|WORKSPACE OUTPUT`
+"""
+
+import os
+
+from ntr.snd.sdat import SDAT
+from ntr.snd.sseq import SSAR, SSEQ
+from ppre.cli import parse_options, run_tasks
+from util import BinaryIO
+
+_worker = {}
+
+
+def find_sdats(path):
+    """Get the SDAT files at a path
+
+    Parameters
+    ----------
+    path : string
+        SDAT file or directory, such as a workspace, to search
+
+    Returns
+    -------
+    paths : list of string
+    """
+    if not os.path.isdir(path):
+        return [path]
+    paths = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith('.sdat'):
+                paths.append(os.path.join(root, name))
+    return paths
+
+
+def _init_worker(paths):
+    _worker['sdats'] = dict((path, SDAT.from_file(path)) for path in paths)
+
+
+def _write(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Made by another worker
+            pass
+    with open(path, 'wb') as handle:
+        handle.write(data)
+
+
+def _convert_task(args):
+    path, record_name, name, directory, loops = args
+    try:
+        data = _worker['sdats'][path].get_member(record_name, name)
+        target = os.path.join(directory,
+                              os.path.splitext(os.path.basename(path))[0],
+                              name)
+        if record_name == 'SEQ':
+            _write(target+'.mid',
+                   SSEQ(reader=BinaryIO.reader(data)).to_midi(loops))
+            return 1
+        ssar = SSAR(reader=BinaryIO.reader(data))
+        for idx in xrange(len(ssar.offsets)):
+            _write(os.path.join(target, '{0:03d}.mid'.format(idx)),
+                   ssar.to_midi(idx, loops))
+        return len(ssar.offsets)
+    except Exception as err:
+        raise RuntimeError('{0}: {1}/{2}: {3}'.format(path, record_name,
+                                                      name, err))
+
+
+def export(path, directory, processes=None, loops=1):
+    """Convert every sequence of one or more SDATs to MIDI files
+
+    Parameters
+    ----------
+    path : string
+        SDAT file or directory with SDAT files
+    directory : string
+        Output directory
+    processes : int or None
+        Number of worker processes. If None, the number of CPUs is used.
+        If 1, everything is run in this process.
+    loops : int
+        Number of repeats of endless loops
+
+    Returns
+    -------
+    count : int
+        Number of MIDI files written
+    """
+    paths = find_sdats(path)
+    _init_worker(paths)
+    tasks = []
+    for sdat_path in paths:
+        sdat = _worker['sdats'][sdat_path]
+        for record_name in ('SEQ', 'SEQARC'):
+            for name in sdat.index.get(record_name, []):
+                try:
+                    sdat.file_id(record_name, name)
+                except IndexError:
+                    continue
+                tasks.append((sdat_path, record_name, name, directory,
+                              loops))
+    return sum(run_tasks(_convert_task, tasks, processes, _init_worker,
+                         (paths, )))
+
+
+def main(argv):
+    try:
+        options, args = parse_options(argv, [
+            (('-l', '--loops'), 'loops', int)])
+        path, directory = args[:2]
+    except (ValueError, IndexError):
+        print("""Usage: %s [options] SDAT|WORKSPACE OUTPUT
+
+    Converts the sequences of an SDAT, or of every SDAT in a directory,
+    into MIDI files in the OUTPUT directory
+
+    OPTIONS
+        -j N --jobs N
+            Number of worker processes. Defaults to the number of CPUs
+        -l N --loops N
+            Number of repeats of endless loops. Defaults to 1
+        --
+            No further options.
+        """ % argv[0])
+        return 1
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    count = export(path, directory, options['processes'],
+                   options.get('loops', 1))
+    print('{0}: {1} sequences'.format(path, count))
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+
+    exit(main(sys.argv))
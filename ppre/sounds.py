@@ -0,0 +1,95 @@
+"""Headless export of the waves of sound archives
+
+Every WAVEARC member of an SDAT is split into its waves, which are decoded
+to WAV files across a process pool. Each worker maps the SDAT and only
+reads the wave archives it is given.
+
+Waves are written as OUTPUT/<wave archive name>/<wave index>.wav
+
+Invoke as `python main5.py sounds [options] SDAT OUTPUT`
+"""
+
+import os
+
+from ntr.snd.sdat import SDAT
+from ntr.snd.swar import SWAR
+from ppre.cli import parse_options, run_tasks
+from util import BinaryIO
+
+_worker = {}
+
+
+def _init_worker(path):
+    _worker['sdat'] = SDAT.from_file(path)
+
+
+def _export_task(args):
+    name, directory = args
+    try:
+        swar = SWAR(reader=BinaryIO.reader(
+            _worker['sdat'].get_member('WAVEARC', name)))
+        target = os.path.join(directory, name)
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        for idx, data in enumerate(swar.get_wavs()):
+            with open(os.path.join(target, '{0:03d}.wav'.format(idx)),
+                      'wb') as handle:
+                handle.write(data)
+        return len(swar.waves)
+    except Exception as err:
+        raise RuntimeError('{0}: {1}'.format(name, err))
+
+
+def export(path, directory, processes=None):
+    """Decode every wave archive of an SDAT to WAV files
+
+    Parameters
+    ----------
+    path : string
+        Path of the SDAT
+    directory : string
+        Output directory
+    processes : int or None
+        Number of worker processes. If None, the number of CPUs is used.
+        If 1, everything is run in this process.
+
+    Returns
+    -------
+    count : int
+        Number of waves written
+    """
+    _init_worker(path)
+    tasks = [(name, directory)
+             for name in _worker['sdat'].index.get('WAVEARC', [])]
+    return sum(run_tasks(_export_task, tasks, processes, _init_worker,
+                         (path, )))
+
+
+def main(argv):
+    try:
+        options, args = parse_options(argv)
+        path, directory = args[:2]
+    except (ValueError, IndexError):
+        print("""Usage: %s [options] SDAT OUTPUT
+
+    Decodes the waves of every wave archive of SDAT into the OUTPUT
+    directory
+
+    OPTIONS
+        -j N --jobs N
+            Number of worker processes. Defaults to the number of CPUs
+        --
+            No further options.
+        """ % argv[0])
+        return 1
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    count = export(path, directory, options['processes'])
+    print('{0}: {1} waves'.format(path, count))
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+
+    exit(main(sys.argv))
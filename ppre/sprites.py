@@ -0,0 +1,385 @@
+"""Headless export of sprite sheets from graphics archives
+
+Members of a NARC are identified by their magic and grouped into sprites
+by a pairing rule. Sprites are rendered across a process pool and written
+as they come in, either packed into atlas pages with a JSON index or as
+individual PNG files.
+
+Rules are JSON objects, or the name of a rule without options::
+
+    {"rule": "nearest"}
+        Every NCER and NSCR uses the closest preceding NCGR and NCLR. An
+        NCGR not used by any of them is rendered on its own with the last
+        NCLR before the next NCGR. This is the default.
+    {"rule": "group", "size": 4, "start": 0, "cgr": 0, "clr": 1, "cer": 2}
+        Members come in groups of "size" from "start". "cgr", "clr",
+        "cer" and "scr" are positions within each group. Groups with
+        members of the wrong type are skipped.
+    {"rule": "explicit", "sprites": [
+        {"name": "hero", "cgr": 10, "clr": 11, "cer": 12}]}
+        Sprites are listed by member index.
+
+Invoke as `python main5.py sprites [options] NARC OUTPUT`
+"""
+
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+from common.lz import LZ
+from ntr.g2d import NCER, NCGR, NCLR, NSCR
+from ntr.g2d import render
+from ntr.narc import NARC
+from ppre.cli import parse_options, run_tasks
+from util import BinaryIO
+from util.cache import RenderCache
+
+MEMBER_TYPES = {
+    'RGCN': 'cgr',
+    'RLCN': 'clr',
+    'RECN': 'cer',
+    'RCSN': 'scr',
+}
+
+PARTS = ('cgr', 'clr', 'cer', 'scr')
+
+
+def member_data(data):
+    """Get the data of an archive member, decompressed if needed"""
+    if data[:4] not in MEMBER_TYPES and data and LZ.is_lz(data):
+        try:
+            return LZ(data).data
+        except Exception:
+            pass
+    return data
+
+
+def _load(cls, files, index):
+    return cls(reader=BinaryIO.reader(member_data(files[index])))
+
+
+def member_types(files):
+    """Get the graphics type of each member ('cgr', 'clr', 'cer', 'scr' or
+    None)"""
+    return [MEMBER_TYPES.get(member_data(data)[:4]) for data in files]
+
+
+def _sprite(index, **parts):
+    sprite = {'name': '{0:04d}'.format(index)}
+    sprite.update(parts)
+    return sprite
+
+
+def pair_nearest(types):
+    sprites = []
+    last = {}
+    pending = None
+    for index, kind in enumerate(types):
+        if kind == 'cgr':
+            if pending is not None and 'clr' in last:
+                sprites.append(_sprite(pending, cgr=pending, clr=last['clr']))
+            pending = index
+        elif kind in ('cer', 'scr'):
+            if 'cgr' in last and 'clr' in last:
+                sprites.append(_sprite(index, cgr=last['cgr'],
+                                       clr=last['clr'], **{kind: index}))
+                if pending == last['cgr']:
+                    pending = None
+        if kind is not None:
+            last[kind] = index
+    if pending is not None and 'clr' in last:
+        sprites.append(_sprite(pending, cgr=pending, clr=last['clr']))
+    return sorted(sprites, key=lambda sprite: sprite['name'])
+
+
+def pair_group(types, rule):
+    sprites = []
+    size = int(rule['size'])
+    for start in xrange(int(rule.get('start', 0)), len(types), size):
+        parts = dict((part, start+int(rule[part]))
+                     for part in PARTS if part in rule)
+        if any(index >= len(types) for index in parts.values()):
+            break
+        if any(types[index] != part for part, index in parts.items()):
+            continue
+        sprites.append(_sprite(start, **parts))
+    return sprites
+
+
+def pair_explicit(types, rule):
+    sprites = []
+    for entry in rule['sprites']:
+        parts = dict((part, int(entry[part]))
+                     for part in PARTS if part in entry)
+        sprite = _sprite(parts.get('cer', parts.get('scr', parts['cgr'])),
+                         **parts)
+        if 'name' in entry:
+            sprite['name'] = entry['name']
+        sprites.append(sprite)
+    return sprites
+
+
+def pair_members(types, rule=None):
+    """Group archive members into sprites
+
+    Parameters
+    ----------
+    types : list
+        Type of each member, as from member_types
+    rule : dict, string or None
+        Pairing rule. See module documentation. If None, "nearest" is used
+
+    Returns
+    -------
+    sprites : list of dict
+        Each has a "name" and the member index of its "cgr", "clr" and
+        optionally "cer" or "scr"
+    """
+    if rule is None:
+        rule = {'rule': 'nearest'}
+    elif isinstance(rule, basestring):
+        rule = {'rule': rule}
+    name = rule.get('rule', 'nearest')
+    try:
+        if name == 'nearest':
+            return pair_nearest(types)
+        elif name == 'group':
+            return pair_group(types, rule)
+        elif name == 'explicit':
+            return pair_explicit(types, rule)
+    except KeyError as err:
+        raise ValueError('Pairing rule "{0}" requires {1}'.format(name, err))
+    raise ValueError('Unknown pairing rule: {0}'.format(name))
+
+
+def render_sprite(files, sprite):
+    """Render the images of a sprite
+
+    Returns
+    -------
+    images : list of (string, np.ndarray)
+        Name and (height, width, 4) RGBA array of each image. A cell bank
+        gives one image per non-empty cell
+    """
+    cgr = _load(NCGR, files, sprite['cgr'])
+    clr = _load(NCLR, files, sprite['clr'])
+    if 'cer' in sprite:
+        cer = _load(NCER, files, sprite['cer'])
+        tiles = cgr.char.get_tile_array()
+        lut = render.palette_lut(clr.get_palette_array())
+        return [('{0}_{1}'.format(sprite['name'], idx),
+                 render.render_cell(tiles, cell, lut))
+                for idx, cell in enumerate(cer.cebk.cells) if cell.attrs]
+    elif 'scr' in sprite:
+        scr = _load(NSCR, files, sprite['scr'])
+        image = scr.get_image(cgr, clr)
+    else:
+        image = cgr.get_image(clr=clr)
+    return [(sprite['name'], np.asarray(image))]
+
+
+class AtlasWriter(object):
+    """Packs images into atlas pages as they are added
+
+    Images are placed left to right on shelves as tall as their tallest
+    image. A page is written once the next image does not fit, and the
+    index of every image is written by close().
+
+    Parameters
+    ----------
+    directory : string
+        Output directory
+    prefix : string
+        Prefix of page and index file names
+    size : int
+        Width and height of pages. Larger images get a page of their own
+    padding : int
+        Transparent pixels between images
+    """
+    def __init__(self, directory, prefix='atlas', size=1024, padding=1):
+        self.directory = directory
+        self.prefix = prefix
+        self.size = size
+        self.padding = padding
+        self.index = {}
+        self.pages = 0
+        self._start_page()
+
+    def _start_page(self):
+        self.page = np.zeros((self.size, self.size, 4), dtype=np.uint8)
+        self.x = self.y = self.shelf = 0
+        self.used = 0
+
+    def _page_name(self):
+        return '{0}_{1}.png'.format(self.prefix, self.pages)
+
+    def _write_page(self, page, height):
+        Image.fromarray(np.ascontiguousarray(page[:height]), 'RGBA').save(
+            os.path.join(self.directory, self._page_name()))
+        self.pages += 1
+
+    def flush(self):
+        """Write the current page if it has any images"""
+        if self.used:
+            self._write_page(self.page, self.y+self.shelf)
+            self._start_page()
+
+    def add(self, name, rgba):
+        height, width = rgba.shape[:2]
+        if width > self.size or height > self.size:
+            self.flush()
+            self.index[name] = {'page': self._page_name(), 'x': 0, 'y': 0,
+                                'width': width, 'height': height}
+            self._write_page(rgba, height)
+            return
+        if self.x+width > self.size:
+            self.x = 0
+            self.y += self.shelf+self.padding
+            self.shelf = 0
+        if self.y+height > self.size:
+            self.flush()
+        self.page[self.y:self.y+height, self.x:self.x+width] = rgba
+        self.index[name] = {'page': self._page_name(), 'x': self.x,
+                            'y': self.y, 'width': width, 'height': height}
+        self.x += width+self.padding
+        self.shelf = max(self.shelf, height)
+        self.used += 1
+
+    def close(self):
+        self.flush()
+        with open(os.path.join(self.directory, self.prefix+'.json'),
+                  'w') as handle:
+            json.dump(self.index, handle, sort_keys=True, indent=2)
+
+
+class PNGWriter(object):
+    """Writes each image to its own PNG file
+
+    Parameters
+    ----------
+    directory : string
+        Output directory
+    cache : RenderCache or None
+        Cache of encoded files. Images that did not change since they were
+        cached are not encoded again
+    """
+    def __init__(self, directory, cache=None):
+        self.directory = directory
+        self.cache = cache
+
+    def add(self, name, rgba):
+        data = render.cached_png(
+            ('sprite', rgba.shape, rgba.tostring()),
+            lambda: render.to_image(rgba), cache=self.cache)
+        with open(os.path.join(self.directory, name+'.png'), 'wb') as handle:
+            handle.write(data)
+
+    def close(self):
+        pass
+
+
+def load_rule(rule):
+    """Get a pairing rule from its name or the path of a JSON rule file"""
+    if os.path.exists(rule):
+        with open(rule) as handle:
+            return json.load(handle)
+    return rule
+
+
+_worker = {}
+
+
+def _init_worker(path):
+    with open(path, 'rb') as handle:
+        _worker['files'] = NARC(handle.read()).files
+
+
+def _render_task(sprite):
+    try:
+        return render_sprite(_worker['files'], sprite)
+    except Exception as err:
+        raise RuntimeError('{0}: {1}'.format(sprite['name'], err))
+
+
+def export(path, writer, rule=None, processes=None):
+    """Render every sprite of a graphics NARC into a writer
+
+    Parameters
+    ----------
+    path : string
+        Path of the NARC
+    writer : AtlasWriter or PNGWriter
+        Receives images in sprite order. It is closed when done
+    rule : dict, string or None
+        Pairing rule
+    processes : int or None
+        Number of worker processes. If None, the number of CPUs is used.
+        If 1, everything is run in this process.
+
+    Returns
+    -------
+    count : int
+        Number of images written
+    """
+    _init_worker(path)
+    sprites = pair_members(member_types(_worker['files']), rule)
+    count = 0
+    for images in run_tasks(_render_task, sprites, processes, _init_worker,
+                            (path, ), ordered=True):
+        for name, rgba in images:
+            writer.add(name, rgba)
+            count += 1
+    writer.close()
+    return count
+
+
+def main(argv):
+    try:
+        options, args = parse_options(argv, [
+            (('-r', '--rule'), 'rule', load_rule),
+            (('-s', '--size'), 'size', int),
+            (('-c', '--cache'), 'cache', str),
+            (('--png', ), 'png', None)])
+        path, directory = args[:2]
+    except (ValueError, IndexError):
+        print("""Usage: %s [options] NARC OUTPUT
+
+    Renders the sprites of a graphics NARC into the OUTPUT directory
+
+    OPTIONS
+        -j N --jobs N
+            Number of worker processes. Defaults to the number of CPUs
+        -r RULE --rule RULE
+            Pairing rule name or JSON rule file. Defaults to nearest
+        -s N --size N
+            Atlas page size. Defaults to 1024
+        --png
+            Write individual PNG files instead of atlas pages
+        -c DIR --cache DIR
+            Keep encoded PNG files in DIR, so that later exports only
+            encode images that changed. Only used with --png
+        --
+            No further options.
+        """ % argv[0])
+        return 1
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    if options.get('png'):
+        cache = None
+        if options.get('cache'):
+            cache = RenderCache(directory=options['cache'])
+        writer = PNGWriter(directory, cache)
+    else:
+        prefix = os.path.splitext(os.path.basename(path))[0]
+        writer = AtlasWriter(directory, prefix, options.get('size', 1024))
+    count = export(path, writer, options.get('rule'), options['processes'])
+    print('{0}: {1} images'.format(path, count))
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+
+    exit(main(sys.argv))
@@ -0,0 +1,47 @@
+
+import struct
+import unittest
+
+import numpy as np
+
+from rawdb.ctr.gfx import etc1
+
+
+class TestETC1(unittest.TestCase):
+    def test_individual_block(self):
+        # Left half 0x888888, right half 0x444444, table 0 and 1
+        hi = (0x84 << 24) | (0x84 << 16) | (0x84 << 8) | (0 << 5) | (1 << 2)
+        # Texel (x=0, y=0) selector 1, texel (x=3, y=3) selector 3
+        lo = (1 << 0) | (1 << 15) | (1 << 31)
+        rgba = etc1.decode_blocks(np.frombuffer(struct.pack('<II', lo, hi),
+                                                dtype=np.uint8)[None])[0]
+        self.assertEqual(rgba[0, 0].tolist(), [0x90, 0x90, 0x90, 255])
+        self.assertEqual(rgba[0, 1].tolist(), [0x8A, 0x8A, 0x8A, 255])
+        self.assertEqual(rgba[3, 3].tolist(), [0x33, 0x33, 0x33, 255])
+        self.assertEqual(rgba[2, 2].tolist(), [0x49, 0x49, 0x49, 255])
+
+    def test_round_trip(self):
+        y, x = np.mgrid[:16, :32]
+        image = np.stack([x*4, y*8, np.full(x.shape, 0x80),
+                          (x % 16)*17], -1).astype(np.uint8)
+        for format in (etc1.FORMAT_ETC1, etc1.FORMAT_ETC1A4):
+            data = etc1.encode(image, format)
+            self.assertEqual(len(data), 32*16/16*etc1.BLOCK_SIZE[format])
+            rgba = etc1.decode(data, 0, format, 32, 16)
+            self.assertLess(np.abs(rgba[..., :3].astype(int) -
+                                   image[..., :3]).mean(), 4)
+            if format == etc1.FORMAT_ETC1A4:
+                self.assertEqual(rgba[..., 3].tolist(),
+                                 image[..., 3].tolist())
+            else:
+                self.assertTrue((rgba[..., 3] == 255).all())
+
+    def test_batch(self):
+        image = np.zeros((8, 16, 4), dtype=np.uint8)
+        image[:, 8:] = 255
+        data = etc1.encode(image)
+        first, second = etc1.decode_batch([(data, 0, etc1.FORMAT_ETC1, 16, 8),
+                                           (data, 0, etc1.FORMAT_ETC1, 8, 8)])
+        self.assertEqual(first[:, :8, :3].max(), 0)
+        self.assertEqual(first[:, 8:, :3].min(), 255)
+        self.assertEqual(second.shape, (8, 8, 4))
@@ -0,0 +1,30 @@
+
+import unittest
+
+import numpy as np
+
+from rawdb.ctr.gfx import swizzle
+
+
+class TestSwizzle(unittest.TestCase):
+    def test_morton(self):
+        self.assertEqual(swizzle.morton([0, 1, 0, 1, 2], [0, 0, 1, 1, 0])
+                         .tolist(), [0, 1, 2, 3, 4])
+        x, y = swizzle.unmorton(swizzle.morton([300, 65535], [4000, 12]))
+        self.assertEqual(x.tolist(), [300, 65535])
+        self.assertEqual(y.tolist(), [4000, 12])
+
+    def test_tiles(self):
+        order = swizzle.swizzle_order(16, 8)
+        self.assertEqual(order[0].tolist(),
+                         [0, 1, 4, 5, 16, 17, 20, 21,
+                          64, 65, 68, 69, 80, 81, 84, 85])
+        self.assertEqual(order[1, :2].tolist(), [2, 3])
+
+    def test_round_trip(self):
+        image = np.arange(32*16*4, dtype=np.uint32).reshape(16, 32, 4)
+        for tile in (8, None):
+            values = swizzle.swizzle(image, tile)
+            self.assertEqual(values.shape, (32*16, 4))
+            self.assertTrue((swizzle.deswizzle(values, 32, 16, tile) ==
+                             image).all())
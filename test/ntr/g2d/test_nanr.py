@@ -0,0 +1,73 @@
+
+import array
+import struct
+import unittest
+
+from PIL import Image
+
+from rawdb.ntr.g2d import NANR, NCER, NCGR, NCLR
+from rawdb.ntr.g2d.nanr import AnimationElement, AnimationSequence
+from rawdb.ntr.g2d.ncer import Cell, CellAttributes
+from rawdb.ntr.g2d.nclr import PLTT
+from rawdb.util import BinaryIO
+
+
+def nanr_data(element_type, elements, frames, mode):
+    seq = struct.pack('<HHIII', len(frames), 0, (1 << 16) | element_type,
+                      mode, 0)
+    frame_data = ''.join(struct.pack('<IHH', ofs, duration, 0xBEEF)
+                         for ofs, duration in frames)
+    body = struct.pack('<HHIIIII', 1, len(frames), 0x18, 0x28,
+                       0x28+len(frame_data), 0, 0)+seq+frame_data + \
+        ''.join(elements)
+    abnk = 'KNBA'+struct.pack('<I', len(body)+8)+body
+    labl = 'LBAL'+struct.pack('<II', 14, 0)+'a\x00'+'\x00'*4
+    return 'RNAN'+struct.pack('<HHIHH', 0xFEFF, 0x100,
+                              16+len(abnk)+len(labl), 16, 3)+abnk+labl
+
+
+class TestNANR(unittest.TestCase):
+    def setUp(self):
+        self.clr = NCLR()
+        self.clr.pltt.format = PLTT.FORMAT_16BIT
+        self.clr.pltt.data = array.array('H', [0]*16)
+        self.clr.pltt.datasize = 32
+        image = Image.new('RGBA', (16, 16), (255, 0, 0, 255))
+        image.paste((0, 255, 0, 255), (0, 0, 8, 8))
+        self.cgr = NCGR()
+        self.cgr.set_image(image, self.clr)
+        self.cer = NCER()
+        cell = Cell(0)
+        attr = CellAttributes()
+        attr.size_ = 1
+        attr.x = attr.y = -8
+        cell.attrs = [attr]
+        cell.num = 1
+        self.cer.cebk.cells = [cell]
+
+    def test_translation(self):
+        elements = [struct.pack('<HHhh', 0, 0xBEEF, 0, 0),
+                    struct.pack('<HHhh', 0, 0xBEEF, 4, 2)]
+        anr = NANR(reader=BinaryIO.reader(nanr_data(
+            AnimationElement.TYPE_TRANSLATION, elements,
+            [(0, 4), (8, 2), (0, 1)], AnimationSequence.MODE_PINGPONG)))
+        seq = anr.abnk.sequences[0]
+        self.assertEqual([frame.element.offset for frame in seq.frames],
+                         [(0, 0), (4, 2), (0, 0)])
+        self.assertIs(seq.frames[0].element, seq.frames[2].element)
+        frames = anr.get_frames(0, self.cer, self.cgr, self.clr)
+        self.assertEqual([duration for rgba, duration in frames],
+                         [4, 2, 1, 2])
+        first, second = frames[0][0], frames[1][0]
+        self.assertEqual(first.shape, (19, 21, 4))
+        self.assertEqual(first[0, 0].tolist(), [0, 248, 0, 255])
+        self.assertEqual(second[0, 0].tolist(), [0, 0, 0, 0])
+        self.assertEqual(second[2, 4].tolist(), [0, 248, 0, 255])
+
+    def test_gif(self):
+        elements = [struct.pack('<HH', 0, 0)]
+        anr = NANR(reader=BinaryIO.reader(nanr_data(
+            AnimationElement.TYPE_INDEX, elements, [(0, 6)],
+            AnimationSequence.MODE_FORWARD_LOOP)))
+        data = anr.get_gif(0, self.cer, self.cgr, self.clr)
+        self.assertEqual(data[:6], 'GIF89a')
@@ -0,0 +1,32 @@
+
+import unittest
+
+import numpy as np
+
+from rawdb.ntr.g2d import render
+
+
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        self.tiles = np.zeros((2, 8, 8), dtype=np.uint8)
+        self.tiles[1, 0, 0] = 1
+        self.lut = render.palette_lut([[(0, 0, 0, 255), (255, 0, 0, 255)],
+                                       [(0, 0, 0, 255), (0, 255, 0, 255)]])
+
+    def test_lut(self):
+        self.assertEqual(self.lut.shape, (16, 256, 4))
+        self.assertEqual(self.lut[0, 0].tolist(), [0, 0, 0, 0])
+        self.assertEqual(self.lut[1, 1].tolist(), [0, 255, 0, 255])
+
+    def test_screen_flip(self):
+        # Tile 1, flipped horizontally and vertically, palette 1
+        entries = [1, 1 | (1 << 10) | (1 << 11) | (1 << 12)]
+        rgba = render.render_screen(self.tiles, entries, 16, 8, self.lut)
+        self.assertEqual(rgba.shape, (8, 16, 4))
+        self.assertEqual(rgba[0, 0].tolist(), [255, 0, 0, 255])
+        self.assertEqual(rgba[7, 15].tolist(), [0, 255, 0, 255])
+        self.assertEqual(int(rgba[:, :, 3].astype(bool).sum()), 2)
+
+    def test_missing_entries(self):
+        rgba = render.render_screen(self.tiles, [1], 16, 16, self.lut)
+        self.assertEqual(int(rgba[:, :, 3].astype(bool).sum()), 1)
@@ -0,0 +1,46 @@
+
+import unittest
+
+import numpy as np
+
+from rawdb.ntr.g2d import tilecodec
+from rawdb.ntr.g2d.ncgr import CHAR, NCGR
+
+
+class TestTileCodec(unittest.TestCase):
+    def test_nibbles(self):
+        indexes = tilecodec.unpack('\x21\xf3', 4)
+        self.assertEqual(indexes.tolist(), [1, 2, 3, 15])
+        self.assertEqual(tilecodec.pack(indexes, 4), '\x21\xf3')
+
+    def test_tiles(self):
+        image = np.arange(16*24, dtype=np.uint8).reshape(16, 24)
+        tiles = tilecodec.image_to_tiles(image)
+        self.assertEqual(tiles.shape, (6, 8, 8))
+        self.assertEqual(tiles[1].tolist(), image[:8, 8:16].tolist())
+        self.assertEqual(tilecodec.tiles_to_image(tiles, 3).tolist(),
+                         image.tolist())
+
+
+class TestCHAR(unittest.TestCase):
+    def test_pixels(self):
+        for fmt in (NCGR().char.FORMAT_16BIT, NCGR().char.FORMAT_256BIT):
+            for layout in (0, NCGR().char.TYPE_LINEAR):
+                cgr = NCGR()
+                cgr.char.format = fmt
+                cgr.char.type = layout
+                pixels = [i % 16 for i in range(16*8)]
+                cgr.char.set_pixels(pixels, 2, 1)
+                self.assertEqual(cgr.char.get_pixels(2, 1), pixels)
+
+    def test_encrypt(self):
+        cgr = NCGR(NCGR.ENCRYPTION_FORWARDS)
+        cgr.char.data = '\x34\x12\x00\x00\x00\x00'
+        cgr.char.encrypt(NCGR.ENCRYPTION_FORWARDS)
+        key = 0x1234
+        expected = []
+        for val in (0x1234, 0, 0):
+            expected.append(val ^ (key & 0xFFFF))
+            key = key*CHAR.ENCRYPT_MULT+CHAR.ENCRYPT_CARRY
+        self.assertEqual(np.frombuffer(cgr.char.data, np.uint16).tolist(),
+                         expected)
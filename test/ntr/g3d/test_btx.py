@@ -1,10 +1,29 @@
 
+import json
+from cStringIO import StringIO
+import os
+import shutil
+import tempfile
 import unittest
 
+from PIL import Image, PngImagePlugin
+
+from rawdb.ntr.g3d import texture
 from rawdb.ntr.g3d.btx import BTX, TEX, TexInfo, TexParam
+from rawdb.util.cache import RenderCache
 from rawdb.util.io import BinaryIO
 
 
+def png(color, **info):
+    image = Image.new('RGBA', (8, 8), color)
+    pnginfo = PngImagePlugin.PngInfo()
+    if info:
+        pnginfo.add_text('Comment', json.dumps(info))
+    buf = StringIO()
+    image.save(buf, 'PNG', pnginfo=pnginfo)
+    return buf.getvalue()
+
+
 class TestBTX(unittest.TestCase):
     def test_default(self):
         default = BTX()
@@ -38,3 +57,42 @@ class TestTEX(unittest.TestCase):
         new = TEX()
         new.load(BinaryIO(out))
         self.assertEqual(default.texparams, new.texparams)
+
+    def test_flush_4x4(self):
+        tex = TEX()
+        tex.add(data=png((248, 0, 0, 255), palidx=0,
+                         format=texture.FORMAT_4X4))
+        tex.add(data=png((0, 0, 248, 255), palidx=0,
+                         format=texture.FORMAT_4X4))
+        tex.add(data=png((0, 248, 0, 255), palidx=0))
+        tex.flush()
+        new = TEX()
+        new.load(BinaryIO(tex.save().getvalue()))
+        self.assertEqual([param.format for param in new.texparams],
+                         [texture.FORMAT_4X4, texture.FORMAT_4X4, 3])
+        colors = [image.getcolors() for image in new.images]
+        self.assertEqual(colors, [[(64, (248, 0, 0, 255))],
+                                  [(64, (0, 0, 248, 255))],
+                                  [(64, (0, 248, 0, 255))]])
+
+    def test_png_cache(self):
+        tex = TEX()
+        tex.add(data=png((0, 248, 0, 255), palidx=0))
+        tex.flush()
+        data = tex.save().getvalue()
+        directory = tempfile.mkdtemp()
+        try:
+            first = TEX(BinaryIO(data))
+            first.png_cache = RenderCache(directory=directory)
+            files = first.files
+            self.assertEqual(len(os.listdir(directory)), 1)
+            # A later session renders nothing
+            second = TEX(BinaryIO(data))
+            second.png_cache = RenderCache(directory=directory)
+
+            def render(*args):
+                raise AssertionError('Rendered again')
+            second._get_image = render
+            self.assertEqual(second.files, files)
+        finally:
+            shutil.rmtree(directory)
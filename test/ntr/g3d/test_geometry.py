@@ -0,0 +1,100 @@
+
+import array
+import json
+import struct
+import unittest
+
+from rawdb.ntr.g3d import export, geometry
+from rawdb.ntr.g3d.bmd import BMD, Material, Model, Shape
+from rawdb.ntr.g3d.btx import PalParam, TexParam
+
+
+def pack(commands):
+    data = ''
+    for start in xrange(0, len(commands), 4):
+        group = commands[start:start+4]
+        group += [(geometry.CMD_NOP, [])]*(4-len(group))
+        data += struct.pack('<I', sum(cmd << (idx*8)
+                                      for idx, (cmd, params)
+                                      in enumerate(group)))
+        for cmd, params in group:
+            data += struct.pack('<{0}I'.format(len(params)), *params)
+    return data
+
+
+class TestGeometry(unittest.TestCase):
+    def setUp(self):
+        self.data = pack([
+            (geometry.CMD_BEGIN_VTXS, [geometry.PRIM_QUADS]),
+            (geometry.CMD_TEXCOORD, [16 << 4 | 8 << 20]),
+            (geometry.CMD_NORMAL, [0x1FF << 10]),
+            (geometry.CMD_COLOR, [0x1F]),
+            (geometry.CMD_VTX_16, [0x1000 | 0x2000 << 16, 0xF000]),
+            (geometry.CMD_VTX_DIFF, [0x3FF]),
+            (geometry.CMD_VTX_XY, [0]),
+            (geometry.CMD_VTX_YZ, [0x1000]),
+            (geometry.CMD_END_VTXS, [])])
+
+    def test_mesh(self):
+        mesh = geometry.decode_mesh(self.data)
+        self.assertEqual(mesh.positions.tolist(), [
+            [1, 2, -1], [4095/4096., 2, -1], [0, 0, -1], [0, 1, 0]])
+        self.assertEqual(mesh.texcoords.tolist(), [[16, 8]]*4)
+        self.assertEqual(mesh.normals.tolist(), [[0, 511/512., 0]]*4)
+        self.assertEqual(mesh.colors.tolist(), [[1, 0, 0]]*4)
+        self.assertEqual(mesh.triangles.tolist(), [[0, 1, 2], [0, 2, 3]])
+        self.assertIs(geometry.cached_mesh(self.data),
+                      geometry.cached_mesh(array.array('B', self.data)))
+
+    def test_strips(self):
+        self.assertEqual(geometry.primitive_triangles(
+            geometry.PRIM_TRIANGLE_STRIP, 2, 5).tolist(),
+            [[2, 3, 4], [4, 3, 5], [4, 5, 6]])
+        self.assertEqual(geometry.primitive_triangles(
+            geometry.PRIM_QUAD_STRIP, 0, 6).tolist(),
+            [[0, 1, 3], [0, 3, 2], [2, 3, 5], [2, 5, 4]])
+
+    def test_export(self):
+        bmd = BMD()
+        model = Model()
+        model.pos_scale_fx32 = 0x2000
+        shape = Shape()
+        shape.data = array.array('B', self.data)
+        model.shapes.shapes = [shape]
+        material = Material()
+        material.poly_attr = 0x1F00C0
+        material.diffuse = 0x7FFF
+        model.materials.materials = [material]
+        model.materials.tex_map = {0: 0}
+        model.materials.texmatdict.names = ['rock\x00']
+        model.sbc = [export.SBC_MAT, 0, export.SBC_SHP, 0, export.SBC_END]
+        bmd.mdl.models = [model]
+        bmd.tex.loaded = True
+        bmd.tex.texdict.names = ['rock'+'\x00'*12]
+        bmd.tex.paldict.names = ['rock_pl']
+        bmd.tex.texparams = [TexParam(0, 32, 16, 3, 0)]
+        bmd.tex.palparams = [PalParam(0, 0)]
+        bmd.tex.texdata = '\x00'*256
+        bmd.tex.paldata = '\x00'*32
+
+        files = export.to_obj(bmd, 'map')
+        self.assertEqual(files.keys(), ['map.obj', 'map.mtl', 'rock.png'])
+        lines = files['map.obj'].splitlines()
+        self.assertIn('v 2.000000 4.000000 -2.000000 1.000000 0.000000 '
+                      '0.000000', lines)
+        self.assertIn('vt 0.500000 0.500000', lines)
+        self.assertEqual(lines[-2:], ['f 1/1/1 2/2/2 3/3/3',
+                                      'f 1/1/1 3/3/3 4/4/4'])
+        self.assertIn('map_Kd rock.png', files['map.mtl'])
+
+        files = export.to_gltf(bmd, 'map')
+        self.assertEqual(files.keys(), ['map.gltf', 'map.bin', 'rock.png'])
+        gltf = json.loads(files['map.gltf'])
+        primitive = gltf['meshes'][0]['primitives'][0]
+        self.assertEqual(sorted(primitive['attributes']),
+                         ['COLOR_0', 'NORMAL', 'POSITION', 'TEXCOORD_0'])
+        position = gltf['accessors'][primitive['attributes']['POSITION']]
+        self.assertEqual(position['max'], [2, 4, 0])
+        self.assertEqual(gltf['images'], [{'uri': 'rock.png'}])
+        self.assertEqual(len(files['map.bin']), gltf['buffers'][0]
+                         ['byteLength'])
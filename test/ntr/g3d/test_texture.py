@@ -0,0 +1,51 @@
+
+import struct
+import unittest
+
+import numpy as np
+
+from rawdb.ntr.g3d import texture
+from rawdb.util.colors import bgr555_to_rgba
+
+
+class TestTexture(unittest.TestCase):
+    def test_i4(self):
+        indexes, alpha = texture.decode_indexed('\x21\x43', 0,
+                                                texture.FORMAT_I4, 4, 1,
+                                                color0=True)
+        self.assertEqual(indexes.tolist(), [[1, 2, 3, 4]])
+        self.assertEqual(alpha.tolist(), [[255, 255, 255, 255]])
+
+    def test_a3i5(self):
+        indexes, alpha = texture.decode_indexed('\xe1\x02', 0,
+                                                texture.FORMAT_A3I5, 2, 1)
+        self.assertEqual(indexes.tolist(), [[1, 2]])
+        self.assertEqual(alpha.tolist(), [[252, 0]])
+
+    def test_truncated(self):
+        indexes, alpha = texture.decode_indexed('\x05', 0,
+                                                texture.FORMAT_I8, 2, 2,
+                                                color0=True)
+        self.assertEqual(indexes.tolist(), [[5, 0], [0, 0]])
+        self.assertEqual(alpha.tolist(), [[255, 0], [0, 0]])
+
+    def test_direct(self):
+        data = struct.pack('<2H', 0x801F, 0x7C00)
+        rgba = texture.decode_direct(data, 0, 2, 1)
+        self.assertEqual(rgba.tolist(), [[[248, 0, 0, 255], [0, 0, 248, 0]]])
+
+    def test_4x4(self):
+        rgba = np.zeros((8, 8, 4), dtype=np.uint8)
+        rgba[:, :, 0] = np.arange(64).reshape(8, 8)*4
+        rgba[:, :, 3] = 255
+        rgba[:4, :4] = [0, 0, 0, 0]
+        rgba[:4, 4:] = [[[248, 0, 0, 255], [0, 248, 0, 255],
+                         [0, 0, 248, 255], [8, 8, 8, 255]]]
+        for quality in (0, 2):
+            texels, pidx, palette = texture.encode_4x4(rgba, quality)
+            selectors, blocks = texture.decode_4x4(texels, pidx, 0, 8, 8)
+            self.assertEqual((blocks >> 14).ravel().tolist(), [1, 2, 3, 3])
+            out = texture.apply_palette_4x4(selectors, blocks,
+                                            bgr555_to_rgba(palette))
+            self.assertEqual(out[:, :, 3].tolist(), rgba[:, :, 3].tolist())
+            self.assertTrue((out[:4, 4:] == rgba[:4, 4:]).all())
@@ -0,0 +1,66 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rawdb.ntr.snd.sdat import SDAT
+from rawdb.test.sdat_fixture import build_sdat
+from rawdb.util import BinaryIO
+
+
+class TestSDAT(unittest.TestCase):
+    def setUp(self):
+        self.members = ['SSEQ'+'\x01'*9, 'SSEQ'+'\x02'*40, 'SSAR'+'\x03'*7,
+                        'SWAR'+'\x04'*200]
+        self.data = build_sdat(self.members)
+        self.sdat = SDAT(reader=BinaryIO(self.data))
+
+    def test_index(self):
+        self.assertEqual(self.sdat.index['SEQ'].items(),
+                         [('intro', 0), ('town', 1)])
+        self.assertEqual(self.sdat.index['SEQARC'].items(), [('fx', 0)])
+        self.assertEqual(self.sdat.index['WAVEARC'].items(), [('0', 0)])
+        self.assertEqual(self.sdat.symb.records['SEQARC'],
+                         [('SEQARC', 'fx', 'step')])
+        self.assertEqual(self.sdat.get_member('SEQ', 'town'), self.members[1])
+        self.assertEqual(self.sdat.get_member('WAVEARC', 0), self.members[3])
+        self.assertRaises(KeyError, self.sdat.get_member, 'SEQ', 'field')
+
+    def test_files(self):
+        self.assertEqual(sorted(self.sdat.files), [
+            'SEQ/intro.sseq', 'SEQ/town.sseq', 'SEQARC/fx.ssar',
+            'WAVEARC/0.swar'])
+        self.assertEqual(self.sdat.files['SEQARC/fx.ssar'], self.members[2])
+        self.assertFalse(self.sdat.file.files.replaced)
+
+    def test_save(self):
+        self.assertEqual(self.sdat.save().getvalue(), self.data)
+        self.sdat.files['SEQ/intro.sseq'] = 'SSEQ'+'\x05'*50
+        self.members[0] = 'SSEQ'+'\x05'*50
+        self.assertEqual(self.sdat.save().getvalue(),
+                         build_sdat(self.members))
+        self.sdat.reset()
+        self.assertEqual(self.sdat.get_member('SEQ', 0), 'SSEQ'+'\x01'*9)
+
+    def test_save_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'sound.sdat')
+            with open(path, 'wb') as handle:
+                handle.write(self.data)
+            sdat = SDAT.from_file(path)
+            sdat.files['SEQ/intro.sseq'] = 'SSEQ'+'\x05'*50
+            self.members[0] = 'SSEQ'+'\x05'*50
+            sdat.save_file(path)
+            with open(path, 'rb') as handle:
+                self.assertEqual(handle.read(), build_sdat(self.members))
+            self.assertEqual(sdat.get_member('WAVEARC', 0), self.members[3])
+            sdat = SDAT.from_file(path)
+            self.assertEqual(sdat.get_member('SEQ', 'intro'),
+                             self.members[0])
+            # Opening the source for writing truncates it
+            with open(path, 'wb') as handle:
+                self.assertRaises(IOError, sdat.save, handle)
+        finally:
+            shutil.rmtree(directory)
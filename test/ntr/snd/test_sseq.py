@@ -0,0 +1,81 @@
+
+import struct
+import unittest
+
+from rawdb.ntr.snd import sseq
+from rawdb.util import BinaryIO
+
+
+def u24(value):
+    return struct.pack('<I', value)[:3]
+
+
+class TestSSEQ(unittest.TestCase):
+    def setUp(self):
+        track0 = ('\xFE\x03\x00' '\x93\x01{track1}' '\xE1\x78\x00'
+                  '\x81\x85\x05' '\x3C\x64\x30' '\x80\x18' '\xD4\x02'
+                  '\x40\x50\x18' '\xFC' '\xA0\x41\x40\x10\x00\x20\x00' '\xFF')
+        start = len(track0.format(track1='...'))
+        track1 = ('\xC3\x02' '\x95'+u24(start+10)+'\x94'+u24(start) +
+                  '\x43\x64\x0C' '\xFD')
+        self.data = track0.format(track1=u24(start))+track1
+        self.track1 = start
+
+    def test_events(self):
+        events = [(event.name, event.args)
+                  for event in sseq.track_events(self.data)]
+        self.assertEqual(events, [
+            ('allocate_tracks', (3, )), ('open_track', (1, self.track1)),
+            ('tempo', (120, )), ('program', (645, )), ('note', (60, 100, 48)),
+            ('rest', (24, )), ('note', (64, 80, 24)), ('note', (64, 80, 24)),
+            ('note', (65, 64, 24))])
+        events = [(event.name, event.args) for event in
+                  sseq.track_events(self.data, self.track1, loops=2)]
+        self.assertEqual(events, [('transpose', (2, )),
+                                  ('note', (67, 100, 12))]*3)
+
+    def test_midi(self):
+        midi_file = sseq.to_midi(self.data)
+        self.assertEqual([track.channel for track in midi_file.tracks],
+                         [0, 1])
+        notes = [(tick, data) for tick, priority, seq, data
+                 in sorted(midi_file.tracks[0].events) if data[0] == '\x90']
+        self.assertEqual(notes, [(0, '\x90\x3C\x64'), (72, '\x90\x40\x50'),
+                                 (96, '\x90\x40\x50'), (120, '\x90\x41\x40')])
+        notes = [(tick, data) for tick, priority, seq, data
+                 in sorted(midi_file.tracks[1].events)]
+        self.assertEqual(notes, [(0, '\x91\x45\x64'), (12, '\x81\x45\x40'),
+                                 (12, '\x91\x45\x64'), (24, '\x81\x45\x40')])
+
+    def test_sseq(self):
+        seq = sseq.SSEQ()
+        seq.data = self.data
+        data = seq.save().getvalue()
+        seq = sseq.SSEQ(reader=BinaryIO(data))
+        self.assertEqual(seq.data[:len(self.data)], self.data)
+        midi_data = seq.to_midi()
+        self.assertEqual(midi_data[:14],
+                         'MThd\x00\x00\x00\x06\x00\x01\x00\x02\x00\x30')
+        self.assertEqual(midi_data.count('MTrk'), 2)
+
+    def test_decompile(self):
+        seq = sseq.SSEQ()
+        seq.data = self.data
+        lines = seq.decompile().lines
+        self.assertEqual([(line.name, line.args) for line in lines[:4]],
+                         [('allocate_tracks', (3, )),
+                          ('open_track', (1, self.track1)),
+                          ('tempo', (120, )), ('program', (645, ))])
+        self.assertTrue(lines[-1].is_return())
+        handle = BinaryIO(self.data)
+        handle.seek(self.track1)
+        decompiler = sseq.SSEQDecompiler(handle)
+        decompiler.parse()
+        lines = decompiler.lines
+        self.assertEqual([(line.name, line.args) for line in lines[:2]],
+                         [('transpose', (2, )), ('call', (self.track1+10, ))])
+        # Jumps end the listing
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[2].is_return())
+        jump = lines[2].args[0]
+        self.assertEqual((jump.name, jump.args), ('jump', (self.track1, )))
@@ -0,0 +1,74 @@
+
+import struct
+import unittest
+import wave
+
+import numpy as np
+
+from rawdb.ntr.snd import swav
+from rawdb.ntr.snd.swar import SWAR
+from rawdb.util import BinaryIO
+
+
+def decode_adpcm(data):
+    sample, index = struct.unpack_from('<hH', data)
+    samples = []
+    for byte in bytearray(data[4:]):
+        for code in (byte & 0xF, byte >> 4):
+            step = swav.ADPCM_STEPS[index]
+            diff = step >> 3
+            if code & 1:
+                diff += step >> 2
+            if code & 2:
+                diff += step >> 1
+            if code & 4:
+                diff += step
+            if code & 8:
+                sample = max(sample-diff, -0x7FFF)
+            else:
+                sample = min(sample+diff, 0x7FFF)
+            index = min(max(index+swav.ADPCM_INDEXES[code & 7], 0), 88)
+            samples.append(sample)
+    return samples
+
+
+class TestSWAV(unittest.TestCase):
+    def test_clamped_sums(self):
+        deltas = np.array([5, 5, -20, 3, 9, -1])
+        self.assertEqual(swav.clamped_sums(2, deltas, 0, 10, 4).tolist(),
+                         [7, 10, 0, 3, 10, 9])
+
+    def test_adpcm(self):
+        rng = np.random.RandomState(0)
+        for start, index, codes in [
+                (0, 0, rng.randint(0, 256, 3000)),
+                (-32000, 80, np.full(100, 0x99)),
+                (32000, 88, np.full(100, 0x77))]:
+            data = struct.pack('<hH', start, index) + \
+                codes.astype(np.uint8).tostring()
+            self.assertEqual(swav.decode_adpcm(data).tolist(),
+                             decode_adpcm(data))
+
+    def test_swar(self):
+        swar = SWAR()
+        for format, data in [(swav.FORMAT_PCM8, '\x80\x00\x7F\x01'),
+                             (swav.FORMAT_PCM16, '\x00\x80\xFF\x7F'),
+                             (swav.FORMAT_ADPCM, '\x00\x00\x00\x00\x70\x89')]:
+            info = swav.WaveInfo()
+            info.format = format
+            info.rate = 8000
+            info.data = data
+            swar.waves.append(info)
+        data = swar.save().getvalue()
+        swar = SWAR(reader=BinaryIO(data))
+        self.assertEqual(swar.save().getvalue(), data)
+        self.assertEqual(swar.waves[1].get_samples().tolist(),
+                         [-0x8000, 0x7FFF])
+        wav = wave.open(BinaryIO(swar.get_wavs()[0]))
+        self.assertEqual((wav.getsampwidth(), wav.getframerate()), (1, 8000))
+        self.assertEqual(wav.readframes(4), '\x00\x80\xFF\x81')
+        swav_data = swar.files[2]
+        self.assertEqual(swav_data[:4], 'SWAV')
+        wave_info = swav.SWAV(reader=BinaryIO(swav_data)).info
+        self.assertEqual(wave_info.get_samples().tolist(),
+                         decode_adpcm('\x00\x00\x00\x00\x70\x89\x00\x00'))
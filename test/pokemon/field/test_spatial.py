@@ -0,0 +1,72 @@
+
+import struct
+import unittest
+
+from rawdb.pokemon.field import spatial
+
+
+class Archive(object):
+    def __init__(self, files):
+        self.files = files
+
+
+class Game(object):
+    def is_hgss(self):
+        return False
+
+
+def zone_events(overworlds=(), warps=(), triggers=()):
+    data = struct.pack('<I', 0)
+    data += struct.pack('<I', len(overworlds))
+    for x, y in overworlds:
+        data += struct.pack('<16H', *([0]*12+[x, y, 0, 0]))
+    data += struct.pack('<I', len(warps))
+    for x, y, map_id in warps:
+        data += struct.pack('<6H', x, y, map_id, 0, 0, 0)
+    data += struct.pack('<I', len(triggers))
+    for x, y, width, height in triggers:
+        data += struct.pack('<8H', 0, x, y, width, height, 0, 0, 0)
+    return data
+
+
+def land_data(objects):
+    data = ''.join(struct.pack('<I6h6i2I', 1, 0, x, 0, 0, 0, y,
+                               0, 0, 0, 4096, 4096, 4096, 0, 0)
+                   for x, y in objects)
+    return struct.pack('<4I', 0x800, len(data), 0, 0)+'\x00'*0x800+data
+
+
+class TestSpatial(unittest.TestCase):
+    def setUp(self):
+        self.game = Game()
+        self.game.land_data_archive = Archive([land_data([(0, 0)]),
+                                               land_data([(-16, 15)])])
+        self.game.event_archive = Archive([zone_events(
+            overworlds=[(50, 10)], warps=[(40, 5, 7), (3, 3, 9)],
+            triggers=[(30, 30, 4, 4)])])
+        self.game.map_matrix_archive = Archive([
+            struct.pack('<5B2H', 2, 1, 0, 0, 0, 0, 1)])
+        self.index = spatial.MatrixIndex(self.game, 0, event_ids=[0])
+
+    def test_query(self):
+        self.assertEqual(len(self.index.query(0, 0, 64, 32)), 6)
+        self.assertEqual([(entry.kind, entry.x, entry.y)
+                          for entry in self.index.at(32, 31)],
+                         [('object', 32, 31), ('trigger', 30, 30)])
+        self.assertEqual([entry.kind for entry in self.index.at(33, 33)],
+                         ['trigger'])
+        self.assertEqual(self.index.query(0, 0, 64, 32, kinds=['warp']),
+                         self.index.warps_to(7)+self.index.warps_to(9))
+        self.assertEqual(self.index.warps_to(7)[0].index, 0)
+        self.assertEqual(self.index.warps_to(8), [])
+
+    def test_refresh(self):
+        self.assertEqual(self.index.refresh(), 0)
+        self.game.land_data_archive.files[1] = land_data([(1, 1)])
+        self.game.event_archive.files[0] = zone_events(warps=[(0, 0, 8)])
+        self.assertEqual(self.index.refresh(), 2)
+        self.assertEqual([(entry.x, entry.y) for entry in self.index.query(
+            32, 0, 32, 32, kinds=[spatial.KIND_OBJECT])], [(49, 17)])
+        self.assertEqual(self.index.warps_to(7), [])
+        self.assertEqual(len(self.index.warps_to(8)), 1)
+        self.assertEqual(self.index.at(32, 31), [])
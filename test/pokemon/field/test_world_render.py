@@ -0,0 +1,61 @@
+
+import struct
+import unittest
+
+import numpy as np
+
+from rawdb.pokemon.field.land_data.land_data_map import LandDataMap
+from rawdb.pokemon.field.world_render import WorldRenderer
+
+
+class Archive(object):
+    def __init__(self, files):
+        self.files = files
+
+
+class Game(object):
+    def is_hgss(self):
+        return False
+
+
+def land_data(seed):
+    permissions = np.random.RandomState(seed).randint(0, 256, 0x800)
+    return struct.pack('<4I', 0x800, 0, 0, 0) + \
+        permissions.astype(np.uint8).tostring()
+
+
+class TestWorldRender(unittest.TestCase):
+    def setUp(self):
+        self.game = Game()
+        self.game.land_data_archive = Archive([land_data(seed)
+                                               for seed in xrange(3)])
+        land_data_ids = np.array([[0, 1, 0xFFFF], [2, 0, 1]], dtype='<u2')
+        altitudes = np.array([[0, 0, 0], [2, 2, 2]], dtype=np.uint8)
+        self.game.map_matrix_archive = Archive([
+            struct.pack('<5B', 3, 2, 0, 1, 4)+'test'+altitudes.tostring() +
+            land_data_ids.tostring()])
+
+    def test_perm_image(self):
+        land = LandDataMap(self.game, reader=self.game.land_data_archive
+                           .files[0])
+        self.assertEqual(land.get_permission_array()[0, 1, 0],
+                         land.permissions.entries[1].perm)
+        self.assertEqual(land.get_perm_image(4).size, (128, 128))
+
+    def test_render(self):
+        renderer = WorldRenderer(self.game, res=1)
+        overview = renderer.render(0).copy()
+        self.assertEqual(overview.shape, (64, 96, 4))
+        # Cells at the lowest altitude are half as bright
+        self.assertTrue((overview[:32, :32, :3] ==
+                         overview[32:, 32:64, :3]//2).all())
+        self.assertFalse(overview[:32, 64:].any())
+        self.assertEqual(len(renderer.cells), 5)
+
+        self.game.land_data_archive.files[1] = land_data(3)
+        changed = renderer.render(0)
+        self.assertEqual(len(renderer.cells), 7)
+        self.assertTrue((changed[:, :32] == overview[:, :32]).all())
+        self.assertFalse((changed[:32, 32:64] == overview[:32, 32:64]).all())
+        self.assertTrue((changed == WorldRenderer(self.game, res=1)
+                         .render(0)).all())
@@ -0,0 +1,45 @@
+
+import struct
+import unittest
+
+import numpy as np
+
+from rawdb.pokemon.graphic import font
+
+
+class TestFont(unittest.TestCase):
+    def setUp(self):
+        self.pixels = np.zeros((3, 16, 16), dtype=np.uint8)
+        self.pixels[0, 2, 1:4] = 1
+        self.pixels[0, 9, 12] = 3
+        self.pixels[2, 15, 15] = 2
+        data = font.encode_glyphs(self.pixels)
+        self.data = struct.pack('<IIIBBBB', 0x10, 0x10+len(data), 3,
+                                16, 16, 2, 2)+data+'\x0D\x00\x10'
+
+    def test_layout(self):
+        # Leftmost pixel of a tile row is in the highest bits
+        data = struct.pack('<H', 0x4003)+'\x00'*62
+        pixels = font.decode_glyphs(data)
+        self.assertEqual(pixels[0, 0, :8].tolist(), [1, 0, 0, 0, 0, 0, 0, 3])
+        self.assertEqual(font.encode_glyphs(pixels), data)
+
+    def test_bboxes(self):
+        fnt = font.Font(reader=self.data)
+        self.assertTrue((fnt.get_glyph_array() == self.pixels).all())
+        self.assertEqual(font.glyph_bboxes(self.pixels).tolist(),
+                         [[12, 8, 1, 2], [0, 0, 0, 2], [1, 1, 15, 15]])
+        self.assertEqual(fnt.glyphs[0].get_bbox(), (12, 8, 1, 2))
+
+    def test_bdf_rows(self):
+        rows = font.bdf_rows(self.pixels, [4, 0, 16])
+        self.assertEqual(rows[0].split('\n')[2], '3F')
+        self.assertEqual(rows[1].split('\n')[0], '00')
+        self.assertEqual(rows[2].split('\n')[15], '00000002')
+
+    def test_image(self):
+        fnt = font.Font(reader=self.data)
+        image = fnt.to_image(2)
+        self.assertEqual(image.size, (32, 32))
+        self.assertEqual(image.getpixel((2, 2)), (0, 0, 0, 255))
+        self.assertEqual(image.getpixel((15, 31)), (0x88, 0x88, 0x88, 255))
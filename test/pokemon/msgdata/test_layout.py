@@ -0,0 +1,34 @@
+
+import unittest
+
+import numpy as np
+
+from rawdb.pokemon.msgdata import layout
+from rawdb.pokemon.msgdata.msg import load_table
+
+
+class TestLayout(unittest.TestCase):
+    def setUp(self):
+        table, rtable = load_table()
+        widths = np.zeros(max(rtable['A'], rtable['B'], rtable[' ']),
+                          dtype=np.int32)
+        widths[rtable['A']-1] = 5
+        widths[rtable['B']-1] = 6
+        widths[rtable[' ']-1] = 3
+        self.layout = layout.TextLayout(widths, 12, 2, var_widths={257: 20},
+                                        var_width=8)
+
+    def test_measure(self):
+        owners, widths, rows = self.layout.measure(
+            ['AB', 'A\\nB\\rAA\\fB', '', 'VAR(257, 0) VAR(1)\\n'])
+        self.assertEqual(owners.tolist(), [0, 1, 1, 1, 1, 2, 3, 3])
+        self.assertEqual(widths.tolist(), [11, 5, 6, 10, 6, 0, 31, 0])
+        self.assertEqual(rows.tolist(), [0, 0, 1, 1, 0, 0, 0, 1])
+
+    def test_overflows(self):
+        overflows = self.layout.overflows(
+            ['AB', 'AAA\\nB\\nA', 'VAR(1)'], [(0, 0), (0, 4), (3, 1)])
+        self.assertEqual(overflows, [
+            layout.Overflow(0, 4, 0, 0, 15, 'AAA'),
+            layout.Overflow(0, 4, 2, 2, 5, 'A'),
+        ])
@@ -0,0 +1,95 @@
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from rawdb.ntr.header_bin import HeaderBin
+from rawdb.ntr.narc import NARC
+from rawdb.pokemon.poketool.evo import Evolutions
+from rawdb.ppre import batch
+
+
+JOBS = """
+jobs = [
+    {'action': 'transform', 'record': 'evo', 'function': 'retarget',
+     'records': '1-2'},
+    {'action': 'export', 'record': 'evo', 'output': '%(dir)s/{game}.json'},
+    {'action': 'import', 'record': 'evo', 'input': '%(dir)s/edited.json'},
+]
+
+
+def retarget(game, index, record):
+    record.entries[0].target = index+100
+"""
+
+
+def make_workspace(directory, files):
+    """Write a Diamond workspace holding an evolution NARC"""
+    header = HeaderBin()
+    header.base_code = 'ADAE'
+    with open(os.path.join(directory, 'header.bin'), 'wb') as handle:
+        handle.write(header.save().getvalue())
+    with open(os.path.join(directory, 'config.json'), 'w') as handle:
+        handle.write('{}')
+    narc = NARC()
+    for data in files:
+        narc.add(data=data)
+    path = os.path.join(directory, 'fs', 'poketool', 'personal', 'evo.narc')
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as handle:
+        handle.write(narc.save().getvalue())
+    return path
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.workspace = os.path.join(self.directory, 'workspace')
+        os.mkdir(self.workspace)
+        self.narc_path = make_workspace(
+            self.workspace, [Evolutions().save().getvalue()]*3)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_records(self):
+        self.assertEqual(batch.parse_records('1-3,7, 9-9,'), [1, 2, 3, 7, 9])
+        self.assertEqual(batch.parse_records([4, '5']), [4, 5])
+        self.assertEqual(batch.parse_records(''), [])
+
+    def test_shard(self):
+        self.assertEqual(batch.shard(range(7), 3), [[0, 1, 2], [3, 4, 5],
+                                                    [6]])
+        self.assertEqual(batch.shard(range(2), 4), [[0], [1]])
+        self.assertEqual(batch.shard([], 4), [])
+        self.assertEqual(batch.shard(range(3), 0), [[0, 1, 2]])
+
+    def test_roundtrip(self):
+        job_path = os.path.join(self.directory, 'jobs.py')
+        with open(job_path, 'w') as handle:
+            handle.write(JOBS % {'dir': self.directory})
+        runner = batch.BatchRunner(self.workspace, job_path, processes=1)
+        try:
+            jobs = batch.load_jobs(job_path)
+            self.assertEqual(runner.run(jobs[0]), 2)
+            self.assertEqual(runner.run(jobs[1]), 3)
+            with open(os.path.join(self.directory, 'Diamond.json')) \
+                    as handle:
+                exported = json.load(handle)
+            self.assertEqual(sorted(exported), ['0', '1', '2'])
+            exported['0']['entries'][1]['method'] = 4
+            with open(os.path.join(self.directory, 'edited.json'), 'w') \
+                    as handle:
+                json.dump(exported, handle)
+            # Only the edited record is written back
+            self.assertEqual(runner.run(jobs[2]), 1)
+        finally:
+            runner.close()
+        with open(self.narc_path, 'rb') as handle:
+            narc = NARC(handle.read())
+        evos = [Evolutions(reader=data) for data in narc.files]
+        self.assertEqual([evo.entries[0].target for evo in evos],
+                         [0, 101, 102])
+        self.assertEqual([evo.entries[1].method for evo in evos], [4, 0, 0])
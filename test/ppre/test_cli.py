@@ -0,0 +1,32 @@
+
+import unittest
+
+from rawdb.ppre import cli
+
+
+def square_task(task):
+    return task*task
+
+
+class TestCLI(unittest.TestCase):
+    def test_parse_options(self):
+        options = [(('-l', '--loops'), 'loops', int), (('--png', ), 'png',
+                                                       None)]
+        self.assertEqual(cli.parse_options(['prog', '-j', '2', '--png', '-l',
+                                            '3', 'a', '-b'], options),
+                         ({'processes': 2, 'png': True, 'loops': 3},
+                          ['a', '-b']))
+        self.assertEqual(cli.parse_options(['prog', '--', '-a']),
+                         ({'processes': None}, ['-a']))
+        self.assertRaises(ValueError, cli.parse_options, ['prog', '-x'])
+        self.assertRaises(ValueError, cli.parse_options, ['prog', '-j', 'x'])
+        self.assertRaises(IndexError, cli.parse_options, ['prog', '-j'])
+
+    def test_run_tasks(self):
+        self.assertEqual(list(cli.run_tasks(square_task, [1, 2, 3], 1)),
+                         [1, 4, 9])
+        self.assertEqual(list(cli.run_tasks(square_task, range(8), 2,
+                                            ordered=True)),
+                         [idx*idx for idx in xrange(8)])
+        self.assertEqual(sorted(cli.run_tasks(square_task, range(8), 2)),
+                         [idx*idx for idx in xrange(8)])
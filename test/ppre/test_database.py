@@ -0,0 +1,106 @@
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from rawdb.ntr.header_bin import HeaderBin
+from rawdb.ntr.narc import NARC
+from rawdb.pokemon.game import Game
+from rawdb.pokemon.poketool.evo import Evolutions
+from rawdb.ppre import database
+
+
+class Text(object):
+    def __init__(self, *values):
+        self.ids = dict((idx, 'entry_{0}'.format(idx))
+                        for idx in xrange(len(values)))
+        self.files = dict(('entry_{0}'.format(idx), value)
+                          for idx, value in enumerate(values))
+
+
+def evo(target):
+    evolutions = Evolutions()
+    evolutions.entries[0].method = 4
+    evolutions.entries[0].target = target
+    return evolutions.save().getvalue()
+
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        header = HeaderBin()
+        header.base_code = 'ADAE'
+        with open(os.path.join(self.directory, 'header.bin'), 'wb') \
+                as handle:
+            handle.write(header.save().getvalue())
+        with open(os.path.join(self.directory, 'config.json'), 'w') \
+                as handle:
+            handle.write('{}')
+        self.narc_path = os.path.join(self.directory, 'fs', 'poketool',
+                                      'personal', 'evo.narc')
+        os.makedirs(os.path.dirname(self.narc_path))
+        self.write_evos([evo(target) for target in (1, 2, 3)])
+        self.game = Game.from_workspace(self.directory)
+        self.path = os.path.join(self.directory, 'test.db')
+
+    def tearDown(self):
+        self.game.close()
+        shutil.rmtree(self.directory)
+
+    def write_evos(self, files):
+        narc = NARC()
+        for data in files:
+            narc.add(data=data)
+        with open(self.narc_path, 'wb') as handle:
+            handle.write(narc.save().getvalue())
+        # Make sure the change is seen even within the timestamp resolution
+        stat = os.stat(self.narc_path)
+        os.utime(self.narc_path, (stat.st_atime, stat.st_mtime+1))
+
+    def query(self, sql):
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    def test_resync(self):
+        self.assertEqual(database.export(self.game, self.path, ['evo']),
+                         {'evo': 3})
+        self.assertEqual(database.export(self.game, self.path, ['evo']),
+                         {'evo': 0})
+        # Tag a row of each member to see which ones get rewritten
+        conn = sqlite3.connect(self.path)
+        conn.execute('UPDATE evo_entries SET param = 7 WHERE idx = 0')
+        conn.commit()
+        conn.close()
+        self.write_evos([evo(1), evo(5)])
+        self.assertEqual(database.export(self.game, self.path, ['evo']),
+                         {'evo': 1})
+        self.assertEqual(self.query(
+            'SELECT id, param, target FROM evo_entries WHERE idx = 0 '
+            'ORDER BY id'), [(0, 7, 1), (1, 0, 5)])
+        self.assertEqual(self.query('SELECT id FROM _members ORDER BY id'),
+                         [(0, ), (1, )])
+
+    def test_delete_text(self):
+        exporter = database.DatabaseExporter(self.game, self.path)
+        try:
+            for bank in xrange(3):
+                exporter.insert_text(bank, Text('a', 'b'))
+            exporter.delete('text', 1)
+            self.assertEqual(exporter.conn.execute(
+                'SELECT DISTINCT bank FROM text').fetchall(), [(0, ), (2, )])
+            exporter.delete('text', 1, following=True)
+            self.assertEqual(exporter.conn.execute(
+                'SELECT bank, id, value FROM text').fetchall(),
+                [(0, 0, 'a'), (0, 1, 'b')])
+        finally:
+            exporter.close()
+
+    def test_main_usage(self):
+        for argv in (['database', '-r'], ['database', '-r', 'nothing', 'a',
+                                          'b'], ['database', 'a']):
+            self.assertEqual(database.main(argv), 1)
@@ -0,0 +1,67 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rawdb.ntr.narc import NARC
+from rawdb.pokemon.poketool.evo import Evolutions
+from rawdb.ppre import diff
+from rawdb.ppre.batch import RECORD_TYPES
+
+
+def evo_narc(targets):
+    narc = NARC()
+    for target in targets:
+        evolutions = Evolutions()
+        evolutions.entries[0].target = target
+        narc.add(data=evolutions.save().getvalue())
+    return narc.save().getvalue()
+
+
+class TestDiff(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.old = os.path.join(self.directory, 'old')
+        self.new = os.path.join(self.directory, 'new')
+        self.write(self.old, 'fs/evo.narc', evo_narc([1, 2, 3]))
+        self.write(self.new, 'fs/evo.narc', evo_narc([1, 5, 3, 4]))
+        for workspace in (self.old, self.new):
+            self.write(workspace, 'header.bin', 'same')
+        self.write(self.old, 'cache/render/ab.png', 'old')
+        self.write(self.new, 'cache/render/cd.png', 'new')
+        self.write(self.new, 'fs/cache/data.bin', 'added')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, workspace, path, data):
+        path = os.path.join(workspace, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as handle:
+            handle.write(data)
+
+    def test_paths(self):
+        self.assertEqual(diff.WorkspaceSource(self.new).paths(),
+                         ['fs/cache/data.bin', 'fs/evo.narc', 'header.bin'])
+
+    def test_diff(self):
+        changes = list(diff.diff(diff.WorkspaceSource(self.old),
+                                 diff.WorkspaceSource(self.new)))
+        self.assertEqual([(change.kind, change.path, change.member)
+                          for change in changes],
+                         [('added', 'fs/cache/data.bin', None),
+                          ('modified', 'fs/evo.narc', 1),
+                          ('added', 'fs/evo.narc', 3)])
+
+    def test_diff_record(self):
+        old = diff.WorkspaceSource(self.old)
+        new = diff.WorkspaceSource(self.new)
+        changes = list(diff.diff_file('fs/evo.narc', old.read('fs/evo.narc'),
+                                      new.read('fs/evo.narc'), None,
+                                      RECORD_TYPES['evo']))
+        self.assertEqual([(change.member, change.field, change.old,
+                           change.new) for change in changes[:1]],
+                         [(1, 'entries.0.target', 2, 5)])
+        self.assertEqual(len(changes), 2)
@@ -0,0 +1,70 @@
+
+import array
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from rawdb.ntr.g3d import export as g3d_export
+from rawdb.ntr.g3d.bmd import BMD, Model, Shape
+from rawdb.ntr.narc import NARC
+from rawdb.ppre import models
+
+
+def build_bmd(shape_data):
+    """BMD with one untextured model drawing one shape"""
+    bmd = BMD()
+    model = Model()
+    shape = Shape()
+    shape.data = array.array('B', shape_data)
+    shape.data_size = len(shape_data)
+    model.shapes.shapes = [shape]
+    model.shapes.shapedict.names = ['shape'.ljust(16, '\x00')]
+    model.num_shapes = 1
+    model.sbc = [g3d_export.SBC_SHP, 0, g3d_export.SBC_END]
+    bmd.mdl.models = [model]
+    bmd.mdl.mdldict.names = ['map'.ljust(16, '\x00')]
+    bmd.mdl.mdldict.data = ['\x00'*4]
+    bmd.tex.loaded = False
+    return bmd.save().getvalue()
+
+
+def square():
+    """Display list of one quad"""
+    commands = [(0x40, [1]), (0x24, [0]), (0x24, [0x1000]),
+                (0x24, [0x1000 | 0x1000 << 16]), (0x24, [0x1000 << 16])]
+    data = ''
+    for cmd, params in commands:
+        data += struct.pack('<4B', cmd, 0, 0, 0)
+        data += struct.pack('<{0}I'.format(len(params)), *params)
+    return data+struct.pack('<4B', 0x41, 0, 0, 0)
+
+
+class TestModels(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, 'out')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def files(self, *parts):
+        return sorted(os.listdir(os.path.join(self.output, *parts)))
+
+    def test_main(self):
+        narc = NARC()
+        for data in ('', build_bmd(square()), 'BMD1'):
+            narc.add(data=data)
+        path = os.path.join(self.directory, 'models.narc')
+        with open(path, 'wb') as handle:
+            handle.write(narc.save().getvalue())
+        self.assertEqual(models.main(['models', '-f', 'obj', '--jobs', '1',
+                                      path, self.output]), 0)
+        self.assertEqual(self.files(), ['0001'])
+        self.assertEqual(self.files('0001'), ['0001.mtl', '0001.obj'])
+        with open(os.path.join(self.output, '0001', '0001.obj')) as handle:
+            lines = handle.read().splitlines()
+        self.assertEqual(lines[-2:], ['f 1 2 3', 'f 1 3 4'])
+        self.assertEqual(models.main(['models', '-f', 'fbx', path,
+                                      self.output]), 1)
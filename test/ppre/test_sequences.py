@@ -0,0 +1,51 @@
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from rawdb.ntr.snd.sseq import SSEQ
+from rawdb.ppre import sequences
+from rawdb.test.sdat_fixture import build_sdat
+
+TRACK = '\x3C\x64\x30' '\xFF'  # One note
+
+
+def build_ssar(data, offsets):
+    data_offset = 0x20+12*len(offsets)
+    header = struct.pack('<4sHHIHH4sIII', 'SSAR', 0xFEFF, 0x100,
+                         data_offset+len(data), 0x10, 1, 'DATA',
+                         data_offset+len(data)-0x10, data_offset,
+                         len(offsets))
+    return header+''.join(struct.pack('<I8x', offset)
+                          for offset in offsets)+data
+
+
+class TestSequences(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, 'out')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def files(self, *parts):
+        return sorted(os.listdir(os.path.join(self.output, *parts)))
+
+    def test_main(self):
+        seq = SSEQ()
+        seq.data = TRACK
+        seq_data = seq.save().getvalue()
+        with open(os.path.join(self.directory, 'sound.sdat'), 'wb') \
+                as handle:
+            handle.write(build_sdat([seq_data, seq_data,
+                                     build_ssar(TRACK*2, [0, 4]), '']))
+        self.assertEqual(sequences.main(['sequences', '-j', '1', '-l', '2',
+                                         self.directory, self.output]), 0)
+        self.assertEqual(self.files('sound'), ['fx', 'intro.mid',
+                                               'town.mid'])
+        self.assertEqual(self.files('sound', 'fx'), ['000.mid', '001.mid'])
+        with open(os.path.join(self.output, 'sound', 'intro.mid'), 'rb') \
+                as handle:
+            self.assertEqual(handle.read(4), 'MThd')
@@ -0,0 +1,41 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rawdb.ntr.snd import swav
+from rawdb.ntr.snd.swar import SWAR
+from rawdb.ppre import sounds
+from rawdb.test.sdat_fixture import build_sdat
+
+
+def build_swar(count):
+    swar = SWAR()
+    for idx in xrange(count):
+        info = swav.WaveInfo()
+        info.format = swav.FORMAT_PCM8
+        info.rate = 8000
+        info.data = chr(idx)*4
+        swar.waves.append(info)
+    return swar.save().getvalue()
+
+
+class TestSounds(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, 'out')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_main(self):
+        path = os.path.join(self.directory, 'sound.sdat')
+        with open(path, 'wb') as handle:
+            handle.write(build_sdat(['', '', '', build_swar(3)]))
+        self.assertEqual(sounds.main(['sounds', '-j', '1', path,
+                                      self.output]), 0)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.output, '0'))),
+                         ['000.wav', '001.wav', '002.wav'])
+        self.assertEqual(sounds.main(['sounds', '-x', path, self.output]),
+                         1)
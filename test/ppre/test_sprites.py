@@ -0,0 +1,128 @@
+
+import array
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from rawdb.ntr.g2d import NCER, NCGR, NCLR
+from rawdb.ntr.g2d.ncer import Cell, CellAttributes
+from rawdb.ntr.g2d.nclr import PLTT
+from rawdb.ntr.narc import NARC
+from rawdb.ppre import sprites
+from rawdb.util.cache import RenderCache
+
+
+def graphics_narc():
+    """NARC of an NCGR, NCLR, NCER and an unknown member"""
+    clr = NCLR()
+    clr.pltt.format = PLTT.FORMAT_16BIT
+    clr.pltt.data = array.array('H', [0]*16)
+    clr.pltt.datasize = 32
+    image = Image.new('RGBA', (16, 16), (255, 0, 0, 255))
+    image.paste((0, 255, 0, 255), (0, 0, 8, 8))
+    cgr = NCGR()
+    cgr.set_image(image, clr)
+    cgr.cpos.loaded = True  # Only set by load()
+    cer = NCER()
+    cell = Cell(0)
+    attr = CellAttributes()
+    attr.size_ = 1
+    attr.x = attr.y = -8
+    cell.attrs = [attr]
+    cell.num = 1
+    cer.cebk.cells = [cell]
+    cer.labl.names = ['cell']
+    narc = NARC()
+    for member in (cgr, clr, cer):
+        narc.add(data=member.save().getvalue())
+    narc.add(data='????')
+    return narc.save().getvalue()
+
+
+class TestPairing(unittest.TestCase):
+    def test_nearest(self):
+        types = ['cgr', 'clr', 'cer', 'cgr', 'scr', None, 'cgr', 'clr',
+                 'cgr']
+        self.assertEqual(sprites.pair_nearest(types), [
+            {'name': '0002', 'cgr': 0, 'clr': 1, 'cer': 2},
+            {'name': '0004', 'cgr': 3, 'clr': 1, 'scr': 4},
+            {'name': '0006', 'cgr': 6, 'clr': 7},
+            {'name': '0008', 'cgr': 8, 'clr': 7},
+        ])
+        self.assertEqual(sprites.pair_nearest(['cgr', 'cer']), [])
+
+    def test_group(self):
+        types = [None, 'cgr', 'clr', 'cer', 'cgr', 'cgr', 'cer', 'cgr',
+                 'clr']
+        rule = {'rule': 'group', 'size': 3, 'start': 1, 'cgr': 0,
+                'clr': 1, 'cer': 2}
+        self.assertEqual(sprites.pair_group(types, rule), [
+            {'name': '0001', 'cgr': 1, 'clr': 2, 'cer': 3}])
+        self.assertEqual(sprites.pair_members(types, rule),
+                         sprites.pair_group(types, rule))
+        with self.assertRaises(ValueError):
+            sprites.pair_members(types, 'group')
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'sprites.narc')
+        with open(self.path, 'wb') as handle:
+            handle.write(graphics_narc())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_atlas_shelves(self):
+        writer = sprites.AtlasWriter(self.directory, 'test', size=16,
+                                     padding=1)
+        for name, (height, width) in zip('abcde', [(4, 6), (6, 6), (3, 4),
+                                                   (10, 8), (20, 2)]):
+            writer.add(name, np.full((height, width, 4), 255, np.uint8))
+        writer.close()
+        with open(os.path.join(self.directory, 'test.json')) as handle:
+            index = json.load(handle)
+        self.assertEqual([(index[name]['page'], index[name]['x'],
+                           index[name]['y']) for name in 'abcde'],
+                         [('test_0.png', 0, 0), ('test_0.png', 7, 0),
+                          ('test_0.png', 0, 7), ('test_1.png', 0, 0),
+                          ('test_2.png', 0, 0)])
+        self.assertEqual(writer.pages, 3)
+        self.assertEqual(Image.open(os.path.join(
+            self.directory, 'test_0.png')).size, (16, 10))
+        self.assertEqual(Image.open(os.path.join(
+            self.directory, 'test_2.png')).size, (2, 20))
+
+    def test_export(self):
+        writer = sprites.AtlasWriter(self.directory, 'sprites')
+        self.assertEqual(sprites.export(self.path, writer, processes=1), 1)
+        with open(os.path.join(self.directory, 'sprites.json')) as handle:
+            index = json.load(handle)
+        self.assertEqual(index.keys(), ['0002_0'])
+        page = Image.open(os.path.join(self.directory, 'sprites_0.png'))
+        self.assertEqual(page.size, (1024, 17))
+        self.assertEqual(page.getpixel((0, 0)), (0, 248, 0, 255))
+        self.assertEqual(page.getpixel((15, 15)), (248, 0, 0, 255))
+
+    def test_export_png(self):
+        cache = os.path.join(self.directory, 'cache')
+        writer = sprites.PNGWriter(self.directory, RenderCache(
+            directory=cache))
+        self.assertEqual(sprites.export(self.path, writer, 'nearest', 1), 1)
+        path = os.path.join(self.directory, '0002_0.png')
+        self.assertEqual(Image.open(path).size, (17, 17))
+        self.assertEqual(len(os.listdir(cache)), 1)
+        with open(path, 'rb') as handle:
+            data = handle.read()
+        os.remove(path)
+        writer = sprites.PNGWriter(self.directory, RenderCache(
+            directory=cache))
+        sprites.export(self.path, writer, 'nearest', 1)
+        with open(path, 'rb') as handle:
+            self.assertEqual(handle.read(), data)
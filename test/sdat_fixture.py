@@ -0,0 +1,74 @@
+
+import struct
+
+
+def align(data, alignment):
+    return data+'\x00'*(-len(data) % alignment)
+
+
+def build_symb():
+    # SEQ names, then one SEQARC with one sequence
+    offsets = [0]*14
+    body = ''
+    base = 0x40
+    offsets[0] = base
+    strings = base+4+8
+    body += struct.pack('<III', 2, strings, strings+6)+'intro\x00town\x00'
+    body = align(body, 4)
+    offsets[1] = base+len(body)
+    name_ofs = offsets[1]+12
+    sub_ofs = name_ofs+8
+    body += struct.pack('<III', 1, name_ofs, sub_ofs)+align('fx\x00', 8)
+    body += struct.pack('<II', 1, sub_ofs+8)+'step\x00'
+    body = align(body, 4)
+    return 'SYMB'+struct.pack('<I14I', 0x40+len(body), *offsets)+body
+
+
+def build_info():
+    offsets = [0]*14
+    body = ''
+    base = 0x40
+    # SEQ
+    offsets[0] = base
+    body += struct.pack('<III', 2, base+12, base+24)
+    body += struct.pack('<HHHBBBBH', 0, 0, 0, 127, 64, 64, 0, 0)
+    body += struct.pack('<HHHBBBBH', 1, 0, 0, 127, 64, 64, 0, 0)
+    # SEQARC
+    offsets[1] = base+len(body)
+    body += struct.pack('<IIHH', 1, offsets[1]+8, 2, 0)
+    # WAVEARC
+    offsets[3] = base+len(body)
+    body += struct.pack('<IIHH', 1, offsets[3]+8, 3, 0)
+    return 'INFO'+struct.pack('<I14I', 0x40+len(body), *offsets)+body
+
+
+def build_sdat(members):
+    """SDAT of SEQ intro and town, SEQARC fx and one WAVEARC
+
+    members are the data of the four files, in that order.
+    """
+    symb = build_symb()
+    info = build_info()
+    symb_ofs = 0x40
+    info_ofs = symb_ofs+len(symb)
+    fat_ofs = info_ofs+len(info)
+    fat_size = 12+16*len(members)
+    file_ofs = fat_ofs+fat_size
+    data = ''
+    fat = ''
+    pos = file_ofs+16
+    for member in members:
+        data += '\x00'*(-pos % 0x20)
+        pos += -pos % 0x20
+        fat += struct.pack('<IIII', pos, len(member), 0, 0)
+        data += member
+        pos += len(member)
+    data += '\x00'*(-pos % 0x20)
+    file_block = 'FILE'+struct.pack('<III', 16+len(data), len(members),
+                                    0)+data
+    fat = 'FAT '+struct.pack('<II', fat_size, len(members))+fat
+    size = file_ofs+len(file_block)
+    header = 'SDAT'+struct.pack(
+        '<HHIHH8I16x', 0xFEFF, 1, size, 0x40, 4, symb_ofs, len(symb),
+        info_ofs, len(info), fat_ofs, fat_size, file_ofs, len(file_block))
+    return header+symb+info+fat+file_block
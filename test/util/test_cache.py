@@ -0,0 +1,96 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rawdb.util.cache import ArchiveCache, RenderCache
+
+
+class TestArchiveCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.loads = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as handle:
+            handle.write(data)
+        return path
+
+    def loader(self, handle):
+        self.loads += 1
+        return handle.read()
+
+    def test_reuse(self):
+        cache = ArchiveCache()
+        path = self.write('a', 'abcd')
+        self.assertEqual(cache.get(path, self.loader), 'abcd')
+        self.assertEqual(cache.get(path, self.loader), 'abcd')
+        self.assertEqual(self.loads, 1)
+
+    def test_invalidate(self):
+        cache = ArchiveCache()
+        path = self.write('a', 'abcd')
+        cache.get(path, self.loader)
+        self.write('a', 'abcdef')
+        self.assertEqual(cache.get(path, self.loader), 'abcdef')
+        self.assertEqual(self.loads, 2)
+
+    def test_update(self):
+        cache = ArchiveCache()
+        path = self.write('a', 'abcd')
+        cache.get(path, self.loader)
+        self.write('a', 'efghij')
+        cache.update(path, 'saved')
+        self.assertEqual(cache.get(path, self.loader), 'saved')
+        self.assertEqual(self.loads, 1)
+
+    def test_eviction(self):
+        cache = ArchiveCache(max_size=8)
+        path_a = self.write('a', 'a'*4)
+        path_b = self.write('b', 'b'*4)
+        path_c = self.write('c', 'c'*4)
+        cache.get(path_a, self.loader)
+        cache.get(path_b, self.loader)
+        cache.get(path_a, self.loader)
+        cache.get(path_c, self.loader)
+        self.assertIn(path_a, cache)
+        self.assertNotIn(path_b, cache)
+        self.assertIn(path_c, cache)
+        self.assertEqual(cache.size, 8)
+
+
+class TestRenderCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.renders = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def render(self):
+        self.renders += 1
+        return 'rendered'
+
+    def test_digest(self):
+        self.assertNotEqual(RenderCache.digest(('ab', 'c')),
+                            RenderCache.digest(('a', 'bc')))
+        self.assertEqual(RenderCache.digest(('a', (1, 2))),
+                         RenderCache.digest(('a', (1, 2))))
+
+    def test_memory(self):
+        cache = RenderCache()
+        self.assertEqual(cache.get(('a', 1), self.render), 'rendered')
+        self.assertEqual(cache.get(('a', 1), self.render), 'rendered')
+        cache.get(('a', 2), self.render)
+        self.assertEqual(self.renders, 2)
+
+    def test_disk(self):
+        RenderCache(directory=self.directory).get(('a', 1), self.render)
+        cache = RenderCache(directory=self.directory)
+        self.assertEqual(cache.get(('a', 1), self.render), 'rendered')
+        self.assertEqual(self.renders, 1)
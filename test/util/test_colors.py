@@ -0,0 +1,20 @@
+
+import unittest
+
+from rawdb.util.colors import BGR555Palette, bgr555_to_rgba, rgba_to_bgr555
+
+
+class TestBGR555(unittest.TestCase):
+    def test_roundtrip(self):
+        data = '\x1f\x00\xe0\x03\x00\x7c\xff\x7f'
+        colors = bgr555_to_rgba(data)
+        self.assertEqual(colors.tolist(), [[248, 0, 0, 255], [0, 248, 0, 255],
+                                           [0, 0, 248, 255],
+                                           [248, 248, 248, 255]])
+        self.assertEqual(rgba_to_bgr555(colors).tostring(), data)
+
+    def test_memoised(self):
+        palette = BGR555Palette()
+        first = palette.rgba('\x1f\x00')
+        self.assertIs(palette.rgba('\x1f\x00'), first)
+        self.assertIsNot(palette.rgba('\x00\x00'), first)
@@ -0,0 +1,112 @@
+
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from rawdb.util import patch
+
+
+class TestPatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rand = random.Random(1)
+        source = ''.join(chr(rand.randrange(256)) for i in xrange(0x30000))
+        # Edits in place, a shifted block, an insertion and a truncation
+        target = source[:0x100]+'edit'+source[0x104:0x8000]
+        target += source[0x10000:0x18000]+'x'*0x300
+        target += source[0x8000:0x2f000]
+        self.source = self.write('source.bin', source)
+        self.target = self.write('target.bin', target)
+        self.expected = target
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as handle:
+            handle.write(data)
+        return path
+
+    def read(self, name):
+        with open(os.path.join(self.directory, name), 'rb') as handle:
+            return handle.read()
+
+    def roundtrip(self, patch_name, processes=1):
+        patch_path = os.path.join(self.directory, patch_name)
+        output = os.path.join(self.directory, 'output.bin')
+        patch.create_patch(self.source, self.target, patch_path, processes)
+        patch.apply_patch(self.source, patch_path, output)
+        self.assertEqual(self.read('output.bin'), self.expected)
+        return os.path.getsize(patch_path)
+
+    def test_bps(self):
+        size = self.roundtrip('a.bps')
+        self.assertLess(size, 0x1000)
+
+    def test_bps_parallel(self):
+        min_segment = patch.MIN_SEGMENT
+        patch.MIN_SEGMENT = 0x1000
+        try:
+            size = self.roundtrip('a.bps', 2)
+        finally:
+            patch.MIN_SEGMENT = min_segment
+        self.assertLess(size, 0x2000)
+
+    def test_ips(self):
+        self.roundtrip('a.ips')
+
+    def test_bps_checksum(self):
+        patch_path = os.path.join(self.directory, 'a.bps')
+        patch.create_bps(self.source, self.target, patch_path, 1)
+        self.write('other.bin', 'other')
+        with self.assertRaises(ValueError):
+            patch.apply_bps(os.path.join(self.directory, 'other.bin'),
+                            patch_path,
+                            os.path.join(self.directory, 'output.bin'))
+
+    def test_numbers(self):
+        for value in (0, 1, 0x7f, 0x80, 0x3fff, 0x4000, 0x123456789):
+            self.assertEqual(
+                patch.decode_number(patch.encode_number(value), 0),
+                (value, len(patch.encode_number(value))))
+
+    def test_index(self):
+        source = self.read('source.bin')
+        index = patch.build_index(source, 128)
+        for ofs in (0, 0x80, 0x2ff80):
+            a, b = patch.weak_checksum(source[ofs:ofs+128])
+            self.assertEqual(index[patch.checksum_key(a, b)], ofs)
+        # Blocks moved to unaligned offsets are found by rolling
+        target = 'ab'+source[0x2003:0x2403]+'junk'+source[0x105:0x505]
+        target_path = self.write('moved.bin', target)
+        actions = list(patch.diff_actions(self.source, target_path, 1))
+        self.assertEqual(actions, [
+            (patch.TARGET_READ, 2, None), (patch.SOURCE_COPY, 0x400, 0x2003),
+            (patch.TARGET_READ, 4, None), (patch.SOURCE_COPY, 0x400, 0x105)])
+
+    def test_close_early(self):
+        min_segment = patch.MIN_SEGMENT
+        patch.MIN_SEGMENT = 0x1000
+        try:
+            actions = patch.diff_actions(self.source, self.target, 2)
+            next(actions)
+            actions.close()
+        finally:
+            patch.MIN_SEGMENT = min_segment
+        self.assertEqual(multiprocessing.active_children(), [])
+
+    def test_main(self):
+        patch_path = os.path.join(self.directory, 'a.bps')
+        output = os.path.join(self.directory, 'output.bin')
+        self.assertEqual(patch.main(['patch', '-j', '1', 'create',
+                                     self.source, self.target, patch_path]),
+                         0)
+        self.assertEqual(patch.main(['patch', 'apply', self.source,
+                                     patch_path, output]), 0)
+        self.assertEqual(self.read('output.bin'), self.expected)
+        self.assertEqual(patch.main(['patch', 'create', self.source]), 1)
+        self.assertEqual(patch.main(['patch', '-j']), 1)
@@ -0,0 +1,59 @@
+
+import unittest
+
+import numpy as np
+
+from rawdb.util import quantize
+
+
+def keys_of(colors):
+    rgba = np.array([[color+(255, ) for color in colors]], dtype=np.uint8)
+    return quantize.color_keys(rgba)
+
+
+class TestQuantize(unittest.TestCase):
+    def test_keys(self):
+        rgba = np.array([[[0xF8, 0, 0, 255], [0, 0, 0xFF, 255],
+                          [1, 2, 3, 0]]], dtype=np.uint8)
+        self.assertEqual(quantize.color_keys(rgba).tolist(),
+                         [[0x1F, 0x7C00, quantize.TRANSPARENT]])
+
+    def test_exact(self):
+        keys = keys_of([(0, 0, 0), (248, 0, 0), (0, 0, 0), (0, 248, 0)])
+        palette = quantize.make_palette(keys, 16)
+        self.assertEqual(palette.tolist(), [0x7FFF, 0, 0x1F, 0x3E0])
+        self.assertEqual(quantize.quantize(keys, palette).tolist(),
+                         [[1, 2, 1, 3]])
+
+    def test_missing(self):
+        keys = keys_of([(248, 0, 0)])
+        with self.assertRaises(ValueError):
+            quantize.quantize(keys, [0, 0x3E0], exact=True)
+        self.assertEqual(quantize.quantize(keys, [0, 0x3E0, 0x1E]).tolist(),
+                         [[2]])
+
+    def test_reduce(self):
+        colors = [(r, g, 0) for r in xrange(0, 256, 16)
+                  for g in xrange(0, 256, 16)]
+        keys = keys_of(colors)
+        palette = quantize.make_palette(keys, 16)
+        self.assertEqual(len(palette), 16)
+        indexes = quantize.quantize(keys, palette)
+        self.assertEqual(indexes.min(), 1)
+        error = np.abs(quantize.key_colors(palette[indexes.ravel()]) -
+                       quantize.key_colors(keys)).mean()
+        self.assertLess(error, 3)
+
+    def test_shared(self):
+        first = keys_of([(8, 0, 0), (16, 0, 0)])
+        second = keys_of([(16, 0, 0), (24, 0, 0)])
+        palette = quantize.make_palette([first, second], 16)
+        self.assertEqual(palette.tolist(), [0x7FFF, 1, 2, 3])
+
+    def test_add_only(self):
+        palette = [0x7FFF, 5, 6, 0, 0, 0]
+        free = quantize.trailing_slots(palette)
+        self.assertEqual(free, [3, 4, 5])
+        keys = keys_of([(0, 0, 0), (8, 0, 0), (40, 0, 0)])
+        palette = quantize.make_palette(keys, 6, palette, free)
+        self.assertEqual(palette.tolist(), [0x7FFF, 5, 6, 0, 1, 0])
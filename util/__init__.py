@@ -3,7 +3,7 @@ import re
 
 from attr import temporary_attr, AttrDict
 from cache import cached_property
-from util.io import BinaryIO
+from util.io import BinaryIO, map_file
 
 
 def lget(lst, idx, default=None):
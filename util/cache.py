@@ -1,4 +1,9 @@
 
+import hashlib
+import os
+from collections import OrderedDict
+
+
 class cached_property(property):
     def __get__(self, instance, owner):
         try:
@@ -12,3 +17,228 @@ class cached_property(property):
             instance._cached_props[self] = super(cached_property,
                                                  self).__get__(instance, owner)
             return instance._cached_props[self]
+
+
+class ArchiveCache(object):
+    """Bounded cache of parsed files keyed by their path
+
+    Entries are validated against the modification time and size of the
+    file on every lookup, so a file changed outside of this cache gets
+    parsed again. Once the total size of the cached files exceeds
+    max_size, the least recently used entries are evicted.
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of source bytes to keep cached
+
+    Attributes
+    ----------
+    size : int
+        Number of source bytes currently cached
+    """
+    def __init__(self, max_size=0x4000000):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()  # path => (stat_key, value)
+
+    @staticmethod
+    def stat_key(path):
+        stat = os.stat(path)
+        return (stat.st_mtime, stat.st_size)
+
+    def get(self, path, loader):
+        """Get the parsed contents of a file
+
+        Parameters
+        ----------
+        path : string
+            Path of the file
+        loader : func(handle)
+            Called with an open handle to parse the file if it is not
+            cached or has changed. The handle is closed after it returns.
+
+        Returns
+        -------
+        value : mixed
+            Result of loader
+        """
+        path = os.path.abspath(path)
+        key = self.stat_key(path)
+        try:
+            entry = self.entries.pop(path)
+        except KeyError:
+            pass
+        else:
+            if entry[0] == key:
+                self.entries[path] = entry
+                return entry[1]
+            self.size -= entry[0][1]
+        with open(path, 'rb') as handle:
+            value = loader(handle)
+        self._store(path, key, value)
+        return value
+
+    def update(self, path, value):
+        """Mark value as the current contents of path
+
+        This should be called after value has been written to path so that
+        the write does not invalidate the entry.
+        """
+        path = os.path.abspath(path)
+        self.discard(path)
+        self._store(path, self.stat_key(path), value)
+
+    def discard(self, path):
+        """Remove a path from the cache if present"""
+        try:
+            entry = self.entries.pop(os.path.abspath(path))
+        except KeyError:
+            return
+        self.size -= entry[0][1]
+
+    def clear(self):
+        """Drop all cached entries"""
+        self.entries.clear()
+        self.size = 0
+
+    def _store(self, path, key, value):
+        self.entries[path] = (key, value)
+        self.size += key[1]
+        # Never evict the newest entry, even if it alone is over budget
+        while self.size > self.max_size and len(self.entries) > 1:
+            old_key, old_value = self.entries.popitem(last=False)[1]
+            self.size -= old_key[1]
+
+    def __contains__(self, path):
+        return os.path.abspath(path) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class LRUCache(object):
+    """Bounded mapping that evicts the least recently used entries
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of entries to keep. If 0, nothing is evicted.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key, factory):
+        """Get the value for key, creating it with factory() if missing"""
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            value = factory()
+            while len(self.entries) >= self.max_entries > 0:
+                self.entries.popitem(last=False)
+        self.entries[key] = value
+        return value
+
+    def clear(self):
+        """Drop all cached entries"""
+        self.entries.clear()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RenderCache(object):
+    """Content addressed cache of rendered file data
+
+    Entries are keyed by a digest of everything the data was rendered from,
+    so they never go stale and need no invalidation. Recent entries are
+    kept in memory. If directory is set, entries are also stored there to
+    be reused by later sessions.
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of entries to keep in memory
+    directory : string or None
+        Directory for the on-disk cache
+    """
+    def __init__(self, max_entries=1024, directory=None):
+        self.memory = LRUCache(max_entries)
+        self.directory = directory
+
+    @staticmethod
+    def digest(parts):
+        """Hash a nested tuple of strings and simple values
+
+        Strings are length prefixed so that different splits of the same
+        bytes do not collide.
+        """
+        sha = hashlib.sha1()
+
+        def update(part):
+            if isinstance(part, (tuple, list)):
+                sha.update('(%d' % len(part))
+                for item in part:
+                    update(item)
+                sha.update(')')
+            elif isinstance(part, str):
+                sha.update('s%d:' % len(part))
+                sha.update(part)
+            else:
+                value = repr(part)
+                sha.update('r%d:' % len(value))
+                sha.update(value)
+        update(parts)
+        return sha.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, parts, render):
+        """Get the rendered data of a source
+
+        Parameters
+        ----------
+        parts : tuple
+            Everything the data depends on, see digest
+        render : func()
+            Returns the data as a string if it is not cached
+
+        Returns
+        -------
+        data : string
+        """
+        key = self.digest(parts)
+        return self.memory.get(key, lambda: self._load(key, render))
+
+    def _load(self, key, render):
+        if self.directory is None:
+            return render()
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as handle:
+                return handle.read()
+        except IOError:
+            pass
+        data = render()
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+        # Written under a temporary name so readers never see partial data
+        temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as handle:
+            handle.write(data)
+        try:
+            os.rename(temp_path, path)
+        except OSError:  # Windows will not replace an existing file
+            os.remove(temp_path)
+        return data
+
+    def clear(self):
+        """Drop all entries kept in memory"""
+        self.memory.clear()
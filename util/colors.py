@@ -1,6 +1,8 @@
 
 import colorsys
 
+import numpy as np
+
 
 def color_gen():
     """Yields unique 32-bit RGBA color tuples each iteration
@@ -36,3 +38,69 @@ def rotate_color(color, degrees=180):
     color = colorsys.hsv_to_rgb(hue/360.0, hsv[1], hsv[2])
     return (int(color[0]*255), int(color[1]*255), int(color[2]*255))\
         + tuple(alpha)
+
+
+def bgr555_to_rgba(data):
+    """Convert BGR555 colors to RGBA
+
+    Parameters
+    ----------
+    data : string or array-like
+        Raw little endian color data or an array of color values
+
+    Returns
+    -------
+    colors : np.ndarray
+        (N, 4) uint8 array. Alpha is always 255
+    """
+    if isinstance(data, basestring):
+        values = np.frombuffer(data[:len(data) & ~1], dtype='<u2')
+    else:
+        values = np.asarray(data, dtype=np.uint16)
+    colors = np.empty((len(values), 4), dtype=np.uint8)
+    colors[:, 0] = (values & 0x1F) << 3
+    colors[:, 1] = ((values >> 5) & 0x1F) << 3
+    colors[:, 2] = ((values >> 10) & 0x1F) << 3
+    colors[:, 3] = 255
+    return colors
+
+
+def rgba_to_bgr555(colors):
+    """Convert RGB[A] colors to BGR555
+
+    Parameters
+    ----------
+    colors : array-like
+        (..., 3) or (..., 4) colors
+
+    Returns
+    -------
+    values : np.ndarray
+        uint16 array of the colors' shape without the last axis
+    """
+    colors = np.asarray(colors, dtype=np.uint16)
+    if not colors.size:
+        return np.zeros(0, dtype=np.uint16)
+    return ((colors[..., 0] >> 3) | ((colors[..., 1] >> 3) << 5) |
+            ((colors[..., 2] >> 3) << 10)).astype(np.uint16)
+
+
+class BGR555Palette(object):
+    """Memoised RGBA conversion of BGR555 color data
+
+    The conversion is only redone when the data differs from the previous
+    call.
+    """
+    def __init__(self):
+        self.source = None
+        self.colors = None
+
+    def rgba(self, data):
+        """Get an (N, 4) read-only uint8 array of the colors in data"""
+        if hasattr(data, 'tostring'):
+            data = data.tostring()
+        if data != self.source:
+            self.colors = bgr555_to_rgba(data)
+            self.colors.flags.writeable = False
+            self.source = data
+        return self.colors
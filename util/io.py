@@ -1,8 +1,9 @@
 
+import mmap
 import struct
 from six import StringIO
 
-__all__ = ['BinaryIO']
+__all__ = ['BinaryIO', 'map_file']
 
 NUL = chr(0)
 
@@ -240,6 +241,17 @@ class BinaryIOAdapter(BinaryIO):
         return self.handle.tell()
 
 
+def map_file(handle):
+    """Map a file read-only. Empty files map to an empty string
+
+    The mapping stays valid after handle is closed.
+    """
+    try:
+        return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        return ''
+
+
 class BoundIO(object):
     """Binds a binary_io to an object so that all of its functions use obj
     directly"""
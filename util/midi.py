@@ -0,0 +1,120 @@
+
+"""Standard MIDI files
+
+Events are added to tracks with absolute times in any order and are
+sorted when the file is written. Note offs sort before other events at
+the same time so that repeated notes do not cut each other off.
+"""
+
+import struct
+
+from util import BinaryIO
+
+META_TEMPO = 0x51
+META_TRACK_NAME = 0x03
+META_END_OF_TRACK = 0x2F
+
+CONTROL_BANK = 0
+CONTROL_MODULATION = 1
+CONTROL_DATA_ENTRY = 6
+CONTROL_VOLUME = 7
+CONTROL_PAN = 10
+CONTROL_EXPRESSION = 11
+CONTROL_RPN_LSB = 100
+CONTROL_RPN_MSB = 101
+
+
+def varlen(value):
+    """Encode a variable length quantity"""
+    data = chr(value & 0x7F)
+    value >>= 7
+    while value:
+        data = chr(0x80 | (value & 0x7F))+data
+        value >>= 7
+    return data
+
+
+class MidiTrack(object):
+    """Events of one track
+
+    Parameters
+    ----------
+    channel : int
+        Channel of channel events, 0 to 15
+    """
+    def __init__(self, channel=0):
+        self.channel = channel & 0xF
+        self.events = []  # (tick, priority, sequence, data)
+
+    def add(self, tick, data, priority=1):
+        self.events.append((tick, priority, len(self.events), data))
+
+    def meta(self, tick, type_, data):
+        self.add(tick, '\xFF'+chr(type_)+varlen(len(data))+data)
+
+    def note(self, tick, key, velocity, duration):
+        self.add(tick, chr(0x90 | self.channel)+chr(key)+chr(velocity))
+        self.add(tick+duration, chr(0x80 | self.channel)+chr(key)+'\x40',
+                 0)
+
+    def control(self, tick, controller, value):
+        self.add(tick, chr(0xB0 | self.channel)+chr(controller) +
+                 chr(min(max(value, 0), 127)))
+
+    def program(self, tick, program):
+        self.add(tick, chr(0xC0 | self.channel)+chr(program & 0x7F))
+
+    def pitch_bend(self, tick, value):
+        """Bend by value, from -0x2000 to 0x1FFF"""
+        value = min(max(value, -0x2000), 0x1FFF)+0x2000
+        self.add(tick, chr(0xE0 | self.channel)+chr(value & 0x7F) +
+                 chr(value >> 7))
+
+    def bend_range(self, tick, semitones):
+        self.control(tick, CONTROL_RPN_MSB, 0)
+        self.control(tick, CONTROL_RPN_LSB, 0)
+        self.control(tick, CONTROL_DATA_ENTRY, semitones)
+
+    def tempo(self, tick, bpm):
+        self.meta(tick, META_TEMPO,
+                  struct.pack('>I', 60000000//max(bpm, 1))[1:])
+
+    def save(self, writer=None):
+        writer = BinaryIO.writer(writer)
+        data = []
+        last = 0
+        for tick, priority, sequence, event in sorted(self.events):
+            data.append(varlen(tick-last))
+            data.append(event)
+            last = tick
+        data.append('\x00\xFF'+chr(META_END_OF_TRACK)+'\x00')
+        data = ''.join(data)
+        writer.write('MTrk'+struct.pack('>I', len(data)))
+        writer.write(data)
+        return writer
+
+
+class MidiFile(object):
+    """Type 1 MIDI file
+
+    Parameters
+    ----------
+    resolution : int
+        Ticks per quarter note
+    """
+    def __init__(self, resolution=48):
+        self.resolution = resolution
+        self.tracks = []
+
+    def add_track(self, channel=0):
+        track = MidiTrack(channel)
+        self.tracks.append(track)
+        return track
+
+    def save(self, writer=None):
+        writer = BinaryIO.writer(writer)
+        writer.write('MThd'+struct.pack('>IHHH', 6, 1, len(self.tracks),
+                                        self.resolution))
+        for track in self.tracks:
+            writer = track.save(writer)
+        return writer
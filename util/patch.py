@@ -0,0 +1,540 @@
+
+"""Binary patches between ROMs
+
+Creates and applies BPS patches without an external binary. The source
+file is indexed by Adler-style checksums of fixed size blocks and the
+target is matched against it in segments across a process pool, with
+both files mapped into memory. The checksum of the target block at each
+offset is rolled on from the previous one, and candidate blocks are
+compared byte for byte before they are used. Unchanged data at the same
+offset, data moved by a constant distance and data found anywhere else
+in the source are encoded as copies; everything else is stored
+literally. CRC32s of the source, target and patch are verified when
+applying.
+
+IPS patches can be created for targets up to 16MB, but only express
+changes at the same offset.
+"""
+
+import multiprocessing
+import struct
+import zlib
+
+import numpy as np
+
+from util import map_file
+
+BPS_MAGIC = 'BPS1'
+SOURCE_READ = 0
+TARGET_READ = 1
+SOURCE_COPY = 2
+TARGET_COPY = 3
+
+IPS_MAGIC = 'PATCH'
+IPS_EOF = 'EOF'
+IPS_MAX_OFFSET = 0xFFFFFF
+IPS_MAX_RECORD = 0xFFFF
+
+MIN_MATCH = 8
+MAX_STEP = 0x100000
+MIN_SEGMENT = 0x100000
+
+
+def crc32(data, crc=0):
+    """CRC32 of a string or mmap, computed in chunks"""
+    for ofs in xrange(0, len(data), MAX_STEP):
+        crc = zlib.crc32(data[ofs:ofs+MAX_STEP], crc)
+    return crc & 0xFFFFFFFF
+
+
+def encode_number(value):
+    """BPS variable length number"""
+    out = ''
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if not value:
+            return out+chr(0x80 | byte)
+        out += chr(byte)
+        value -= 1
+
+
+def decode_number(data, ofs):
+    """Read a BPS variable length number
+
+    Returns
+    -------
+    value : int
+    ofs : int
+        Offset after the number
+    """
+    value = 0
+    shift = 1
+    while True:
+        byte = ord(data[ofs])
+        ofs += 1
+        value += (byte & 0x7F)*shift
+        if byte & 0x80:
+            return value, ofs
+        shift <<= 7
+        value += shift
+
+
+def match_length(a, a_ofs, b, b_ofs, limit):
+    """Length of the common prefix of a[a_ofs:] and b[b_ofs:limit]"""
+    maximum = min(len(a)-a_ofs, limit-b_ofs)
+    length = 0
+    step = MIN_MATCH
+    while length < maximum:
+        size = min(step, maximum-length)
+        if a[a_ofs+length:a_ofs+length+size] == \
+                b[b_ofs+length:b_ofs+length+size]:
+            length += size
+            step = min(step*2, MAX_STEP)
+        elif size == 1:
+            break
+        else:
+            step = size // 2
+    return length
+
+
+class PatchWriter(object):
+    """Writes to a file while tracking the CRC32 of all written data"""
+    def __init__(self, handle):
+        self.handle = handle
+        self.crc = 0
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.handle.write(data)
+
+
+_shared = {}
+
+
+def _init_worker(source_path, target_path, block_size):
+    if _shared.get('key') == (source_path, target_path, block_size):
+        # Inherited from the parent
+        return
+    source_handle = open(source_path, 'rb')
+    target_handle = open(target_path, 'rb')
+    source = map_file(source_handle)
+    _shared.update(key=(source_path, target_path, block_size),
+                   handles=(source_handle, target_handle), source=source,
+                   target=map_file(target_handle), block_size=block_size,
+                   index=build_index(source, block_size))
+
+
+def _close_shared():
+    for handle in _shared.pop('handles', ()):
+        handle.close()
+    for name in ('source', 'target'):
+        data = _shared.pop(name, '')
+        if data:
+            data.close()
+    _shared.clear()
+
+
+def weak_checksum(block):
+    """Adler-style sums of a block
+
+    Returns
+    -------
+    a : int
+        Sum of the bytes
+    b : int
+        Sum of the running sums of the bytes. Together with a, it can be
+        rolled forward one byte at a time.
+    """
+    a = b = 0
+    for byte in bytearray(block):
+        a += byte
+        b += a
+    return a, b
+
+
+def checksum_key(a, b):
+    """Index key of the sums from weak_checksum"""
+    return (a & 0xFFFF) | (b & 0xFFFF) << 16
+
+
+def build_index(source, block_size):
+    """Map checksum keys of aligned source blocks to their first offsets"""
+    index = {}
+    weights = np.arange(block_size, 0, -1, dtype=np.int64)
+    count = len(source)//block_size
+    step = max(MAX_STEP//block_size, 1)
+    for first in xrange(0, count, step):
+        last = min(first+step, count)
+        blocks = np.frombuffer(source[first*block_size:last*block_size],
+                               dtype=np.uint8).reshape(-1, block_size)
+        blocks = blocks.astype(np.int64)
+        keys = (blocks.sum(axis=1) & 0xFFFF) | \
+            (blocks.dot(weights) & 0xFFFF) << 16
+        for idx, key in enumerate(keys.tolist()):
+            index.setdefault(key, (first+idx)*block_size)
+    return index
+
+
+def _diff_segment(segment):
+    """Match target[start:end] against the source
+
+    Returns
+    -------
+    actions : list of (action, length, source offset)
+        source offset is only set for SOURCE_COPY
+    """
+    start, end = segment
+    source = _shared['source']
+    target = _shared['target']
+    index = _shared['index']
+    block_size = _shared['block_size']
+    source_size = len(source)
+    target_size = len(target)
+    actions = []
+    literal = pos = start
+    delta = 0
+    # Offset of the target block that a and b are the sums of
+    summed = None
+    a = b = 0
+    while pos < end:
+        key = target[pos:pos+MIN_MATCH]
+        if source[pos:pos+MIN_MATCH] == key:
+            match = pos
+        elif 0 <= pos+delta < source_size and \
+                source[pos+delta:pos+delta+MIN_MATCH] == key:
+            match = pos+delta
+        elif pos+block_size <= target_size:
+            if summed == pos-1:
+                removed = ord(target[pos-1])
+                a += ord(target[pos+block_size-1])-removed
+                b += a-block_size*removed
+            else:
+                a, b = weak_checksum(target[pos:pos+block_size])
+            summed = pos
+            match = index.get(checksum_key(a, b))
+            if match is not None and source[match:match+block_size] != \
+                    target[pos:pos+block_size]:
+                match = None
+        else:
+            match = None
+        if match is None:
+            pos += 1
+            continue
+        length = match_length(source, match, target, pos, end)
+        if length < MIN_MATCH:
+            pos += 1
+            continue
+        while pos > literal and match > 0 and \
+                source[match-1] == target[pos-1]:
+            pos -= 1
+            match -= 1
+            length += 1
+        if pos > literal:
+            actions.append((TARGET_READ, pos-literal, None))
+        if match == pos:
+            actions.append((SOURCE_READ, length, None))
+        else:
+            actions.append((SOURCE_COPY, length, match))
+        delta = match-pos
+        pos += length
+        literal = pos
+    if end > literal:
+        actions.append((TARGET_READ, end-literal, None))
+    return actions
+
+
+def diff_actions(source_path, target_path, processes=None, block_size=128):
+    """Generate BPS actions describing target in terms of source
+
+    Parameters
+    ----------
+    source_path : string
+    target_path : string
+    processes : int or None
+        Number of worker processes. If None, the number of CPUs is used.
+    block_size : int
+        Size of the source blocks that are indexed. Smaller blocks find
+        more matches but take more memory.
+
+    Returns
+    -------
+    actions : generator of (action, length, source offset)
+        Adjacent actions of the same kind are merged
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    pool = None
+    _init_worker(source_path, target_path, block_size)
+    try:
+        target_size = len(_shared['target'])
+        size = max(MIN_SEGMENT, -(-target_size // max(processes*4, 1)))
+        segments = [(ofs, min(ofs+size, target_size))
+                    for ofs in xrange(0, target_size, size)]
+        if processes > 1 and len(segments) > 1:
+            pool = multiprocessing.Pool(processes, _init_worker,
+                                        (source_path, target_path,
+                                         block_size))
+            results = pool.imap(_diff_segment, segments)
+        else:
+            results = (_diff_segment(segment) for segment in segments)
+        pending = None
+        for actions in results:
+            for action in actions:
+                if pending is None:
+                    pending = action
+                elif action[0] == pending[0] and (
+                        action[0] != SOURCE_COPY or
+                        action[2] == pending[2]+pending[1]):
+                    pending = (pending[0], pending[1]+action[1], pending[2])
+                else:
+                    yield pending
+                    pending = action
+        if pending is not None:
+            yield pending
+        if pool is not None:
+            pool.close()
+            pool.join()
+            pool = None
+    finally:
+        if pool is not None:
+            # The caller stopped early or a segment failed
+            pool.terminate()
+            pool.join()
+        _close_shared()
+
+
+def create_bps(source_path, target_path, patch_path, processes=None,
+               metadata=''):
+    """Write a BPS patch that turns source into target"""
+    with open(source_path, 'rb') as source_handle:
+        with open(target_path, 'rb') as target_handle:
+            source = map_file(source_handle)
+            target = map_file(target_handle)
+            with open(patch_path, 'wb') as handle:
+                writer = PatchWriter(handle)
+                writer.write(BPS_MAGIC)
+                writer.write(encode_number(len(source)))
+                writer.write(encode_number(len(target)))
+                writer.write(encode_number(len(metadata)))
+                writer.write(metadata)
+                pos = 0
+                source_relative = 0
+                for action, length, ofs in diff_actions(
+                        source_path, target_path, processes):
+                    writer.write(encode_number(((length-1) << 2) | action))
+                    if action == TARGET_READ:
+                        for chunk in xrange(pos, pos+length, MAX_STEP):
+                            writer.write(target[chunk:min(chunk+MAX_STEP,
+                                                          pos+length)])
+                    elif action == SOURCE_COPY:
+                        relative = ofs-source_relative
+                        writer.write(encode_number(
+                            (abs(relative) << 1) | (relative < 0)))
+                        source_relative = ofs+length
+                    pos += length
+                writer.write(struct.pack('<II', crc32(source), crc32(target)))
+                writer.write(struct.pack('<I', writer.crc & 0xFFFFFFFF))
+            if source:
+                source.close()
+            if target:
+                target.close()
+
+
+def apply_bps(source_path, patch_path, target_path):
+    """Apply a BPS patch
+
+    Raises
+    ------
+    ValueError
+        If the patch is malformed or any checksum does not match
+    """
+    with open(patch_path, 'rb') as handle:
+        patch = handle.read()
+    if patch[:4] != BPS_MAGIC:
+        raise ValueError('Not a BPS patch')
+    if crc32(patch[:-4]) != struct.unpack('<I', patch[-4:])[0]:
+        raise ValueError('Patch checksum mismatch')
+    source_crc, target_crc = struct.unpack('<II', patch[-12:-4])
+    with open(source_path, 'rb') as source_handle:
+        source = map_file(source_handle)
+        try:
+            source_size, ofs = decode_number(patch, 4)
+            target_size, ofs = decode_number(patch, ofs)
+            metadata_size, ofs = decode_number(patch, ofs)
+            ofs += metadata_size
+            if len(source) != source_size or crc32(source) != source_crc:
+                raise ValueError('Source checksum mismatch')
+            target = bytearray(target_size)
+            pos = source_relative = target_relative = 0
+            end = len(patch)-12
+            while ofs < end:
+                data, ofs = decode_number(patch, ofs)
+                action = data & 3
+                length = (data >> 2)+1
+                if action == SOURCE_READ:
+                    target[pos:pos+length] = source[pos:pos+length]
+                elif action == TARGET_READ:
+                    target[pos:pos+length] = patch[ofs:ofs+length]
+                    ofs += length
+                else:
+                    relative, ofs = decode_number(patch, ofs)
+                    relative = -(relative >> 1) if relative & 1 \
+                        else relative >> 1
+                    if action == SOURCE_COPY:
+                        source_relative += relative
+                        target[pos:pos+length] = \
+                            source[source_relative:source_relative+length]
+                        source_relative += length
+                    else:
+                        target_relative += relative
+                        # May overlap the output, eg for runs
+                        done = 0
+                        if target_relative >= pos:
+                            raise ValueError('Invalid target copy')
+                        while done < length:
+                            size = min(length-done, pos+done-target_relative)
+                            target[pos+done:pos+done+size] = \
+                                target[target_relative:target_relative+size]
+                            target_relative += size
+                            done += size
+                pos += length
+        finally:
+            if source:
+                source.close()
+    if pos != target_size or crc32(buffer(target)) != target_crc:
+        raise ValueError('Target checksum mismatch')
+    with open(target_path, 'wb') as handle:
+        handle.write(target)
+
+
+def create_ips(source_path, target_path, patch_path):
+    """Write an IPS patch that turns source into target
+
+    Raises
+    ------
+    ValueError
+        If target is larger than 16MB
+    """
+    with open(source_path, 'rb') as source_handle:
+        source = source_handle.read()
+    with open(target_path, 'rb') as target_handle:
+        target = target_handle.read()
+    target_size = len(target)
+    if target_size > IPS_MAX_OFFSET+1:
+        raise ValueError('IPS patches cannot exceed 16MB')
+    with open(patch_path, 'wb') as handle:
+        handle.write(IPS_MAGIC)
+        pos = 0
+        while pos < target_size:
+            if pos < len(source):
+                pos += match_length(source, pos, target, pos, target_size)
+            if pos >= target_size:
+                break
+            if struct.pack('>I', pos)[1:] == IPS_EOF:
+                # Would be read as the end marker
+                pos -= 1
+            end = pos+1
+            while end < target_size and end-pos < IPS_MAX_RECORD and (
+                    end >= len(source) or
+                    source[end:end+MIN_MATCH] != target[end:end+MIN_MATCH]):
+                end += 1
+            handle.write(struct.pack('>I', pos)[1:])
+            handle.write(struct.pack('>H', end-pos))
+            handle.write(target[pos:end])
+            pos = end
+        handle.write(IPS_EOF)
+        if target_size < len(source):
+            handle.write(struct.pack('>I', target_size)[1:])
+
+
+def apply_ips(source_path, patch_path, target_path):
+    """Apply an IPS patch
+
+    Raises
+    ------
+    ValueError
+        If the patch is malformed
+    """
+    with open(patch_path, 'rb') as handle:
+        patch = handle.read()
+    if patch[:5] != IPS_MAGIC:
+        raise ValueError('Not an IPS patch')
+    with open(source_path, 'rb') as handle:
+        target = bytearray(handle.read())
+    ofs = 5
+    while True:
+        record = patch[ofs:ofs+3]
+        ofs += 3
+        if record == IPS_EOF:
+            break
+        if len(record) < 3:
+            raise ValueError('Truncated IPS patch')
+        pos = struct.unpack('>I', '\x00'+record)[0]
+        size, = struct.unpack('>H', patch[ofs:ofs+2])
+        ofs += 2
+        if size:
+            data = patch[ofs:ofs+size]
+            ofs += size
+        else:
+            size, = struct.unpack('>H', patch[ofs:ofs+2])
+            data = patch[ofs+2]*size
+            ofs += 3
+        if len(target) < pos:
+            target.extend('\x00'*(pos-len(target)))
+        target[pos:pos+size] = data
+    if len(patch) >= ofs+3:
+        del target[struct.unpack('>I', '\x00'+patch[ofs:ofs+3])[0]:]
+    with open(target_path, 'wb') as handle:
+        handle.write(target)
+
+
+def create_patch(source_path, target_path, patch_path, processes=None):
+    """Write a patch, choosing IPS or BPS by the patch file's extension"""
+    if patch_path.lower().endswith('.ips'):
+        create_ips(source_path, target_path, patch_path)
+    else:
+        create_bps(source_path, target_path, patch_path, processes)
+
+
+def apply_patch(source_path, patch_path, target_path):
+    """Apply an IPS or BPS patch, detected by its header"""
+    with open(patch_path, 'rb') as handle:
+        magic = handle.read(5)
+    if magic == IPS_MAGIC:
+        apply_ips(source_path, patch_path, target_path)
+    else:
+        apply_bps(source_path, patch_path, target_path)
+
+
+def main(argv):
+    from ppre.cli import parse_options
+    try:
+        options, args = parse_options(argv)
+        command, first, second, third = args
+        if command not in ('create', 'apply'):
+            raise ValueError
+    except (ValueError, IndexError):
+        print("""Usage: %s [options] create SOURCE TARGET PATCH
+       %s apply SOURCE PATCH TARGET
+
+    Creates or applies a BPS (or .ips) patch
+
+    OPTIONS
+        -j N --jobs N
+            Number of worker processes. Defaults to the number of CPUs
+        --
+            No further options.
+        """ % (argv[0], argv[0]))
+        return 1
+    if command == 'create':
+        create_patch(first, second, third, options['processes'])
+    else:
+        apply_patch(first, second, third)
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+
+    exit(main(sys.argv))
@@ -0,0 +1,300 @@
+
+"""Palette quantization of RGBA images to BGR555 palettes
+
+Colors are reduced to 15-bit BGR555 keys, so matching colors exactly is a
+lookup in a table of every possible key. Colors that do not fit in a
+palette are reduced with a median cut followed by k-means refinement,
+weighted by how many pixels use each color.
+
+Palettes are arrays of keys. With transparency, index 0 of a palette is
+reserved for transparent pixels and never used for opaque ones.
+"""
+
+import numpy as np
+
+TRANSPARENT = 0x8000
+
+
+def color_keys(rgba, threshold=0x80):
+    """Convert RGBA pixels to BGR555 keys
+
+    Parameters
+    ----------
+    rgba : array-like
+        (..., 4) colors or an RGBA PIL Image
+    threshold : int
+        Pixels with alpha below this are transparent
+
+    Returns
+    -------
+    keys : np.ndarray
+        uint16 array without the last axis. Transparent pixels are
+        TRANSPARENT
+    """
+    rgba = np.asarray(rgba, dtype=np.uint8)
+    keys = (rgba[..., 0] >> 3).astype(np.uint16) | \
+        ((rgba[..., 1] >> 3).astype(np.uint16) << 5) | \
+        ((rgba[..., 2] >> 3).astype(np.uint16) << 10)
+    keys[rgba[..., 3] < threshold] = TRANSPARENT
+    return keys
+
+
+def key_colors(keys):
+    """Split keys into an (N, 3) int32 array of 5-bit components"""
+    keys = np.asarray(keys, dtype=np.int32).ravel()
+    return np.stack([keys & 0x1F, (keys >> 5) & 0x1F, (keys >> 10) & 0x1F],
+                    -1)
+
+
+def nearest(colors, centers):
+    """Find the index of the closest center of each color
+
+    Parameters
+    ----------
+    colors : np.ndarray
+        (N, 3) colors
+    centers : np.ndarray
+        (K, 3) colors, K > 0
+
+    Returns
+    -------
+    indexes : np.ndarray
+        (N, ) indexes into centers
+    """
+    indexes = np.empty(len(colors), dtype=np.intp)
+    centers = np.asarray(centers, dtype=np.float32)
+    # Chunked to bound the size of the distance matrix
+    for start in xrange(0, len(colors), 4096):
+        chunk = colors[start:start+4096].astype(np.float32)
+        distance = ((chunk[:, None, :]-centers[None, :, :])**2).sum(-1)
+        indexes[start:start+4096] = distance.argmin(1)
+    return indexes
+
+
+def median_cut(colors, counts, num):
+    """Split colors into up to num boxes at their weighted medians
+
+    The box with the widest channel range is split each time.
+
+    Parameters
+    ----------
+    colors : np.ndarray
+        (N, 3) distinct colors
+    counts : np.ndarray
+        (N, ) number of pixels of each color
+    num : int
+        Number of boxes
+
+    Returns
+    -------
+    centers : np.ndarray
+        (min(num, N), 3) float weighted mean color of each box
+    """
+    boxes = [np.arange(len(colors))]
+    while len(boxes) < num:
+        best = None
+        best_range = 0
+        for box_id, box in enumerate(boxes):
+            if len(box) < 2:
+                continue
+            extent = colors[box].max(0)-colors[box].min(0)
+            if extent.max() > best_range:
+                best_range = extent.max()
+                best = box_id, extent.argmax()
+        if best is None:
+            break
+        box_id, channel = best
+        box = boxes[box_id]
+        box = box[np.argsort(colors[box, channel], kind='mergesort')]
+        weights = np.cumsum(counts[box])
+        split = np.searchsorted(weights, weights[-1]/2.0)+1
+        split = min(max(split, 1), len(box)-1)
+        boxes[box_id:box_id+1] = [box[:split], box[split:]]
+    return np.array([np.average(colors[box], 0, counts[box])
+                     for box in boxes]).reshape(-1, 3)
+
+
+def kmeans(colors, counts, centers, fixed=0, iterations=8):
+    """Refine centers with weighted k-means
+
+    Parameters
+    ----------
+    colors : np.ndarray
+        (N, 3) distinct colors
+    counts : np.ndarray
+        (N, ) number of pixels of each color
+    centers : np.ndarray
+        (K, 3) initial centers
+    fixed : int
+        Number of leading centers that do not move
+    iterations : int
+        Maximum number of iterations
+
+    Returns
+    -------
+    centers : np.ndarray
+        (K, 3) int32 5-bit colors
+    """
+    centers = np.array(centers, dtype=np.float64)
+    num = len(centers)
+    for unused in xrange(iterations):
+        assigned = nearest(colors, centers)
+        totals = np.bincount(assigned, counts, num)
+        moving = totals > 0
+        moving[:fixed] = False
+        if not moving.any():
+            break
+        new_centers = centers.copy()
+        for channel in xrange(3):
+            sums = np.bincount(assigned, counts*colors[:, channel], num)
+            new_centers[moving, channel] = sums[moving]/totals[moving]
+        if np.allclose(new_centers, centers, atol=0.01):
+            break
+        centers = new_centers
+    return np.clip(np.rint(centers), 0, 31).astype(np.int32)
+
+
+def histogram(keys):
+    """Get the distinct opaque keys of one or more images
+
+    Parameters
+    ----------
+    keys : np.ndarray or list of np.ndarray
+        Keys as from color_keys
+
+    Returns
+    -------
+    distinct : np.ndarray
+        Distinct keys in order of first appearance
+    counts : np.ndarray
+        Number of pixels of each key
+    """
+    if isinstance(keys, (list, tuple)):
+        keys = np.concatenate([np.asarray(image).ravel() for image in keys]
+                              or [np.zeros(0, dtype=np.uint16)])
+    keys = np.asarray(keys, dtype=np.uint16).ravel()
+    keys = keys[keys != TRANSPARENT]
+    distinct, first, counts = np.unique(keys, return_index=True,
+                                        return_counts=True)
+    order = np.argsort(first, kind='mergesort')
+    return distinct[order], counts[order]
+
+
+def trailing_slots(palette):
+    """Get the indexes of unused entries at the end of a palette
+
+    The trailing run of entries repeating the last color (after index 0)
+    is treated as unused.
+    """
+    palette = np.asarray(palette)
+    end = len(palette)
+    start = end-1
+    while start > 1 and palette[start-1] == palette[end-1]:
+        start -= 1
+    return range(max(start, 1), end)
+
+
+def make_palette(keys, num_colors, palette=None, free=None,
+                 transparent=True):
+    """Create or extend a palette so it can represent one or more images
+
+    When the new colors fit, they are added in order of first appearance.
+    Otherwise they are quantized while keeping the existing colors.
+
+    Parameters
+    ----------
+    keys : np.ndarray or list of np.ndarray
+        Keys of the images. A list gets one palette shared by all of them
+    num_colors : int
+        Maximum palette size
+    palette : array-like or None
+        Existing palette keys to extend. If None, a new palette is made
+    free : list of int or None
+        Indexes of existing entries that may be replaced. Entries matching
+        a color of the images stay in use
+    transparent : bool
+        If set, index 0 is reserved for transparent pixels
+
+    Returns
+    -------
+    palette : np.ndarray
+        uint16 keys
+    """
+    if palette is None:
+        palette = [0x7FFF] if transparent else []
+    palette = list(np.asarray(palette, dtype=np.uint16)[:num_colors])
+    free = list(free or [])
+    distinct, counts = histogram(keys)
+    start = 1 if transparent else 0
+    used = set(palette[index] for index in xrange(start, len(palette))
+               if index not in free)
+    for index in list(free):
+        if palette[index] not in used and palette[index] in distinct:
+            used.add(palette[index])
+            free.remove(index)
+    is_new = ~np.in1d(distinct, list(used))
+    new = distinct[is_new]
+    capacity = len(free)+num_colors-len(palette)
+    if len(new) > capacity:
+        fixed = [palette[index] for index in xrange(start, len(palette))
+                 if index not in free]
+        if capacity <= 0:
+            new = []
+        else:
+            colors = key_colors(distinct)
+            centers = median_cut(colors[is_new], counts[is_new], capacity)
+            centers = kmeans(colors, counts,
+                             np.concatenate([key_colors(fixed), centers]),
+                             len(fixed))[len(fixed):]
+            new = np.unique(centers[:, 0] | (centers[:, 1] << 5) |
+                            (centers[:, 2] << 10))
+            new = [key for key in new if key not in used]
+    for key in new:
+        if free:
+            palette[free.pop(0)] = key
+        else:
+            palette.append(key)
+    return np.array(palette, dtype=np.uint16)
+
+
+def quantize(keys, palette, exact=False, transparent=True):
+    """Map keys to palette indexes
+
+    Exact colors map to their first entry. Others map to the closest color.
+
+    Parameters
+    ----------
+    keys : np.ndarray
+        Keys as from color_keys
+    palette : array-like
+        Palette keys
+    exact : bool
+        If set, colors missing from the palette raise a ValueError
+    transparent : bool
+        If set, transparent pixels map to index 0 and opaque ones never do
+
+    Returns
+    -------
+    indexes : np.ndarray
+        uint8 array of the shape of keys
+    """
+    palette = np.asarray(palette, dtype=np.uint16) & 0x7FFF
+    start = 1 if transparent else 0
+    lut = np.full(TRANSPARENT+1, -1, dtype=np.int16)
+    # Assigned in reverse so the first entry of a repeated color wins
+    entries = np.arange(len(palette)-1, start-1, -1)
+    lut[palette[entries]] = entries
+    lut[TRANSPARENT] = 0
+    indexes = lut[keys]
+    missing = indexes < 0
+    if missing.any():
+        if exact:
+            raise ValueError('Some colors do not exist in current palette')
+        missing_keys = np.unique(keys[missing])
+        if len(palette) > start:
+            lut[missing_keys] = nearest(key_colors(missing_keys),
+                                        key_colors(palette[start:]))+start
+        else:
+            lut[missing_keys] = 0
+        indexes = lut[keys]
+    return indexes.astype(np.uint8)
@@ -113,6 +113,30 @@ class GitControl(object):
                 entry.changes += line+'\n'
         return entries
 
+    def structured_diff(self, version='HEAD', new_version=None, game=None):
+        """Get record-level changes between version1 and version2
+
+        Unlike diff, this does not depend on narcinfo. Archives are compared
+        member by member and records are compared field by field.
+
+        Parameters
+        ----------
+        version : string
+            Old version
+        new_version : string or None
+            New version. If None, new_version refers to the working tree
+        game : Game or None
+            Game used to decode records. If None, it is loaded from the
+            directory
+
+        Returns
+        -------
+        changes : generator of ppre.diff.Change
+        """
+        from ppre.diff import diff_revisions
+
+        return diff_revisions(self, version, new_version, game)
+
     def call(self, command, *args):
         """Invokes the git command with the supplied arguments
 
@@ -1,5 +1,7 @@
 import os, subprocess
 
+from util import patch
+
 if os.name == "nt":
     binary = "bin/xdelta3.exe"
 else:
@@ -7,9 +9,16 @@ else:
     if not os.path.exists(binary):
         binary = "xdelta3"
 
+def isNative(patchname):
+    return os.path.splitext(str(patchname))[1].lower() in (".bps", ".ips")
+
 def makePatch(patchname, fname1, fname2):
+    if isNative(patchname):
+        return patch.create_patch(str(fname1), str(fname2), str(patchname))
     subprocess.call([binary, "-e", "-s", fname1, fname2, patchname])
     
 def applyPatch(patchname, fname1, fname2):
+    if isNative(patchname):
+        return patch.apply_patch(str(fname1), str(patchname), str(fname2))
     subprocess.call([binary, "-d", "-s", fname1, patchname, fname2])
     
\ No newline at end of file
@@ -124,7 +124,8 @@ class MainWindow(QMainWindow):
         self.projectinfo["project_output_value"].setText(ndsFile)
     def openPatch(self):
         patchFile = QFileDialog.getOpenFileName(None, "Open Patch File", 
-            filter="xdelta3 Patch Files (*.xdelta3);;All Files (*.*)")
+            filter="BPS Patch Files (*.bps);;IPS Patch Files (*.ips);;"
+            "xdelta3 Patch Files (*.xdelta3);;All Files (*.*)")
         if not patchFile:
             return
         self.projectinfo["patch_value"].setText(patchFile)